@@ -0,0 +1,147 @@
+"""
+Barrido poblacional de alertas: aplica las reglas de alerta del motor
+compilado (las mismas de generar_plan_cientifico) a columnas completas de
+clinical_records con máscaras NumPy y materializa la lista de trabajo en
+clinical_alerts. Es incremental: solo procesa registros con id mayor que la marca de agua.
+
+Uso por línea de comandos:
+    python alertas.py [--lote 50000]
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from database import AppDatabase, DB_PATH
+from motor import ParametroCategorico, motor_reglas
+
+MARCA = "alertas"
+LOTE = 50_000
+COLUMNAS = ["id", "px_id", "px_name", "date", "doctor"]
+SQL_INSERTAR = """INSERT INTO clinical_alerts
+    (record_id, px_id, px_name, date, doctor, codigo, alerta, valor, detectada)
+    VALUES (?,?,?,?,?,?,?,?,?)
+    ON CONFLICT (record_id, codigo) DO UPDATE SET alerta = excluded.alerta, valor = excluded.valor,
+        detectada = excluded.detectada"""
+
+def evaluar_alertas_lote(df, motor=None):
+    """
+    Evalúa todas las reglas de alerta sobre un DataFrame de registros usando
+    los segmentos compilados del motor (np.searchsorted en vez de bisect).
+    Devuelve un DataFrame largo (posición de fila, código, alerta, valor),
+    ordenado como lo haría generar_plan_cientifico fila por fila.
+    Valores faltantes (NaN) nunca disparan alerta.
+    """
+    motor = motor or motor_reglas()
+    # Arreglos vacíos de partida: una tabla sin reglas de alerta devuelve un resultado vacío
+    filas, ordenes, valores = [np.empty(0, dtype=np.intp)], [np.empty(0, dtype=np.intp)], [np.empty(0)]
+    segmentos = {}
+    for orden, (codigo, parametro, texto) in enumerate(motor.alertas):
+        p = motor.por_nombre[parametro]
+        if isinstance(p, ParametroCategorico):
+            idx = np.flatnonzero(df[parametro].isin(list(p.alertas[codigo])).to_numpy())
+            v = np.full(len(df), np.nan)
+        else:
+            if parametro not in segmentos:
+                v = pd.to_numeric(df[parametro], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+                segmentos[parametro] = (v, p.segmentos_np(v))
+            v, seg = segmentos[parametro]
+            idx = np.flatnonzero(np.isin(seg, list(p.alertas[codigo])) & ~np.isnan(v))
+        filas.append(idx)
+        ordenes.append(np.full(len(idx), orden))
+        valores.append(v[idx])
+
+    fila = np.concatenate(filas)
+    orden = np.concatenate(ordenes)
+    # Orden estable por (fila, regla) = mismo orden que la evaluación escalar
+    perm = np.lexsort((orden, fila))
+    orden = orden[perm]
+    return pd.DataFrame({
+        "fila": fila[perm],
+        "codigo": np.array([a[0] for a in motor.alertas], dtype=object)[orden],
+        "alerta": np.array([a[2] for a in motor.alertas], dtype=object)[orden],
+        "valor": np.concatenate(valores)[perm],
+    })
+
+def _columnas(motor):
+    return COLUMNAS + list(dict.fromkeys(parametro for _, parametro, _ in motor.alertas))
+
+def _filas_alerta(df, resultado, detectada):
+    registros = df.iloc[resultado["fila"].to_numpy()]
+    return list(zip(
+        registros["id"].astype(int).tolist(),
+        registros["px_id"].tolist(),
+        registros["px_name"].tolist(),
+        registros["date"].tolist(),
+        registros["doctor"].tolist(),
+        resultado["codigo"].tolist(),
+        resultado["alerta"].tolist(),
+        resultado["valor"].astype(float).tolist(),
+        [detectada] * len(resultado),
+    ))
+
+def barrer_alertas(db, lote=LOTE):
+    """
+    Evalúa los registros nuevos desde la marca de agua en bloques de `lote`.
+    Cada bloque se confirma junto con el avance de la marca, de modo que un
+    barrido interrumpido continúa donde quedó. Devuelve (registros, alertas).
+    """
+    ultimo = db.marca_agua(MARCA)
+    total_registros = total_alertas = 0
+    while True:
+        motor = motor_reglas()
+        df = db.leer_df(
+            f"SELECT {', '.join(_columnas(motor))} FROM clinical_records WHERE id > ? ORDER BY id LIMIT ?",
+            [ultimo, lote])
+        if df.empty:
+            return total_registros, total_alertas
+
+        resultado = evaluar_alertas_lote(df, motor)
+        filas = _filas_alerta(df, resultado, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        ultimo = int(df["id"].iloc[-1])
+        with db.transaccion() as conn:
+            conn.executemany(SQL_INSERTAR, filas)
+            db.fijar_marca_agua(conn, MARCA, ultimo)
+        total_registros += len(df)
+        total_alertas += len(filas)
+
+def reevaluar_registros(db, ids):
+    """
+    Recalcula las alertas de registros ya barridos cuyos valores cambiaron
+    (p. ej. al incorporar resultados de laboratorio).
+    """
+    ids = [int(i) for i in ids]
+    if not ids:
+        return 0
+    marcas = ", ".join("?" * len(ids))
+    motor = motor_reglas()
+    df = db.leer_df(f"SELECT {', '.join(_columnas(motor))} FROM clinical_records WHERE id IN ({marcas})", ids)
+    resultado = evaluar_alertas_lote(df, motor)
+    filas = _filas_alerta(df, resultado, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    with db.transaccion() as conn:
+        conn.execute(f"DELETE FROM clinical_alerts WHERE record_id IN ({marcas})", ids)
+        conn.executemany(SQL_INSERTAR, filas)
+    return len(filas)
+
+def pacientes_en_alerta(db, codigo=None, limite=500):
+    """
+    Lista de trabajo: alertas de la visita más reciente de cada paciente,
+    es decir, pacientes que hoy están en estado crítico.
+    """
+    filtro, params = "", []
+    if codigo:
+        filtro = " AND a.codigo = ?"
+        params.append(codigo)
+    return db.leer_df(f"""SELECT a.px_id, a.px_name, a.date, a.doctor, a.codigo, a.alerta, a.valor, a.record_id
+        FROM clinical_alerts a
+        WHERE a.record_id = (SELECT r.id FROM clinical_records r WHERE r.px_id = a.px_id
+                             ORDER BY r.date DESC, r.id DESC LIMIT 1){filtro}
+        ORDER BY a.date DESC, a.record_id DESC LIMIT ?""", params + [int(limite)],
+        tablas=("clinical_alerts", "clinical_records"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Barrido incremental de alertas clínicas")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--lote", type=int, default=LOTE)
+    args = parser.parse_args()
+    n_reg, n_alertas = barrer_alertas(AppDatabase(args.db), args.lote)
+    print(f"{n_reg} registros evaluados, {n_alertas} alertas")
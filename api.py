@@ -0,0 +1,304 @@
+"""
+API HTTP (ASGI, Starlette) para integraciones sin navegador: motor de
+recomendaciones, riesgo ERC, historial y reporte PDF. Los handlers son
+asíncronos; la evaluación y los PDF (CPU-bound) corren en un pool acotado de
+procesos, y el lote se reparte en bloques entre los procesos.
+
+Autenticación HTTP Basic con los usuarios del sistema (autenticacion.py, con
+el mismo limitador de intentos); las credenciales verificadas se recuerdan
+unos minutos para no pagar bcrypt en cada petición, mientras la tabla users
+no cambie (desactivar un usuario o cambiar su contraseña las invalida).
+
+Endpoints:
+    GET  /salud
+    POST /evaluar                  {"tfg": 42, "fevi": 38, ...}
+    POST /evaluar/lote             {"pacientes": [{...}, ...]}
+    POST /reporte                  {"px_name": ..., "px_id": ..., "tfg": ..., ...} -> application/pdf
+    GET  /historial?texto=...&cursor_fecha=...&cursor_id=...&tamano=50
+    GET  /pacientes/{px_id}/consultas
+
+Uso por línea de comandos:
+    python api.py [--host 127.0.0.1] [--puerto 8000] [--procesos 4]
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date
+import numpy as np
+import pandas as pd
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from autenticacion import autenticador
+from database import AppDatabase, DB_PATH, HISTORIAL_COLUMNAS
+from importacion import validar_clinicos
+from motor import generar_plan_cientifico, motor_reglas, pdf_reporte
+from procesos import EN_VUELO_POR_PROCESO, pool_spawn, procesos_por_defecto
+from registro_modelos import modelo_activo
+from riesgo import VARIABLES, puntuar_lote
+
+PROCESOS = procesos_por_defecto()
+BLOQUE = 500  # pacientes por tarea del pool
+LOTE_MAX = 20_000
+HISTORIAL_PAGINA_MAX = 500
+CREDENCIALES_TTL_S = 300
+CREDENCIALES_MAX = 10_000
+
+# =============================================
+# TRABAJO CPU-BOUND (corre en los procesos del pool)
+# =============================================
+def _paciente(crudo):
+    if not isinstance(crudo, dict):
+        raise ValueError("cada paciente debe ser un objeto JSON")
+    d = validar_clinicos(crudo)
+    for campo in ("px_name", "px_id", "date"):
+        if crudo.get(campo) is not None:
+            d[campo] = str(crudo[campo]).strip()
+    return d
+
+def _evaluar_bloque(pacientes):
+    """[payload, ...] -> [resultado | {"error": motivo}, ...] en el mismo orden"""
+    validos, salida = [], []
+    for crudo in pacientes:
+        try:
+            validos.append(_paciente(crudo))
+            salida.append(None)
+        except ValueError as e:
+            salida.append({"error": str(e)})
+    if validos:
+        # Riesgo vectorizado para todo el bloque; las reglas, paciente por paciente
+        riesgos, version = puntuar_lote(pd.DataFrame(validos).reindex(columns=list(VARIABLES.values())))
+        resultados = iter(zip(validos, riesgos))
+        for i, r in enumerate(salida):
+            if r is None:
+                d, riesgo = next(resultados)
+                recoms, alertas = generar_plan_cientifico(d)
+                salida[i] = {"recomendaciones": recoms, "alertas": alertas,
+                             "riesgo_erc": None if np.isnan(riesgo) else float(riesgo),
+                             "riesgo_modelo": None if np.isnan(riesgo) else version}
+    return salida
+
+def _reporte(crudo, medico):
+    d = _paciente(crudo)
+    faltan = [c for c in ("px_name", "px_id") if not d.get(c)]
+    if faltan:
+        raise ValueError(f"faltan campos obligatorios: {', '.join(faltan)}")
+    recoms, alertas = generar_plan_cientifico(d)
+    # Sin fecha de consulta se usa la de hoy: entra en la clave de la caché, así que no queda un día atrasada
+    return pdf_reporte(d, recoms, alertas, medico, d.get("date") or date.today().isoformat())
+
+# =============================================
+# ESTADO DEL SERVICIO
+# =============================================
+class Credenciales:
+    """
+    Usuarios ya verificados con bcrypt, por huella de usuario+contraseña, con
+    vencimiento y sellados con la versión de escritura de users: cualquier
+    cambio en la tabla obliga a verificar de nuevo.
+    """
+    def __init__(self, ttl_s=CREDENCIALES_TTL_S, maximo=CREDENCIALES_MAX):
+        self.ttl_s = ttl_s
+        self.maximo = maximo
+        self._sal = os.urandom(16)
+        self._vigentes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def huella(self, usuario, password):
+        return hashlib.sha256(self._sal + usuario.encode() + b"\0" + password.encode()).digest()
+
+    def obtener(self, huella, version):
+        with self._lock:
+            entrada = self._vigentes.get(huella)
+            if entrada and entrada[1] > time.monotonic() and entrada[2] == version:
+                return entrada[0]
+            self._vigentes.pop(huella, None)
+            return None
+
+    def guardar(self, huella, usuario, version):
+        with self._lock:
+            self._vigentes[huella] = (usuario, time.monotonic() + self.ttl_s, version)
+            self._vigentes.move_to_end(huella)
+            while len(self._vigentes) > self.maximo:
+                self._vigentes.popitem(last=False)
+
+class ErrorHTTP(Exception):
+    def __init__(self, estado, mensaje, encabezados=None):
+        super().__init__(mensaje)
+        self.estado = estado
+        self.encabezados = encabezados
+
+async def _usuario(request):
+    """(username, name, role) del encabezado Authorization: Basic; ErrorHTTP si no es válido"""
+    esquema, _, token = request.headers.get("authorization", "").partition(" ")
+    try:
+        usuario, separador, password = base64.b64decode(token).decode().partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        separador = ""
+    if esquema.lower() != "basic" or not separador:
+        raise ErrorHTTP(401, "Se requiere autenticación", {"WWW-Authenticate": 'Basic realm="NefroCardio"'})
+
+    credenciales = request.app.state.credenciales
+    db = request.app.state.db
+    huella = credenciales.huella(usuario, password)
+    # Versión leída antes de verificar: un cambio durante bcrypt no queda sellado como vigente
+    version = await run_in_threadpool(db.version_tabla, "users")
+    datos = credenciales.obtener(huella, version)
+    if datos is None:
+        origen = request.client.host if request.client else None
+        try:
+            res = await run_in_threadpool(autenticador.verificar, db, usuario, password, origen)
+        except ValueError as e:
+            raise ErrorHTTP(429, str(e)) from None
+        if not res:
+            db.log_action(usuario or "Desconocido", "Login Fallido", f"API | Origen: {origen}")
+            raise ErrorHTTP(401, "Credenciales inválidas o usuario inactivo",
+                            {"WWW-Authenticate": 'Basic realm="NefroCardio"'})
+        datos = (usuario, *res)
+        credenciales.guardar(huella, datos, version)
+    return datos
+
+async def _cuerpo(request):
+    try:
+        return await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ErrorHTTP(400, "El cuerpo debe ser JSON válido") from None
+
+async def _en_pool(request, fn, *args):
+    """Ejecuta fn en el pool de procesos; como mucho EN_VUELO_POR_PROCESO tareas por proceso en vuelo"""
+    estado = request.app.state
+    async with estado.cupos:
+        return await asyncio.get_running_loop().run_in_executor(estado.pool, fn, *args)
+
+def _manejar(handler):
+    """Traduce ErrorHTTP / ValueError a respuestas JSON con el código correspondiente"""
+    async def envoltura(request):
+        try:
+            return await handler(request)
+        except ErrorHTTP as e:
+            return JSONResponse({"error": str(e)}, status_code=e.estado, headers=e.encabezados)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+    return envoltura
+
+# =============================================
+# ENDPOINTS
+# =============================================
+async def salud(request):
+    return JSONResponse({"estado": "ok", "reglas": motor_reglas().version, "modelo": modelo_activo().version})
+
+async def evaluar(request):
+    await _usuario(request)
+    paciente = await _cuerpo(request)
+    resultado = (await _en_pool(request, _evaluar_bloque, [paciente]))[0]
+    if "error" in resultado:
+        raise ValueError(resultado["error"])
+    return JSONResponse(resultado)
+
+async def evaluar_lote(request):
+    usuario = await _usuario(request)
+    cuerpo = await _cuerpo(request)
+    pacientes = cuerpo.get("pacientes") if isinstance(cuerpo, dict) else cuerpo
+    if not isinstance(pacientes, list):
+        raise ValueError("Se espera {\"pacientes\": [...]} o una lista de pacientes")
+    if len(pacientes) > LOTE_MAX:
+        raise ErrorHTTP(413, f"Máximo {LOTE_MAX} pacientes por petición")
+
+    bloques = [pacientes[i:i + BLOQUE] for i in range(0, len(pacientes), BLOQUE)]
+    partes = await asyncio.gather(*(_en_pool(request, _evaluar_bloque, b) for b in bloques))
+    resultados = [r for parte in partes for r in parte]
+    errores = sum("error" in r for r in resultados)
+    request.app.state.db.log_action(usuario[0], "API Evaluación Lote",
+                                    f"Pacientes: {len(resultados)} | Con error: {errores}")
+    return JSONResponse({"resultados": resultados, "errores": errores})
+
+async def reporte(request):
+    usuario = await _usuario(request)
+    paciente = await _cuerpo(request)
+    if not isinstance(paciente, dict):
+        raise ValueError("Se espera un objeto JSON con los datos del paciente")
+    medico = paciente.get("medico") or usuario[1]
+    pdf = await _en_pool(request, _reporte, paciente, medico)
+    request.app.state.db.log_action(usuario[0], "API Reporte PDF",
+                                    f"Paciente: {paciente.get('px_name')} ({paciente.get('px_id')})")
+    return Response(pdf, media_type="application/pdf",
+                    headers={"Content-Disposition": f'attachment; filename="Reporte_Cardiorrenal_{paciente.get("px_id")}.pdf"'})
+
+def _json_df(df):
+    """JSON de un DataFrame (NaN -> null) sin pasar por objetos Python fila a fila"""
+    # float32 (compactar) tiene ~7 cifras: se redondea para no exponer 4.0999999046 en vez de 4.1
+    df = df.astype({c: "float64" for c in df.columns if df[c].dtype == np.float32})
+    df = df.round({c: 6 for c in df.columns if df[c].dtype == np.float64})
+    return df.to_json(orient="records", force_ascii=False, date_format="iso")
+
+async def historial(request):
+    usuario = await _usuario(request)
+    p = request.query_params
+    try:
+        tamano = min(int(p.get("tamano", 50)), HISTORIAL_PAGINA_MAX)
+        cursor = (p["cursor_fecha"], int(p["cursor_id"])) if p.get("cursor_fecha") else None
+    except (KeyError, ValueError):
+        raise ValueError("tamano y cursor_id deben ser enteros; cursor_fecha requiere cursor_id") from None
+    texto = p.get("texto") or None
+    db = request.app.state.db
+    df, siguiente = await run_in_threadpool(db.pagina_historial, texto, cursor, max(tamano, 1))
+    db.log_action(usuario[0], "API Historial", f"Búsqueda: {texto or '(todos)'} | Registros: {len(df)}")
+    return Response(f'{{"registros": {_json_df(df)}, "siguiente": {json.dumps(siguiente)}}}',
+                    media_type="application/json")
+
+async def consultas_paciente(request):
+    usuario = await _usuario(request)
+    px_id = request.path_params["px_id"]
+    db = request.app.state.db
+    columnas = ", ".join(HISTORIAL_COLUMNAS + ["riesgo_erc", "riesgo_modelo"])
+    df = await run_in_threadpool(
+        db.leer_df, f"SELECT {columnas} FROM clinical_records WHERE px_id = ? ORDER BY date, id",
+        [px_id], ("clinical_records",))
+    db.log_action(usuario[0], "API Consultas Paciente", f"Paciente: {px_id} | Registros: {len(df)}")
+    return Response(f'{{"px_id": {json.dumps(px_id)}, "consultas": {_json_df(df)}}}',
+                    media_type="application/json")
+
+# =============================================
+# APLICACIÓN
+# =============================================
+def crear_app(db_path=DB_PATH, procesos=PROCESOS):
+    @asynccontextmanager
+    async def ciclo_de_vida(app):
+        app.state.db = AppDatabase(db_path)
+        app.state.credenciales = Credenciales()
+        app.state.pool = pool_spawn(procesos, motor_reglas)
+        app.state.cupos = asyncio.Semaphore(EN_VUELO_POR_PROCESO * procesos)
+        try:
+            yield
+        finally:
+            app.state.pool.shutdown(cancel_futures=True)
+            app.state.db.cerrar()
+
+    return Starlette(routes=[
+        Route("/salud", salud),
+        Route("/evaluar", _manejar(evaluar), methods=["POST"]),
+        Route("/evaluar/lote", _manejar(evaluar_lote), methods=["POST"]),
+        Route("/reporte", _manejar(reporte), methods=["POST"]),
+        Route("/historial", _manejar(historial)),
+        Route("/pacientes/{px_id}/consultas", _manejar(consultas_paciente)),
+    ], lifespan=ciclo_de_vida)
+
+app = crear_app()
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="API HTTP de NefroCardio")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8000)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--procesos", type=int, default=PROCESOS)
+    args = parser.parse_args()
+    uvicorn.run(crear_app(args.db, args.procesos), host=args.host, port=args.puerto)
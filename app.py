@@ -1,277 +1,120 @@
 import pandas as pd
 import sqlite3
-import bcrypt
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
-from fpdf import FPDF
+from datetime import datetime, timedelta
 import io
+import os
+import shutil
+import tempfile
+from database import AppDatabase
+from autenticacion import autenticador
+from motor import generar_plan_cientifico, motor_reglas, pdf_reporte
+from graficos import clasificacion_kdigo, estado_cardiaco, figuras_resultado
+from alertas import MARCA as MARCA_ALERTAS, barrer_alertas, pacientes_en_alerta, reevaluar_registros
+from riesgo import puntuar
+from registro_modelos import activar, modelo_activo, versiones
+from archivo_auditoria import RETENCION_DIAS, archivar, consultar_auditoria, segmentos
+from importacion import importar
+from exportacion import FORMATOS, bloques_auditoria, exportar_temporal
+from reportes_lote import contar as contar_reportes, generar_zip_subproceso
+from longitudinal import pacientes_en_descenso, resumen_paciente, resumenes
+from pronostico import proyeccion_paciente, proyectados_g4
+from tablero import medicos as medicos_tablero, tablero
+from espejo import estado as estado_espejo, historial as bloques_historial, sincronizar as sincronizar_espejo
 
 # =============================================
 # 1. CONFIGURACIÓN Y BASE DE DATOS
 # =============================================
 st.set_page_config(page_title="NefroCardio Pro SaaS", page_icon="⚖️", layout="wide")
 
-class AppDatabase:
-    def __init__(self):
-        self.conn = sqlite3.connect("nefrocardio_v2026.db", check_same_thread=False)
-        self.init_db()
+@st.cache_resource
+def get_db():
+    """Una sola instancia por proceso: las migraciones corren una vez por despliegue"""
+    return AppDatabase()
 
-    def init_db(self):
-        c = self.conn.cursor()
-        
-        # Crear tabla de usuarios
-        c.execute("""CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY, 
-            password TEXT, 
-            name TEXT, 
-            role TEXT, 
-            specialty TEXT,
-            active INTEGER DEFAULT 1,
-            created_date TEXT)""")
-        
-        # Migración: Agregar columnas si no existen
-        try:
-            c.execute("SELECT active FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # La columna 'active' no existe, agregarla
-            c.execute("ALTER TABLE users ADD COLUMN active INTEGER DEFAULT 1")
-            print("Columna 'active' agregada a la tabla users")
-        
-        try:
-            c.execute("SELECT created_date FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # La columna 'created_date' no existe, agregarla
-            c.execute("ALTER TABLE users ADD COLUMN created_date TEXT")
-            c.execute("UPDATE users SET created_date = ? WHERE created_date IS NULL", 
-                     (datetime.now().strftime("%Y-%m-%d"),))
-            print("Columna 'created_date' agregada a la tabla users")
-        
-        # Crear tabla de registros clínicos
-        c.execute("""CREATE TABLE IF NOT EXISTS clinical_records (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, 
-            px_name TEXT, 
-            px_id TEXT, 
-            date TEXT, 
-            doctor TEXT,
-            sys INT, 
-            tfg REAL, 
-            albuminuria REAL, 
-            potasio REAL, 
-            bun_cr REAL,
-            fevi REAL, 
-            troponina REAL, 
-            bnp REAL, 
-            ldl REAL, 
-            sleep REAL, 
-            stress TEXT, 
-            exercise INT, 
-            obs TEXT)""")
-        
-        # Migración: Agregar columna exercise si no existe
-        try:
-            c.execute("SELECT exercise FROM clinical_records LIMIT 1")
-        except sqlite3.OperationalError:
-            c.execute("ALTER TABLE clinical_records ADD COLUMN exercise INTEGER DEFAULT 0")
-            print("Columna 'exercise' agregada a clinical_records")
-        
-        # Crear tabla de auditoría
-        c.execute("""CREATE TABLE IF NOT EXISTS audit_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, 
-            timestamp TEXT, 
-            user TEXT, 
-            action TEXT, 
-            details TEXT)""")
-        
-        # Crear usuario admin si no existe
-        c.execute("SELECT * FROM users WHERE username='admin'")
-        if not c.fetchone():
-            pw = bcrypt.hashpw("Admin2026!".encode(), bcrypt.gensalt()).decode()
-            c.execute("INSERT INTO users VALUES ('admin', ?, 'Admin Master', 'admin', 'Sistemas', 1, ?)", 
-                     (pw, datetime.now().strftime("%Y-%m-%d")))
-            print("Usuario admin creado")
-        
-        self.conn.commit()
-
-    def log_action(self, user, action, details):
-        self.conn.execute("INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?,?,?,?)",
-                          (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), user, action, details))
-        self.conn.commit()
-
-db = AppDatabase()
+db = get_db()
 
 # =============================================
-# 2. MOTOR DE RECOMENDACIONES Y PDF
+# 2. FRAGMENTOS DEL PANEL DE RESULTADOS
 # =============================================
-def generar_plan_cientifico(d):
-    """
-    Genera recomendaciones basadas en guías KDIGO 2024 y AHA/ACC 2023
-    """
-    recom = {"dieta": [], "estilo": [], "clinico": [], "seguimiento": []}
-    alertas = []
-    
-    # Evaluación Renal (KDIGO 2024)
-    tfg = d.get('tfg', 90)
-    if tfg < 30:
-        recom['clinico'].append("⚠️ ERC G4-G5: Derivar a nefrología. Considerar preparación para terapia de reemplazo renal.")
-        alertas.append("CRÍTICO: TFG <30 ml/min")
-    elif tfg < 60:
-        recom['clinico'].append("ERC G3: Iniciar/optimizar IECA o ARA-II + SGLT2i (ej: empagliflozina 10mg/día) según KDIGO.")
-        recom['seguimiento'].append("Control de TFG cada 3 meses")
-    elif tfg < 90:
-        recom['seguimiento'].append("Monitoreo anual de función renal")
-    
-    # Evaluación de Potasio
-    potasio = d.get('potasio', 4.0)
-    if potasio > 5.5:
-        recom['dieta'].append("🔴 HIPERPOTASEMIA: Dieta estricta baja en K+ (<2g/día). Evitar: plátanos, naranjas, tomates, aguacate, frijoles.")
-        recom['clinico'].append("Considerar quelante de potasio (patiromer o ciclosilicato de zirconio sódico)")
-        alertas.append("URGENTE: K+ >5.5 mEq/L")
-    elif potasio > 5.2:
-        recom['dieta'].append("Restricción moderada de potasio. Limitar cítricos y vegetales crudos.")
-    elif potasio < 3.5:
-        recom['dieta'].append("Aumentar ingesta de potasio: plátanos, espinacas, batatas.")
-        alertas.append("Hipopotasemia detectada")
-    
-    # Evaluación Cardíaca (AHA/ACC 2023)
-    fevi = d.get('fevi', 55)
-    if fevi < 40:
-        recom['clinico'].append("🫀 IC-FEr: Terapia cuádruple GDMT: ARNI (sacubitrilo/valsartán) + betabloqueador + ARM + SGLT2i")
-        recom['seguimiento'].append("Ecocardiograma cada 3-6 meses")
-        alertas.append("Insuficiencia Cardíaca con FEr <40%")
-    elif fevi < 50:
-        recom['clinico'].append("FE limítrofe: Optimizar control de presión arterial y manejo de volumen")
-        recom['seguimiento'].append("Ecocardiograma anual")
-    
-    # Presión Arterial
-    sys = d.get('sys', 120)
-    if sys >= 140:
-        recom['clinico'].append("HTA: Meta <130/80 mmHg en ERC. IECA/ARA-II como primera línea.")
-        recom['dieta'].append("Dieta DASH: <2g sodio/día, rica en frutas y vegetales (ajustar K+ si ERC avanzada)")
-    elif sys < 100:
-        alertas.append("Hipotensión: Revisar medicación antihipertensiva")
-    
-    # Estilo de Vida
-    sleep = d.get('sleep', 7)
-    if sleep < 6:
-        recom['estilo'].append("⚠️ Sueño insuficiente (<6h): Aumenta riesgo CV 20-30%. Meta: 7-8 horas/noche.")
-        recom['estilo'].append("Higiene del sueño: Horario regular, evitar pantallas 1h antes de dormir, ambiente oscuro.")
-    elif sleep > 9:
-        recom['estilo'].append("Sueño excesivo (>9h): Evaluar causas subyacentes (depresión, apnea del sueño)")
-    
-    # Manejo de Estrés
-    stress = d.get('stress', 'Bajo')
-    if stress == "Alto":
-        recom['estilo'].append("Estrés elevado aumenta activación simpática y eje RAA. Técnicas recomendadas:")
-        recom['estilo'].append("• Mindfulness/meditación 10-20 min/día (reduce PA sistólica 4-5 mmHg)")
-        recom['estilo'].append("• Ejercicio aeróbico moderado 150 min/semana")
-        recom['estilo'].append("• Considerar apoyo psicológico si persiste")
-    
-    # Ejercicio
-    exercise = d.get('exercise', 0)
-    if exercise < 150:
-        recom['estilo'].append(f"Actividad física actual: {exercise} min/sem. Meta AHA: ≥150 min ejercicio moderado.")
-        recom['estilo'].append("Iniciar gradualmente: Caminata 30 min 5 días/semana, aumentar progresivamente.")
-    
-    return recom, alertas
+# Cada fragmento se vuelve a ejecutar solo cuando interactúan con él; las
+# figuras salen de la caché de graficos.py según los valores de la consulta.
+@st.fragment
+def panel_graficos(d):
+    figuras = figuras_resultado(d, proyeccion_paciente(db, d['px_id']))
+    col_g1, col_g2 = st.columns(2)
 
-def crear_pdf(datos, recoms, alertas, medico):
-    """
-    Genera PDF profesional con datos clínicos y recomendaciones
-    """
-    pdf = FPDF()
-    pdf.add_page()
-    
-    # Encabezado
-    pdf.set_font("Arial", 'B', 18)
-    pdf.set_text_color(0, 51, 102)
-    pdf.cell(0, 12, "REPORTE MEDICO CARDIORRENAL", ln=True, align='C')
-    pdf.set_text_color(0, 0, 0)
-    pdf.ln(5)
-    
-    # Información del paciente
-    pdf.set_font("Arial", 'B', 13)
-    pdf.set_fill_color(230, 240, 250)
-    pdf.cell(0, 10, "DATOS DEL PACIENTE", ln=True, fill=True)
-    pdf.set_font("Arial", '', 11)
-    pdf.cell(95, 8, f"Nombre: {datos['px_name']}", border=1)
-    pdf.cell(95, 8, f"ID: {datos['px_id']}", border=1, ln=True)
-    pdf.cell(95, 8, f"Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M')}", border=1)
-    pdf.cell(95, 8, f"Medico: Dr. {medico}", border=1, ln=True)
-    pdf.ln(8)
-    
-    # Resultados clínicos
-    pdf.set_font("Arial", 'B', 13)
-    pdf.set_fill_color(230, 240, 250)
-    pdf.cell(0, 10, "RESULTADOS CLINICOS", ln=True, fill=True)
-    pdf.set_font("Arial", '', 11)
-    
-    resultados = [
-        ("Presion Sistolica", f"{datos.get('sys', 'N/A')} mmHg"),
-        ("TFG (Funcion Renal)", f"{datos.get('tfg', 'N/A')} ml/min/1.73m2"),
-        ("Potasio (K+)", f"{datos.get('potasio', 'N/A')} mEq/L"),
-        ("FEVI (Fraccion Eyeccion)", f"{datos.get('fevi', 'N/A')}%"),
-        ("Horas de Sueno", f"{datos.get('sleep', 'N/A')} horas/dia"),
-        ("Nivel de Estres", datos.get('stress', 'N/A'))
-    ]
-    
-    for label, valor in resultados:
-        pdf.cell(95, 7, label, border=1)
-        pdf.cell(95, 7, valor, border=1, ln=True)
-    pdf.ln(5)
-    
-    # Alertas críticas
-    if alertas:
-        pdf.set_font("Arial", 'B', 12)
-        pdf.set_text_color(220, 20, 60)
-        pdf.cell(0, 8, "ALERTAS CLINICAS", ln=True)
-        pdf.set_text_color(0, 0, 0)
-        pdf.set_font("Arial", '', 10)
-        for alerta in alertas:
-            pdf.multi_cell(0, 6, f"* {alerta}")
-        pdf.ln(3)
-    
-    # Recomendaciones
-    pdf.set_font("Arial", 'B', 13)
-    pdf.set_fill_color(230, 240, 250)
-    pdf.cell(0, 10, "PLAN DE TRATAMIENTO Y RECOMENDACIONES", ln=True, fill=True)
-    pdf.ln(2)
-    
-    categorias = {
-        'clinico': ('MANEJO CLINICO', (0, 100, 0)),
-        'dieta': ('INTERVENCION NUTRICIONAL', (139, 69, 19)),
-        'estilo': ('MODIFICACION DE ESTILO DE VIDA', (0, 51, 102)),
-        'seguimiento': ('PLAN DE SEGUIMIENTO', (75, 0, 130))
-    }
-    
-    for cat, items in recoms.items():
-        if items:
-            titulo, color = categorias.get(cat, (cat.upper(), (0, 0, 0)))
-            pdf.set_font("Arial", 'B', 11)
-            pdf.set_text_color(*color)
-            pdf.cell(0, 8, titulo, ln=True)
-            pdf.set_text_color(0, 0, 0)
-            pdf.set_font("Arial", '', 10)
-            for item in items:
-                pdf.multi_cell(0, 6, f"  * {item}")
-            pdf.ln(3)
-    
-    # Disclaimer
-    pdf.ln(5)
-    pdf.set_font("Arial", 'I', 9)
-    pdf.set_text_color(128, 128, 128)
-    pdf.multi_cell(0, 5, "AVISO LEGAL: Este reporte es una herramienta de apoyo clinico basada en guias KDIGO 2024 y AHA/ACC 2023. No sustituye el juicio clinico profesional ni la evaluacion individualizada del paciente. Todas las decisiones terapeuticas deben ser validadas por el medico tratante considerando el contexto clinico completo del paciente.")
-    
-    # Firma
-    pdf.ln(8)
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_font("Arial", '', 10)
-    pdf.cell(0, 6, "_" * 40, ln=True, align='C')
-    pdf.cell(0, 6, f"Dr. {medico}", ln=True, align='C')
-    pdf.cell(0, 6, "Firma y Sello Profesional", ln=True, align='C')
-    
-    return pdf.output(dest='S').encode('latin-1')
+    with col_g1:
+        st.plotly_chart(figuras["tfg"], use_container_width=True)
+        categoria, color = clasificacion_kdigo(d['tfg'])
+        st.markdown(f"**Clasificación KDIGO:** :{color}[{categoria}]")
+
+    with col_g2:
+        st.plotly_chart(figuras["fevi"], use_container_width=True)
+        cat_fevi, color_fevi = estado_cardiaco(d['fevi'])
+        st.markdown(f"**Estado Cardíaco:** :{color_fevi}[{cat_fevi}]")
+
+    # Gráfico de tendencia proyectada
+    st.subheader("📈 Proyección de Evolución (Según la Trayectoria del Paciente)")
+    st.plotly_chart(figuras["tendencia"], use_container_width=True)
+
+    # Gráfico de parámetros múltiples
+    st.subheader("🎯 Panel de Parámetros Clínicos")
+    col_p1, col_p2 = st.columns(2)
+    with col_p1:
+        st.plotly_chart(figuras["parametros"], use_container_width=True)
+    with col_p2:
+        st.plotly_chart(figuras["estilo"], use_container_width=True)
+
+@st.fragment
+def panel_recomendaciones(r):
+    tab1, tab2, tab3, tab4 = st.tabs(["🏥 Manejo Clínico", "🥗 Nutrición", "🏃 Estilo de Vida", "📅 Seguimiento"])
+
+    with tab1:
+        if r['clinico']:
+            for rec in r['clinico']:
+                st.success(rec)
+        else:
+            st.info("No se detectaron necesidades clínicas urgentes")
+
+    with tab2:
+        if r['dieta']:
+            for rec in r['dieta']:
+                st.warning(rec) if 'URGENTE' in rec or '🔴' in rec else st.info(rec)
+        else:
+            st.info("Mantener dieta balanceada según recomendaciones generales")
+
+    with tab3:
+        if r['estilo']:
+            for rec in r['estilo']:
+                st.info(rec)
+        else:
+            st.success("Estilo de vida dentro de parámetros saludables")
+
+    with tab4:
+        if r['seguimiento']:
+            for rec in r['seguimiento']:
+                st.info(rec)
+        else:
+            st.info("Control anual de rutina recomendado")
+
+@st.fragment
+def panel_reporte(d, r, alertas, medico):
+    st.subheader("📄 Generar Reporte")
+    # Se genera solo al pulsar el botón (callable diferido) y se reutiliza desde
+    # la caché; la descarga no provoca rerun de la página
+    st.download_button(
+        label="⬇️ Descargar PDF Completo",
+        data=lambda: pdf_reporte(d, r, alertas, medico, d["date"]),
+        file_name=f"Reporte_Cardiorrenal_{d['px_id']}_{d['date'].replace('-', '')}.pdf",
+        mime="application/pdf",
+        use_container_width=True,
+        type="primary",
+        on_click="ignore"
+    )
+    st.caption(f"Generado por: Dr. {medico}")
 
 # =============================================
 # 3. INTERFAZ DE USUARIO
@@ -292,15 +135,21 @@ if not st.session_state.auth:
         p = st.text_input("🔒 Contraseña", type="password", placeholder="Admin2026!")
         
         if st.button("🚀 Acceder", use_container_width=True, type="primary"):
-            res = db.conn.execute("SELECT password, name, role FROM users WHERE username=? AND active=1", (u,)).fetchone()
-            if res and bcrypt.checkpw(p.encode(), res[0].encode()):
-                st.session_state.update({"auth":True, "name":res[1], "role":res[2], "username":u})
-                db.log_action(u, "Login", "Acceso exitoso al sistema")
-                st.success("✅ Autenticación exitosa")
-                st.rerun()
-            else: 
-                st.error("❌ Credenciales inválidas o usuario inactivo")
-                db.log_action(u or "Desconocido", "Login Fallido", "Intento de acceso denegado")
+            origen = st.context.ip_address or "local"
+            try:
+                res = autenticador.verificar(db, u, p, origen)
+            except ValueError as e:
+                st.error(f"⏳ {e}")
+                db.log_action(u or "Desconocido", "Login Rechazado", f"{e} | Origen: {origen}")
+            else:
+                if res:
+                    st.session_state.update({"auth":True, "name":res[0], "role":res[1], "username":u})
+                    db.log_action(u, "Login", "Acceso exitoso al sistema")
+                    st.success("✅ Autenticación exitosa")
+                    st.rerun()
+                else: 
+                    st.error("❌ Credenciales inválidas o usuario inactivo")
+                    db.log_action(u or "Desconocido", "Login Fallido", f"Intento de acceso denegado | Origen: {origen}")
         
         st.info("💡 **Usuario demo:** admin | **Contraseña:** Admin2026!")
     st.stop()
@@ -339,6 +188,12 @@ if menu == "🔬 Nueva Consulta":
         pot_v = col3.number_input("Potasio K+ (mEq/L)", 2.0, 8.0, 4.0, step=0.1, help="Nivel sérico de potasio")
         fevi_v = col4.number_input("FEVI (%)", 5.0, 80.0, 55.0, help="Fracción de Eyección Ventricular Izquierda")
         
+        col5, col6, col7, col8 = st.columns(4)
+        edad_v = col5.number_input("Edad (años)", 18, 110, 50)
+        imc_v = col6.number_input("IMC (kg/m²)", 10.0, 60.0, 25.0, step=0.1, help="Índice de Masa Corporal")
+        glu_v = col7.number_input("Glucosa en ayunas (mg/dL)", 40.0, 600.0, 95.0, step=1.0)
+        cr_v = col8.number_input("Creatinina (mg/dL)", 0.2, 15.0, 1.0, step=0.1, help="Creatinina sérica")
+        
         st.divider()
         st.subheader("🏃 Estilo de Vida")
         
@@ -362,23 +217,33 @@ if menu == "🔬 Nueva Consulta":
             "sleep": sleep_v, 
             "stress": stress_v, 
             "sys": sys_p,
-            "exercise": exercise_v
+            "exercise": exercise_v,
+            "edad": edad_v,
+            "imc": imc_v,
+            "glucosa": glu_v,
+            "creatinina": cr_v,
+            "date": fecha_actual.strftime("%Y-%m-%d")
         }
         
         recoms, alertas = generar_plan_cientifico(datos_enviados)
+        riesgo, version_modelo = puntuar(datos_enviados)
+        datos_enviados["riesgo_erc"] = riesgo
+        datos_enviados["riesgo_modelo"] = version_modelo if riesgo is not None else None
         st.session_state.recoms = recoms
         st.session_state.alertas = alertas
         st.session_state.datos_recientes = datos_enviados
         st.session_state.analisis_listo = True
         
-        # Guardar en base de datos
-        db.conn.execute("""INSERT INTO clinical_records 
-            (px_name, px_id, date, doctor, sys, tfg, potasio, fevi, sleep, stress, exercise, obs) 
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (px_name, px_id, fecha_actual.strftime("%Y-%m-%d"), st.session_state.name, 
-             sys_p, tfg_v, pot_v, fevi_v, sleep_v, stress_v, exercise_v, obs_v))
-        db.conn.commit()
-        db.log_action(st.session_state.username, "Consulta Creada", f"Paciente: {px_name} ({px_id})")
+        # Guardar en base de datos (registro + auditoría en una sola transacción)
+        id_consulta = db.guardar_consulta({
+            "px_name": px_name, "px_id": px_id, "date": fecha_actual.strftime("%Y-%m-%d"),
+            "doctor": st.session_state.name, "sys": sys_p, "tfg": tfg_v, "potasio": pot_v,
+            "fevi": fevi_v, "sleep": sleep_v, "stress": stress_v, "exercise": exercise_v, "obs": obs_v,
+            "edad": edad_v, "imc": imc_v, "glucosa": glu_v, "creatinina": cr_v,
+            "riesgo_erc": datos_enviados["riesgo_erc"], "riesgo_modelo": datos_enviados["riesgo_modelo"]
+        }, st.session_state.username)
+        # La consulta entra a la lista de trabajo sin esperar al próximo barrido
+        reevaluar_registros(db, [id_consulta])
         st.success("✅ Análisis completado y guardado exitosamente")
         st.rerun()
 
@@ -398,243 +263,25 @@ if menu == "🔬 Nueva Consulta":
                 st.warning(f"🔴 {alerta}")
             st.divider()
         
-        # Gráficos principales
-        col_g1, col_g2 = st.columns(2)
-        
-        with col_g1:
-            # Gauge de TFG
-            fig_tfg = go.Figure(go.Indicator(
-                mode="gauge+number+delta",
-                value=d['tfg'],
-                title={'text': "Función Renal (TFG)<br><span style='font-size:0.8em'>ml/min/1.73m²</span>", 'font': {'size': 20}},
-                delta={'reference': 90, 'increasing': {'color': "green"}},
-                gauge={
-                    'axis': {'range': [None, 120], 'tickwidth': 1},
-                    'bar': {'color': "darkblue"},
-                    'bgcolor': "white",
-                    'steps': [
-                        {'range': [0, 15], 'color': "#8B0000", 'name': 'G5'},
-                        {'range': [15, 30], 'color': "#FF4500", 'name': 'G4'},
-                        {'range': [30, 45], 'color': "#FFA500", 'name': 'G3b'},
-                        {'range': [45, 60], 'color': "#FFD700", 'name': 'G3a'},
-                        {'range': [60, 90], 'color': "#90EE90", 'name': 'G2'},
-                        {'range': [90, 120], 'color': "#32CD32", 'name': 'G1'}
-                    ],
-                    'threshold': {
-                        'line': {'color': "red", 'width': 4},
-                        'thickness': 0.75,
-                        'value': 60
-                    }
-                }
-            ))
-            fig_tfg.update_layout(height=350, margin=dict(l=20, r=20, t=80, b=20))
-            st.plotly_chart(fig_tfg, use_container_width=True)
-            
-            # Clasificación ERC
-            if d['tfg'] >= 90:
-                categoria = "G1 - Normal"
-                color = "green"
-            elif d['tfg'] >= 60:
-                categoria = "G2 - Leve ↓"
-                color = "lightgreen"
-            elif d['tfg'] >= 45:
-                categoria = "G3a - Moderada ↓"
-                color = "yellow"
-            elif d['tfg'] >= 30:
-                categoria = "G3b - Moderada-Severa ↓"
-                color = "orange"
-            elif d['tfg'] >= 15:
-                categoria = "G4 - Severa ↓"
-                color = "darkorange"
-            else:
-                categoria = "G5 - Falla Renal"
-                color = "red"
-            
-            st.markdown(f"**Clasificación KDIGO:** :{color}[{categoria}]")
-        
-        with col_g2:
-            # Gauge de FEVI
-            fig_fevi = go.Figure(go.Indicator(
-                mode="gauge+number",
-                value=d['fevi'],
-                title={'text': "Función Cardíaca (FEVI)<br><span style='font-size:0.8em'>Fracción de Eyección %</span>", 'font': {'size': 20}},
-                gauge={
-                    'axis': {'range': [0, 80]},
-                    'bar': {'color': "crimson"},
-                    'steps': [
-                        {'range': [0, 40], 'color': "rgba(255, 0, 0, 0.3)"},
-                        {'range': [40, 50], 'color': "rgba(255, 165, 0, 0.3)"},
-                        {'range': [50, 80], 'color': "rgba(0, 128, 0, 0.3)"}
-                    ],
-                    'threshold': {
-                        'line': {'color': "orange", 'width': 4},
-                        'thickness': 0.75,
-                        'value': 50
-                    }
-                }
-            ))
-            fig_fevi.update_layout(height=350, margin=dict(l=20, r=20, t=80, b=20))
-            st.plotly_chart(fig_fevi, use_container_width=True)
-            
-            # Clasificación IC
-            if d['fevi'] >= 50:
-                cat_fevi = "Normal"
-                color_fevi = "green"
-            elif d['fevi'] >= 40:
-                cat_fevi = "FE Limítrofe"
-                color_fevi = "orange"
-            else:
-                cat_fevi = "IC con FE Reducida"
-                color_fevi = "red"
-            
-            st.markdown(f"**Estado Cardíaco:** :{color_fevi}[{cat_fevi}]")
-        
-        # Gráfico de tendencia proyectada
-        st.subheader("📈 Proyección de Evolución (Con Adherencia al Tratamiento)")
-        fechas = ["Hoy", "+2 meses", "+4 meses", "+6 meses", "+12 meses"]
+        # Riesgo estimado por el modelo (regresión logística)
+        if d.get('riesgo_erc') is not None:
+            st.metric("🧮 Riesgo ERC estimado (modelo)", f"{d['riesgo_erc'] * 100:.1f}%",
+                      help=f"Modelo: {d.get('riesgo_modelo')}")
         
-        # Proyección optimista con tratamiento
-        if d['tfg'] < 60:
-            progreso_tfg = [d['tfg'], d['tfg']*1.02, d['tfg']*1.04, d['tfg']*1.06, d['tfg']*1.08]
-        else:
-            progreso_tfg = [d['tfg'], d['tfg']*1.01, d['tfg']*1.015, d['tfg']*1.02, d['tfg']*1.02]
-        
-        if d['fevi'] < 50:
-            progreso_fevi = [d['fevi'], d['fevi']*1.03, d['fevi']*1.06, d['fevi']*1.08, d['fevi']*1.10]
-        else:
-            progreso_fevi = [d['fevi'], d['fevi']*1.01, d['fevi']*1.01, d['fevi']*1.015, d['fevi']*1.015]
-        
-        fig_trend = go.Figure()
-        fig_trend.add_trace(go.Scatter(
-            x=fechas, y=progreso_tfg, 
-            mode='lines+markers', 
-            name="TFG Proyectada",
-            line=dict(color='royalblue', width=3),
-            marker=dict(size=10)
-        ))
-        fig_trend.add_trace(go.Scatter(
-            x=fechas, y=progreso_fevi, 
-            mode='lines+markers', 
-            name="FEVI Proyectada",
-            line=dict(color='crimson', width=3, dash='dash'),
-            marker=dict(size=10, symbol='diamond')
-        ))
-        
-        fig_trend.update_layout(
-            title="Evolución Esperada con Manejo Óptimo",
-            xaxis_title="Tiempo",
-            yaxis_title="Valor",
-            hovermode='x unified',
-            height=400,
-            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-        )
-        st.plotly_chart(fig_trend, use_container_width=True)
-        
-        # Gráfico de parámetros múltiples
-        st.subheader("🎯 Panel de Parámetros Clínicos")
-        col_p1, col_p2 = st.columns(2)
-        
-        with col_p1:
-            # Gráfico de barras comparativo
-            parametros = ['Presión\nSistólica', 'Potasio\n(K+)', 'Horas\nSueño']
-            valores = [d['sys'], d['potasio']*25, d['sleep']*15]
-            valores_objetivo = [120, 4.5*25, 7.5*15]
-            
-            fig_params = go.Figure(data=[
-                go.Bar(name='Valor Actual', x=parametros, y=valores, marker_color='lightsalmon'),
-                go.Bar(name='Valor Objetivo', x=parametros, y=valores_objetivo, marker_color='lightgreen')
-            ])
-            fig_params.update_layout(
-                title="Comparación con Valores Objetivo",
-                barmode='group',
-                height=350,
-                yaxis_title="Valor (escala normalizada)"
-            )
-            st.plotly_chart(fig_params, use_container_width=True)
-        
-        with col_p2:
-            # Gráfico de radar para estilo de vida
-            categories = ['Sueño\n(h/día)', 'Ejercicio\n(min/sem)', 'Control\nEstrés']
-            
-            valores_actuales = [
-                (d['sleep'] / 8) * 100,
-                (d.get('exercise', 0) / 150) * 100,
-                {'Alto': 30, 'Moderado': 60, 'Bajo': 90}.get(d['stress'], 60)
-            ]
-            
-            fig_radar = go.Figure()
-            fig_radar.add_trace(go.Scatterpolar(
-                r=valores_actuales,
-                theta=categories,
-                fill='toself',
-                name='Actual',
-                line_color='coral'
-            ))
-            fig_radar.add_trace(go.Scatterpolar(
-                r=[100, 100, 100],
-                theta=categories,
-                fill='toself',
-                name='Objetivo',
-                line_color='lightgreen',
-                opacity=0.5
-            ))
-            fig_radar.update_layout(
-                polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
-                title="Evaluación de Estilo de Vida",
-                height=350
-            )
-            st.plotly_chart(fig_radar, use_container_width=True)
+        # Gráficos, recomendaciones y reporte: fragmentos que se vuelven a ejecutar por separado
+        panel_graficos(d)
         
         # Recomendaciones científicas
         st.divider()
         st.header("💊 Plan de Tratamiento y Recomendaciones")
-        
-        tab1, tab2, tab3, tab4 = st.tabs(["🏥 Manejo Clínico", "🥗 Nutrición", "🏃 Estilo de Vida", "📅 Seguimiento"])
-        
-        with tab1:
-            if r['clinico']:
-                for rec in r['clinico']:
-                    st.success(rec)
-            else:
-                st.info("No se detectaron necesidades clínicas urgentes")
-        
-        with tab2:
-            if r['dieta']:
-                for rec in r['dieta']:
-                    st.warning(rec) if 'URGENTE' in rec or '🔴' in rec else st.info(rec)
-            else:
-                st.info("Mantener dieta balanceada según recomendaciones generales")
-        
-        with tab3:
-            if r['estilo']:
-                for rec in r['estilo']:
-                    st.info(rec)
-            else:
-                st.success("Estilo de vida dentro de parámetros saludables")
-        
-        with tab4:
-            if r['seguimiento']:
-                for rec in r['seguimiento']:
-                    st.info(rec)
-            else:
-                st.info("Control anual de rutina recomendado")
+        panel_recomendaciones(r)
         
         # Generar PDF
         st.divider()
         col_pdf, col_info = st.columns([1, 2])
         
         with col_pdf:
-            st.subheader("📄 Generar Reporte")
-            pdf_data = crear_pdf(d, r, alertas, st.session_state.name)
-            st.download_button(
-                label="⬇️ Descargar PDF Completo",
-                data=pdf_data,
-                file_name=f"Reporte_Cardiorrenal_{d['px_id']}_{datetime.now().strftime('%Y%m%d')}.pdf",
-                mime="application/pdf",
-                use_container_width=True,
-                type="primary"
-            )
-            st.caption(f"Generado por: Dr. {st.session_state.name}")
+            panel_reporte(d, r, alertas, st.session_state.name)
         
         with col_info:
             st.warning("""
@@ -660,28 +307,28 @@ elif menu == "📂 Historial":
     
     col_search, col_filter = st.columns([2, 1])
     with col_search:
-        h_px = st.text_input("🔍 Buscar por nombre de paciente", placeholder="Ej: Juan Pérez")
+        h_px = st.text_input("🔍 Buscar por nombre, cédula u observaciones", placeholder="Ej: Juan Pérez")
     with col_filter:
         fecha_desde = st.date_input("Desde", datetime.now().replace(day=1))
     
-    if h_px or st.button("Ver todos los registros"):
-        query = "SELECT * FROM clinical_records WHERE 1=1"
-        params = []
-        
-        if h_px:
-            query += " AND px_name LIKE ?"
-            params.append(f"%{h_px}%")
-        
-        query += " ORDER BY date DESC"
-        
-        df_h = pd.read_sql(query, db.conn, params=params if params else None)
+    # Paginación: pila de cursores (date, id); se reinicia al cambiar la búsqueda
+    if st.session_state.get("hist_busqueda") != h_px:
+        st.session_state.hist_busqueda = h_px
+        st.session_state.hist_cursores = [None]
+    if st.button("Ver todos los registros"):
+        st.session_state.hist_ver_todos = True
+        st.session_state.hist_cursores = [None]
+    
+    if h_px or st.session_state.get("hist_ver_todos"):
+        cursores = st.session_state.hist_cursores
+        df_h, siguiente = db.pagina_historial(h_px or None, cursor=cursores[-1])
         
         if not df_h.empty:
-            st.success(f"✅ Se encontraron {len(df_h)} registros")
+            st.success(f"✅ Mostrando {len(df_h)} registros (página {len(cursores)})")
             
             # Mostrar tabla
             st.dataframe(
-                df_h[['id', 'px_name', 'px_id', 'date', 'doctor', 'tfg', 'fevi', 'potasio', 'sys']],
+                df_h,
                 use_container_width=True,
                 column_config={
                     "id": "ID",
@@ -696,8 +343,34 @@ elif menu == "📂 Historial":
                 }
             )
             
-            # Gráfico de evolución histórica
-            if len(df_h) > 1:
+            col_prev, col_next = st.columns(2)
+            if col_prev.button("⬅️ Anterior", disabled=len(cursores) == 1, use_container_width=True):
+                cursores.pop()
+                st.rerun()
+            if col_next.button("Siguiente ➡️", disabled=siguiente is None, use_container_width=True):
+                cursores.append(siguiente)
+                st.rerun()
+            
+            # Tendencias por paciente desde el resumen longitudinal (no mezcla pacientes)
+            pacientes_pagina = df_h['px_id'].dropna().unique()
+            if len(pacientes_pagina) > 1:
+                st.subheader("📈 Tendencia por Paciente")
+                st.dataframe(
+                    resumenes(db, pacientes_pagina),
+                    use_container_width=True,
+                    hide_index=True,
+                    column_order=["px_id", "px_name", "visitas", "primera", "ultima", "pendiente_tfg", "pendiente_fevi"],
+                    column_config={
+                        "px_id": "Cédula",
+                        "px_name": "Paciente",
+                        "visitas": "Visitas",
+                        "primera": "Primera",
+                        "ultima": "Última",
+                        "pendiente_tfg": st.column_config.NumberColumn("TFG / año", format="%+.1f"),
+                        "pendiente_fevi": st.column_config.NumberColumn("FEVI / año", format="%+.1f")
+                    }
+                )
+            elif len(df_h) > 1:
                 st.subheader("📈 Evolución Temporal")
                 
                 fig_hist = go.Figure()
@@ -727,28 +400,64 @@ elif menu == "📂 Historial":
                 )
                 st.plotly_chart(fig_hist, use_container_width=True)
                 
-                # Análisis de tendencia
-                tendencia_tfg = df_h['tfg'].iloc[0] - df_h['tfg'].iloc[-1]
-                tendencia_fevi = df_h['fevi'].iloc[0] - df_h['fevi'].iloc[-1]
-                
-                col_t1, col_t2 = st.columns(2)
-                with col_t1:
-                    if tendencia_tfg > 0:
-                        st.success(f"📈 TFG: Mejora de {tendencia_tfg:.1f} ml/min")
-                    elif tendencia_tfg < 0:
-                        st.error(f"📉 TFG: Descenso de {abs(tendencia_tfg):.1f} ml/min")
-                    else:
-                        st.info("➡️ TFG: Estable")
-                
-                with col_t2:
-                    if tendencia_fevi > 0:
-                        st.success(f"📈 FEVI: Mejora de {tendencia_fevi:.1f}%")
-                    elif tendencia_fevi < 0:
-                        st.error(f"📉 FEVI: Descenso de {abs(tendencia_fevi):.1f}%")
-                    else:
-                        st.info("➡️ FEVI: Estable")
+                # Análisis de tendencia: pendiente sobre todas las visitas del paciente
+                resumen = resumen_paciente(db, pacientes_pagina[0]) if len(pacientes_pagina) else None
+                if resumen:
+                    st.caption(f"{resumen['visitas']} visitas entre {resumen['primera']} y {resumen['ultima']}")
+                    col_t1, col_t2 = st.columns(2)
+                    for col_t, serie, nombre, unidad in ((col_t1, "tfg", "TFG", "ml/min"), (col_t2, "fevi", "FEVI", "%")):
+                        pendiente = resumen[f"pendiente_{serie}"]
+                        with col_t:
+                            if pendiente is None or pd.isna(pendiente):
+                                st.info(f"➡️ {nombre}: Sin visitas suficientes para estimar la tendencia")
+                            elif pendiente == 0:
+                                st.info(f"➡️ {nombre}: Estable")
+                            elif pendiente > 0:
+                                st.success(f"📈 {nombre}: Mejora de {pendiente:.1f} {unidad} por año")
+                            else:
+                                st.error(f"📉 {nombre}: Descenso de {abs(pendiente):.1f} {unidad} por año")
         else:
             st.warning("No se encontraron registros con los criterios de búsqueda")
+    
+    # Descenso más rápido: recorre el índice de pendientes del resumen longitudinal
+    with st.expander("📉 Pacientes con descenso más rápido"):
+        col_d1, col_d2 = st.columns(2)
+        serie_desc = col_d1.selectbox("Parámetro", ["tfg", "fevi"], format_func=str.upper, key="serie_descenso")
+        limite_desc = col_d2.number_input("Pacientes", 5, 200, 20, key="limite_descenso")
+        st.caption("Pendiente por año (mínimos cuadrados) con al menos 3 mediciones en 90 días o más")
+        st.dataframe(
+            pacientes_en_descenso(db, serie_desc, int(limite_desc)),
+            use_container_width=True,
+            hide_index=True,
+            column_order=["px_id", "px_name", "visitas", "ultima", "tfg", "fevi", f"pendiente_{serie_desc}"],
+            column_config={
+                "px_id": "Cédula",
+                "px_name": "Paciente",
+                "visitas": "Visitas",
+                "ultima": "Última visita",
+                "tfg": st.column_config.NumberColumn("TFG actual", format="%.1f"),
+                "fevi": st.column_config.NumberColumn("FEVI actual", format="%.0f"),
+                f"pendiente_{serie_desc}": st.column_config.NumberColumn("Cambio / año", format="%+.1f")
+            }
+        )
+    
+    # Exportación del historial (streaming desde el espejo si está al día o desde SQLite, solo al pulsar el botón)
+    with st.expander("📤 Exportar historial"):
+        col_e1, col_e2, col_e3 = st.columns(3)
+        exp_hasta = col_e1.date_input("Hasta", datetime.now(), key="exp_hasta")
+        exp_doctor = col_e2.text_input("Médico (opcional)", key="exp_doctor")
+        formato_hist = col_e3.selectbox("Formato", list(FORMATOS), key="formato_historial")
+        st.caption(f"Registros desde {fecha_desde.strftime('%d/%m/%Y')}"
+                   + (f" que coinciden con '{h_px}'" if h_px else ""))
+        st.download_button(
+            label=f"📥 Exportar Historial ({formato_hist.upper()})",
+            data=lambda: exportar_temporal(bloques_historial(
+                db, h_px or None, fecha_desde.strftime("%Y-%m-%d"),
+                exp_hasta.strftime("%Y-%m-%d"), exp_doctor or None
+            ), formato_hist),
+            file_name=f"historial_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato_hist}",
+            mime=FORMATOS[formato_hist]
+        )
 
 # =============================================
 # SECCIÓN: PANEL DE ADMINISTRACIÓN
@@ -760,14 +469,15 @@ elif menu == "⚙️ Panel Admin":
     
     st.title("⚙️ Panel de Administración")
     
-    tab1, tab2 = st.tabs(["👥 Gestión de Usuarios", "📊 Auditoría del Sistema"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["👥 Gestión de Usuarios", "📊 Auditoría del Sistema", "🚨 Alertas Clínicas", "🧮 Modelos de Riesgo", "📥 Importación Masiva", "📄 Reportes por Lote", "🌐 Tablero Poblacional"])
     
     # TAB 1: Gestión de Usuarios
     with tab1:
         st.header("👥 Administración de Usuarios")
         
         # Listar usuarios existentes
-        df_users = pd.read_sql("SELECT username, name, role, specialty, active, created_date FROM users", db.conn)
+        df_users = db.leer_df("SELECT username, name, role, specialty, active, created_date FROM users",
+                              tablas=("users",))
         
         col_u1, col_u2 = st.columns([2, 1])
         with col_u1:
@@ -807,17 +517,18 @@ elif menu == "⚙️ Panel Admin":
                 if st.form_submit_button("✅ Crear Usuario", use_container_width=True, type="primary"):
                     if new_u and new_n and new_p:
                         try:
-                            hash_p = bcrypt.hashpw(new_p.encode(), bcrypt.gensalt()).decode()
-                            db.conn.execute(
+                            hash_p = autenticador.hash(new_p)
+                            db.ejecutar(
                                 "INSERT INTO users (username, password, name, role, specialty, active, created_date) VALUES (?,?,?,?,?,1,?)",
-                                (new_u, hash_p, new_n, new_r, new_spec, datetime.now().strftime("%Y-%m-%d"))
+                                (new_u, hash_p, new_n, new_r, new_spec, datetime.now().strftime("%Y-%m-%d")),
+                                auditoria=(st.session_state.username, "Usuario Creado", f"Nuevo usuario: {new_u} ({new_r})")
                             )
-                            db.conn.commit()
-                            db.log_action(st.session_state.username, "Usuario Creado", f"Nuevo usuario: {new_u} ({new_r})")
                             st.success(f"✅ Usuario '{new_u}' creado exitosamente")
                             st.rerun()
                         except sqlite3.IntegrityError:
                             st.error("❌ El usuario ya existe")
+                        except ValueError as e:
+                            st.error(f"⚠️ {e}")
                     else:
                         st.error("⚠️ Complete todos los campos obligatorios")
         
@@ -833,25 +544,22 @@ elif menu == "⚙️ Panel Admin":
                 with col_act1:
                     if user_data['active'] == 1:
                         if st.button("🔴 Desactivar Usuario", use_container_width=True):
-                            db.conn.execute("UPDATE users SET active=0 WHERE username=?", (user_select,))
-                            db.conn.commit()
-                            db.log_action(st.session_state.username, "Usuario Desactivado", f"Usuario: {user_select}")
+                            db.ejecutar("UPDATE users SET active=0 WHERE username=?", (user_select,),
+                                        auditoria=(st.session_state.username, "Usuario Desactivado", f"Usuario: {user_select}"))
                             st.success(f"Usuario '{user_select}' desactivado")
                             st.rerun()
                     else:
                         if st.button("🟢 Activar Usuario", use_container_width=True):
-                            db.conn.execute("UPDATE users SET active=1 WHERE username=?", (user_select,))
-                            db.conn.commit()
-                            db.log_action(st.session_state.username, "Usuario Activado", f"Usuario: {user_select}")
+                            db.ejecutar("UPDATE users SET active=1 WHERE username=?", (user_select,),
+                                        auditoria=(st.session_state.username, "Usuario Activado", f"Usuario: {user_select}"))
                             st.success(f"Usuario '{user_select}' activado")
                             st.rerun()
                 
                 with col_act2:
                     if st.button("🗑️ Eliminar Permanentemente", use_container_width=True, type="secondary"):
                         if user_select != 'admin':
-                            db.conn.execute("DELETE FROM users WHERE username=?", (user_select,))
-                            db.conn.commit()
-                            db.log_action(st.session_state.username, "Usuario Eliminado", f"Usuario: {user_select}")
+                            db.ejecutar("DELETE FROM users WHERE username=?", (user_select,),
+                                        auditoria=(st.session_state.username, "Usuario Eliminado", f"Usuario: {user_select}"))
                             st.warning(f"Usuario '{user_select}' eliminado")
                             st.rerun()
                         else:
@@ -879,21 +587,16 @@ elif menu == "⚙️ Panel Admin":
         with col_f3:
             limite_registros = st.number_input("Mostrar últimos N registros", 10, 1000, 100, step=10)
         
-        # Construir query de auditoría
-        query_audit = "SELECT * FROM audit_logs WHERE 1=1"
-        params_audit = []
-        
-        if filtro_user != "Todos":
-            query_audit += " AND user = ?"
-            params_audit.append(filtro_user)
-        
-        if filtro_accion != "Todas":
-            query_audit += " AND action = ?"
-            params_audit.append(filtro_accion)
-        
-        query_audit += f" ORDER BY id DESC LIMIT {limite_registros}"
+        # Incluir los eventos aún en la cola del escritor de auditoría
+        db.auditoria.flush()
         
-        df_logs = pd.read_sql(query_audit, db.conn, params=params_audit if params_audit else None)
+        # Tabla viva + segmentos archivados si hace falta completar los N registros
+        df_logs = consultar_auditoria(
+            db,
+            usuario=filtro_user if filtro_user != "Todos" else None,
+            accion=filtro_accion if filtro_accion != "Todas" else None,
+            limite=limite_registros
+        )
         
         if not df_logs.empty:
             st.dataframe(
@@ -908,35 +611,297 @@ elif menu == "⚙️ Panel Admin":
                 }
             )
             
-            # Estadísticas de auditoría
-            st.divider()
-            st.subheader("📈 Estadísticas de Actividad")
+            # Exportar auditoría completa con los filtros actuales (tabla viva + archivo),
+            # en streaming y solo al pulsar el botón
+            col_fmt, col_exp = st.columns([1, 3])
+            formato_aud = col_fmt.selectbox("Formato", list(FORMATOS), key="formato_auditoria")
+            col_exp.download_button(
+                label=f"📥 Exportar Auditoría ({formato_aud.upper()})",
+                data=lambda: exportar_temporal(bloques_auditoria(
+                    db,
+                    usuario=filtro_user if filtro_user != "Todos" else None,
+                    accion=filtro_accion if filtro_accion != "Todas" else None
+                ), formato_aud),
+                file_name=f"auditoria_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato_aud}",
+                mime=FORMATOS[formato_aud]
+            )
+        else:
+            st.info("No hay registros de auditoría con los filtros seleccionados")
+        
+        # Estadísticas de auditoría (tablas de rollup, cualquier rango de fechas)
+        st.divider()
+        st.subheader("📈 Estadísticas de Actividad")
+        
+        hoy = datetime.now().date()
+        rango = st.date_input("Periodo", (hoy - timedelta(days=30), hoy))
+        desde_s, hasta_s = (rango[0], rango[-1]) if rango else (None, None)
+        
+        df_stats = db.estadisticas_auditoria(
+            desde_s, hasta_s,
+            usuario=filtro_user if filtro_user != "Todos" else None,
+            accion=filtro_accion if filtro_accion != "Todas" else None,
+            granularidad=None
+        )
+        
+        if not df_stats.empty:
+            por_accion = df_stats.groupby('action', as_index=False)['n'].sum()
             
             col_s1, col_s2, col_s3, col_s4 = st.columns(4)
-            col_s1.metric("Total Eventos", len(df_logs))
-            col_s2.metric("Logins", len(df_logs[df_logs['action'] == 'Login']))
-            col_s3.metric("Consultas", len(df_logs[df_logs['action'] == 'Consulta Creada']))
-            col_s4.metric("Usuarios Únicos", df_logs['user'].nunique())
+            col_s1.metric("Total Eventos", int(df_stats['n'].sum()))
+            col_s2.metric("Logins", int(por_accion.loc[por_accion['action'] == 'Login', 'n'].sum()))
+            col_s3.metric("Consultas", int(por_accion.loc[por_accion['action'] == 'Consulta Creada', 'n'].sum()))
+            col_s4.metric("Usuarios Únicos", df_stats['user'].nunique())
             
             # Gráfico de actividad por acción
             fig_audit = px.pie(
-                df_logs, 
+                por_accion, 
                 names='action', 
+                values='n',
                 title='Distribución de Acciones en el Sistema',
                 hole=0.4
             )
             st.plotly_chart(fig_audit, use_container_width=True)
-            
-            # Exportar auditoría
-            csv = df_logs.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="📥 Exportar Auditoría (CSV)",
-                data=csv,
-                file_name=f"auditoria_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv"
+        else:
+            st.info("Sin actividad registrada en el periodo seleccionado")
+        
+        # Retención: mover eventos antiguos a segmentos comprimidos
+        st.divider()
+        with st.expander("🗄️ Retención de Auditoría"):
+            dias_retencion = st.number_input("Conservar en la tabla activa (días)", 7, 3650, RETENCION_DIAS, step=1)
+            if st.button("Archivar eventos antiguos"):
+                n_archivados = archivar(db, dias_retencion)
+                db.log_action(st.session_state.username, "Auditoría Archivada",
+                              f"{n_archivados} eventos con más de {dias_retencion} días")
+                st.success(f"✅ {n_archivados} eventos archivados")
+            df_seg = segmentos(db)
+            if not df_seg.empty:
+                st.dataframe(
+                    df_seg[['archivo', 'desde', 'hasta', 'filas', 'creado']],
+                    use_container_width=True,
+                    column_config={
+                        "archivo": "Segmento",
+                        "desde": "Desde",
+                        "hasta": "Hasta",
+                        "filas": "Eventos",
+                        "creado": "Archivado"
+                    }
+                )
+    
+    # TAB 3: Lista de trabajo de alertas
+    with tab3:
+        st.header("🚨 Pacientes en Estado Crítico")
+        st.caption("Alertas de la visita más reciente de cada paciente (umbrales KDIGO 2024 / AHA-ACC 2023)")
+        
+        # El barrido escribe y es proporcional a los registros nuevos: solo a pedido (o por cron con alertas.py)
+        with st.expander("🔄 Barrido de alertas"):
+            st.caption(f"Registros evaluados hasta el id {db.marca_agua(MARCA_ALERTAS)}. "
+                       "Las consultas guardadas desde el formulario se evalúan al guardarse; "
+                       "las importaciones masivas, con el barrido.")
+            if st.button("Barrer ahora"):
+                with st.spinner("Evaluando registros nuevos..."):
+                    n_reg, n_alertas = barrer_alertas(db)
+                st.success(f"✅ {n_reg} registros nuevos evaluados, {n_alertas} alertas")
+        
+        codigos = {"Todas": None, **{texto: codigo for codigo, _, texto in motor_reglas().alertas}}
+        filtro_alerta = st.selectbox("Tipo de alerta", list(codigos))
+        df_alertas = pacientes_en_alerta(db, codigos[filtro_alerta])
+        
+        if not df_alertas.empty:
+            st.metric("Pacientes con alerta activa", df_alertas['px_id'].nunique())
+            st.dataframe(
+                df_alertas.drop(columns=['codigo', 'record_id']),
+                use_container_width=True,
+                column_config={
+                    "px_id": "Cédula",
+                    "px_name": "Paciente",
+                    "date": "Última Visita",
+                    "doctor": "Médico",
+                    "alerta": "Alerta",
+                    "valor": st.column_config.NumberColumn("Valor", format="%.1f")
+                }
             )
         else:
-            st.info("No hay registros de auditoría con los filtros seleccionados")
+            st.success("✅ No hay pacientes con alertas activas")
+        
+        # Pronóstico de cohorte: toda la población proyectada en una sola operación vectorizada
+        with st.expander("🔮 Proyectados a G4 (TFG < 30) en 12 meses"):
+            df_g4 = proyectados_g4(db, 12)
+            st.metric("Pacientes proyectados a G4", len(df_g4))
+            st.caption("Pendiente de cada paciente sobre todas sus visitas, contraída hacia la de la cohorte si hay pocas")
+            st.dataframe(
+                df_g4,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "px_id": "Cédula",
+                    "px_name": "Paciente",
+                    "ultima": "Última Visita",
+                    "visitas": "Visitas",
+                    "tfg": st.column_config.NumberColumn("Última TFG", format="%.1f"),
+                    "tfg_proyectada_hoy": st.column_config.NumberColumn("TFG hoy (proy.)", format="%.1f"),
+                    "tfg_12m": st.column_config.NumberColumn("TFG +12 meses", format="%.1f"),
+                    "pendiente_anual": st.column_config.NumberColumn("Cambio / año", format="%+.1f"),
+                    "meses_hasta_g4": st.column_config.NumberColumn("Meses hasta G4", format="%.1f")
+                }
+            )
+            st.download_button("📥 Descargar CSV", df_g4.to_csv(index=False), "proyectados_g4.csv", "text/csv",
+                               on_click="ignore")
+    
+    # TAB 4: Registro de modelos
+    with tab4:
+        st.header("🧮 Modelos de Riesgo ERC")
+        activo = modelo_activo()
+        st.info(f"**Versión activa:** {activo.version} | Variables: {', '.join(activo.variables)}")
+        
+        df_modelos = pd.DataFrame(versiones())
+        if not df_modelos.empty:
+            st.dataframe(df_modelos, use_container_width=True)
+            
+            version_sel = st.selectbox("Versión a activar", df_modelos['version'].tolist())
+            if st.button("🔁 Activar versión", disabled=version_sel == activo.version):
+                activar(version_sel)
+                db.log_action(st.session_state.username, "Modelo Activado", f"Versión: {version_sel}")
+                st.success(f"✅ Versión '{version_sel}' activa para nuevas consultas")
+                st.rerun()
+    
+    # TAB 5: Importación masiva desde planillas
+    with tab5:
+        st.header("📥 Importación Masiva de Consultas")
+        st.caption("CSV o Excel (.xlsx) con encabezados: px_name, px_id, date, doctor, sys, tfg, potasio, fevi, "
+                   "edad, imc, glucosa, creatinina, sleep, stress, exercise, obs")
+        
+        archivo_imp = st.file_uploader("Archivo", type=["csv", "xlsx"])
+        medico_imp = st.text_input("Médico para filas sin columna doctor", value=st.session_state.name)
+        
+        if archivo_imp and st.button("📥 Importar", type="primary"):
+            carpeta = tempfile.mkdtemp()
+            ruta_imp = os.path.join(carpeta, os.path.basename(archivo_imp.name))
+            ruta_rech = os.path.join(carpeta, "rechazos.csv")
+            with open(ruta_imp, "wb") as f:
+                shutil.copyfileobj(archivo_imp, f)
+            try:
+                with st.spinner("Importando..."):
+                    resumen = importar(db, ruta_imp, st.session_state.username, medico_imp, ruta_rech)
+                st.success(f"✅ {resumen['insertadas']} consultas importadas de {resumen['leidas']} filas")
+                if resumen['rechazadas']:
+                    st.warning(f"⚠️ {resumen['rechazadas']} filas rechazadas")
+                    st.dataframe(pd.read_csv(ruta_rech, nrows=200, dtype=str), use_container_width=True)
+                    with open(ruta_rech, "rb") as f:
+                        st.download_button("📥 Descargar filas rechazadas", f.read(), "rechazos.csv", "text/csv")
+            except ValueError as e:
+                st.error(f"❌ {e}")
+            finally:
+                shutil.rmtree(carpeta, ignore_errors=True)
+    
+    # TAB 6: Reportes PDF por lote (pool de procesos -> ZIP)
+    with tab6:
+        st.header("📄 Reportes PDF por Lote")
+        st.caption("Un reporte por consulta del periodo, con las recomendaciones recalculadas con las reglas vigentes")
+        
+        hoy_lote = datetime.now().date()
+        col_r1, col_r2, col_r3 = st.columns(3)
+        lote_desde = col_r1.date_input("Desde", hoy_lote.replace(day=1), key="lote_desde")
+        lote_hasta = col_r2.date_input("Hasta", hoy_lote, key="lote_hasta")
+        medicos = [m for (m,) in db.consultar("SELECT DISTINCT doctor FROM clinical_records WHERE doctor IS NOT NULL ORDER BY doctor")]
+        lote_medico = col_r3.selectbox("Médico", ["Todos"] + medicos, key="lote_medico")
+        filtros_lote = (lote_desde.strftime("%Y-%m-%d"), lote_hasta.strftime("%Y-%m-%d"),
+                        lote_medico if lote_medico != "Todos" else None)
+        
+        n_lote = contar_reportes(db, *filtros_lote)
+        st.info(f"📋 {n_lote} consultas en el periodo seleccionado")
+        
+        if n_lote and st.button("⚙️ Generar reportes", type="primary"):
+            barra = st.progress(0.0, text="Generando reportes...")
+            with tempfile.TemporaryDirectory() as carpeta:
+                ruta_zip = os.path.join(carpeta, "reportes.zip")
+                try:
+                    generados = generar_zip_subproceso(
+                        db, ruta_zip, *filtros_lote,
+                        progreso=lambda hechos, total: barra.progress(hechos / total, text=f"{hechos}/{total} reportes"),
+                        usuario=st.session_state.username
+                    )
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    with open(ruta_zip, "rb") as f:
+                        st.download_button(
+                            f"⬇️ Descargar {generados} reportes (ZIP)", f,
+                            f"reportes_{filtros_lote[0]}_{filtros_lote[1]}.zip", "application/zip"
+                        )
+    
+    # TAB 7: Tablero poblacional (agregados SQL sobre el rollup mensual, en caché hasta la próxima escritura)
+    with tab7:
+        st.header("🌐 Tablero Poblacional")
+        st.caption("Etapas KDIGO, categorías de FEVI, volumen por médico y tendencias mensuales de toda la población")
+        
+        hoy_tab = datetime.now().date()
+        col_t1, col_t2, col_t3 = st.columns(3)
+        tab_desde = col_t1.date_input("Desde", hoy_tab.replace(year=hoy_tab.year - 1, day=1), key="tablero_desde")
+        tab_hasta = col_t2.date_input("Hasta", hoy_tab, key="tablero_hasta")
+        tab_medico = col_t3.selectbox("Médico", ["Todos"] + medicos_tablero(db), key="tablero_medico")
+        vistas = tablero(db, tab_desde, tab_hasta, tab_medico if tab_medico != "Todos" else None)
+        
+        df_mes = vistas["mensual"]
+        total_consultas = int(df_mes['consultas'].sum())
+        col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+        col_m1.metric("Pacientes", int(vistas["kdigo_pacientes"]['pacientes'].sum()))
+        col_m2.metric("Consultas en el Periodo", total_consultas)
+        col_m3.metric("Consultas con Alerta",
+                      f"{100 * df_mes['con_alerta'].sum() / total_consultas:.1f}%" if total_consultas else "—")
+        col_m4.metric("Médicos Activos", int((vistas["medicos"]['consultas'] > 0).sum()))
+        
+        st.subheader("🩺 Etapa Actual de Cada Paciente")
+        col_d1, col_d2 = st.columns(2)
+        with col_d1:
+            st.plotly_chart(px.bar(vistas["kdigo_pacientes"], x='categoria', y='pacientes', text='porcentaje',
+                                   title='Etapas KDIGO (última TFG)'), use_container_width=True)
+        with col_d2:
+            st.plotly_chart(px.pie(vistas["fevi_pacientes"], names='categoria', values='pacientes',
+                                   title='Categorías de FEVI (última medición)', hole=0.4), use_container_width=True)
+        
+        st.subheader("📅 Consultas del Periodo")
+        col_c1, col_c2 = st.columns(2)
+        col_c1.dataframe(vistas["kdigo_consultas"], use_container_width=True, hide_index=True)
+        col_c2.dataframe(vistas["fevi_consultas"], use_container_width=True, hide_index=True)
+        
+        if not df_mes.empty:
+            st.plotly_chart(px.bar(df_mes, x='mes', y='consultas', title='Consultas por Mes'),
+                            use_container_width=True)
+            st.plotly_chart(px.line(df_mes, x='mes', y=['tasa_alerta', 'pct_g4_g5', 'pct_fevi_reducida'],
+                                    markers=True, title='Tendencia Mensual (%)'), use_container_width=True)
+        
+        st.subheader("👨‍⚕️ Volumen por Médico")
+        st.dataframe(
+            vistas["medicos"],
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "doctor": "Médico",
+                "consultas": "Consultas",
+                "con_alerta": "Con Alerta",
+                "tasa_alerta": st.column_config.NumberColumn("Tasa de Alerta", format="%.1f%%"),
+                "tfg_media": st.column_config.NumberColumn("TFG Media", format="%.1f"),
+                "fevi_media": st.column_config.NumberColumn("FEVI Media", format="%.1f"),
+                "pct_g4_g5": st.column_config.NumberColumn("G4-G5", format="%.1f%%"),
+                "pct_fevi_reducida": st.column_config.NumberColumn("FEVI Reducida", format="%.1f%%")
+            }
+        )
+        st.caption("La tasa de alerta refleja el último barrido de alertas (pestaña 🚨 Alertas Clínicas)")
+        
+        # Espejo columnar (Parquet) para exportaciones y entrenamiento fuera del archivo SQLite
+        with st.expander("🗃️ Espejo Analítico (Parquet)"):
+            if st.button("🔄 Sincronizar espejo"):
+                agregadas, reescritas = sincronizar_espejo(db)
+                db.log_action(st.session_state.username, "Espejo Sincronizado",
+                              f"{agregadas} filas agregadas, {reescritas} particiones reescritas")
+                st.success(f"✅ {agregadas} filas agregadas, {reescritas} particiones reescritas")
+            info_espejo = estado_espejo(db)
+            col_e1, col_e2, col_e3, col_e4 = st.columns(4)
+            col_e1.metric("Filas sin Copiar", info_espejo["filas_sin_copiar"])
+            col_e2.metric("Particiones Pendientes", info_espejo["particiones_pendientes"])
+            col_e3.metric("Particiones", info_espejo["particiones"])
+            col_e4.metric("Tamaño", f"{info_espejo['bytes'] / 1024 / 1024:.1f} MB")
+            st.caption("También por línea de comandos: python espejo.py sincronizar")
 
 # Footer
 st.markdown("---")
@@ -0,0 +1,147 @@
+"""
+Retención de auditoría: las filas de audit_logs más antiguas que la ventana
+configurada se mueven a segmentos CSV comprimidos (gzip) de solo escritura,
+indexados por rango de fechas en audit_archivo_segmentos. La tabla viva queda
+pequeña y las consultas del panel leen los segmentos solo cuando hace falta.
+
+Uso por línea de comandos (p. ej. desde cron):
+    python archivo_auditoria.py --dias 90
+"""
+import argparse
+import csv
+import gzip
+import os
+import pandas as pd
+from datetime import datetime, timedelta
+from database import AppDatabase, DB_PATH
+
+RETENCION_DIAS = 90
+FILAS_POR_SEGMENTO = 100_000
+COLUMNAS = ["id", "timestamp", "user", "action", "details"]
+
+def directorio_archivo(db):
+    return os.path.join(os.path.dirname(os.path.abspath(db.path)), "archivo_auditoria")
+
+def _escribir_segmento(ruta, filas):
+    """Escribe el segmento en un temporal y lo publica con un rename atómico"""
+    tmp = ruta + ".tmp"
+    with gzip.open(tmp, "wt", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(COLUMNAS)
+        w.writerows(filas)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ruta)
+
+def archivar(db, dias=RETENCION_DIAS, filas_por_segmento=FILAS_POR_SEGMENTO):
+    """
+    Mueve a segmentos comprimidos los eventos con más de `dias` de antigüedad.
+    Cada segmento se registra en el índice y se borra de audit_logs en la misma
+    transacción; un fallo a mitad deja como mucho un archivo huérfano sin indexar.
+    Devuelve el número de filas archivadas.
+    """
+    corte = (datetime.now() - timedelta(days=dias)).strftime("%Y-%m-%d %H:%M:%S")
+    carpeta = directorio_archivo(db)
+    os.makedirs(carpeta, exist_ok=True)
+    db.auditoria.flush()
+
+    total = 0
+    while True:
+        filas = db.consultar(
+            f"SELECT {', '.join(COLUMNAS)} FROM audit_logs WHERE timestamp < ? ORDER BY id LIMIT ?",
+            (corte, filas_por_segmento))
+        if not filas:
+            return total
+
+        id_min, id_max = filas[0][0], filas[-1][0]
+        desde = min(f[1] for f in filas)
+        hasta = max(f[1] for f in filas)
+        nombre = f"audit_{id_min:012d}_{id_max:012d}.csv.gz"
+        _escribir_segmento(os.path.join(carpeta, nombre), filas)
+
+        with db.transaccion() as conn:
+            conn.execute("""INSERT INTO audit_archivo_segmentos
+                (archivo, desde, hasta, id_min, id_max, filas, creado) VALUES (?,?,?,?,?,?,?)""",
+                (nombre, desde, hasta, id_min, id_max, len(filas),
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            conn.execute("DELETE FROM audit_logs WHERE id BETWEEN ? AND ? AND timestamp < ?",
+                         (id_min, id_max, corte))
+        total += len(filas)
+
+def segmentos(db, desde=None, hasta=None):
+    """Segmentos cuyo rango de fechas se solapa con [desde, hasta], del más reciente al más antiguo"""
+    condiciones, params = [], []
+    if desde:
+        condiciones.append("hasta >= ?")
+        params.append(str(desde))
+    if hasta:
+        condiciones.append("desde <= ?")
+        params.append(str(hasta) + "~")
+    where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return db.leer_df(f"SELECT * FROM audit_archivo_segmentos{where} ORDER BY id_max DESC", params,
+                      tablas=("audit_archivo_segmentos",))
+
+def leer_segmento(ruta, usuario=None, accion=None, desde=None, hasta=None):
+    """Bloques (DataFrame) de un segmento archivado que cumplen los filtros"""
+    # Texto tal cual: un usuario "1234" o "NA" debe seguir coincidiendo con el filtro
+    for bloque in pd.read_csv(ruta, compression="gzip", chunksize=20_000, keep_default_na=False,
+                              dtype={"timestamp": str, "user": str, "action": str, "details": str}):
+        m = pd.Series(True, index=bloque.index)
+        if usuario:
+            m &= bloque["user"] == usuario
+        if accion:
+            m &= bloque["action"] == accion
+        if desde:
+            m &= bloque["timestamp"] >= str(desde)
+        if hasta:
+            m &= bloque["timestamp"] <= str(hasta) + "~"
+        yield bloque[m]
+
+def consultar_auditoria(db, usuario=None, accion=None, limite=100, desde=None, hasta=None):
+    """
+    Últimos `limite` eventos que cumplen los filtros, más recientes primero.
+    Lee la tabla viva y, si no alcanza, continúa por los segmentos archivados.
+    """
+    condiciones, params = [], []
+    if usuario:
+        condiciones.append("user = ?")
+        params.append(usuario)
+    if accion:
+        condiciones.append("action = ?")
+        params.append(accion)
+    if desde:
+        condiciones.append("timestamp >= ?")
+        params.append(str(desde))
+    if hasta:
+        condiciones.append("timestamp <= ?")
+        params.append(str(hasta) + "~")
+    where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    df = db.leer_df(f"SELECT * FROM audit_logs{where} ORDER BY id DESC LIMIT ?", params + [int(limite)],
+                   tablas=("audit_logs",))
+    if len(df) >= limite:
+        return df
+
+    partes = [df]
+    faltan = limite - len(df)
+    carpeta = directorio_archivo(db)
+    for seg in segmentos(db, desde, hasta).itertuples():
+        ruta = os.path.join(carpeta, seg.archivo)
+        if not os.path.exists(ruta):
+            continue
+        encontrados = pd.concat(list(leer_segmento(ruta, usuario, accion, desde, hasta)))
+        encontrados = encontrados.sort_values("id", ascending=False).head(faltan)
+        partes.append(encontrados)
+        faltan -= len(encontrados)
+        if faltan <= 0:
+            break
+    partes = [p for p in partes if not p.empty]
+    return pd.concat(partes, ignore_index=True) if partes else df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archiva eventos de auditoría antiguos")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--dias", type=int, default=RETENCION_DIAS)
+    parser.add_argument("--filas-por-segmento", type=int, default=FILAS_POR_SEGMENTO)
+    args = parser.parse_args()
+    n = archivar(AppDatabase(args.db), args.dias, args.filas_por_segmento)
+    print(f"{n} eventos archivados")
@@ -0,0 +1,195 @@
+"""
+Autenticación: bcrypt corre en un pool acotado de hilos (bcrypt libera el
+GIL), de modo que una ráfaga de logins no ocupa el hilo de cada sesión ni
+todos los núcleos. Antes de gastar un hash se consulta un limitador de
+intentos por usuario y por origen; si el usuario o el origen está bloqueado,
+o el pool está saturado, el intento se rechaza sin tocar bcrypt.
+
+El costo de bcrypt y los hilos del pool se configuran con las variables de
+entorno NEFROCARDIO_COSTO_BCRYPT y NEFROCARDIO_HILOS_BCRYPT (por defecto 12 y
+la mitad de los núcleos). Los hashes con otro costo se regeneran de forma
+transparente en el siguiente login correcto.
+
+Uso por línea de comandos:
+    python autenticacion.py [--costo 12]   (pide la contraseña e imprime el hash y lo que tardó)
+"""
+import argparse
+import getpass
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import bcrypt
+
+def _entero_entorno(nombre, defecto, minimo, maximo):
+    valor = os.environ.get(nombre, "").strip()
+    if not valor:
+        return defecto
+    if not valor.isdigit() or not minimo <= int(valor) <= maximo:
+        raise ValueError(f"{nombre} debe ser un entero entre {minimo} y {maximo} (recibido {valor!r})")
+    return int(valor)
+
+# 12: ~0.4 s por hash en un núcleo actual
+COSTO_BCRYPT = _entero_entorno("NEFROCARDIO_COSTO_BCRYPT", 12, 4, 31)
+# Por defecto deja núcleos libres para el resto de sesiones
+HILOS_BCRYPT = _entero_entorno("NEFROCARDIO_HILOS_BCRYPT", max(1, (os.cpu_count() or 2) // 2), 1, 256)
+EN_VUELO_POR_HILO = 4  # hashes pendientes por hilo antes de rechazar por saturación
+BCRYPT_MAX_BYTES = 72
+
+# Limitador: intentos sin éxito dentro de la ventana antes de bloquear
+VENTANA_S = 15 * 60
+INTENTOS_LIBRES_USUARIO = 5
+INTENTOS_LIBRES_ORIGEN = 20  # un origen puede ser la NAT de todo un hospital
+BLOQUEO_BASE_S = 30
+BLOQUEO_MAX_S = 15 * 60
+CLAVES_MAX = 50_000
+
+def costo_hash(hash_guardado):
+    """'$2b$12$...' -> 12 (None si no es un hash bcrypt)"""
+    partes = hash_guardado.split("$")
+    return int(partes[2]) if len(partes) > 3 and partes[2].isdigit() else None
+
+class Limitador:
+    """
+    Intentos fallidos por clave (usuario u origen) en una ventana deslizante.
+    Cada intento cuenta desde que empieza y solo un éxito lo descuenta, así que
+    varios intentos simultáneos no esquivan el límite. Superados los intentos
+    libres, el bloqueo crece en forma exponencial hasta BLOQUEO_MAX_S.
+    Con `olvidar_al_exito` un éxito borra todo el historial de la clave; si no,
+    descuenta solo su propio intento (un origen compartido no se limpia con el
+    login correcto de otro usuario).
+    """
+    def __init__(self, libres, olvidar_al_exito=True, ventana_s=VENTANA_S, maximo=CLAVES_MAX):
+        self.libres = libres
+        self.olvidar_al_exito = olvidar_al_exito
+        self.ventana_s = ventana_s
+        self.maximo = maximo
+        self._intentos = OrderedDict()  # clave -> (intentos, último intento)
+        self._lock = threading.Lock()
+
+    def _vigente(self, clave, ahora):
+        entrada = self._intentos.get(clave)
+        if entrada and ahora - entrada[1] > self.ventana_s:
+            del self._intentos[clave]
+            return None
+        return entrada
+
+    def espera(self, clave, ahora=None):
+        """Segundos que faltan para poder intentar de nuevo (0 si no está bloqueada)"""
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            entrada = self._vigente(clave, ahora)
+            if not entrada or entrada[0] < self.libres:
+                return 0
+            bloqueo = min(BLOQUEO_BASE_S * 2 ** (entrada[0] - self.libres), BLOQUEO_MAX_S)
+            return max(0, entrada[1] + bloqueo - ahora)
+
+    def intento(self, clave, ahora=None):
+        ahora = time.monotonic() if ahora is None else ahora
+        with self._lock:
+            entrada = self._vigente(clave, ahora)
+            self._intentos[clave] = ((entrada[0] if entrada else 0) + 1, ahora)
+            self._intentos.move_to_end(clave)
+            while len(self._intentos) > self.maximo:
+                self._intentos.popitem(last=False)
+
+    def exito(self, clave):
+        with self._lock:
+            entrada = self._intentos.pop(clave, None)
+            if entrada and not self.olvidar_al_exito and entrada[0] > 1:
+                self._intentos[clave] = (entrada[0] - 1, entrada[1])
+
+class Autenticador:
+    """
+    Verificación y generación de hashes en un pool compartido por todas las
+    sesiones del proceso. Los métodos bloquean a quien llama hasta tener el
+    resultado, pero el trabajo de bcrypt lo hacen como mucho `hilos` hilos.
+    """
+    def __init__(self, costo=COSTO_BCRYPT, hilos=HILOS_BCRYPT):
+        self.costo = costo
+        self._pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="bcrypt")
+        self._cupos = threading.BoundedSemaphore(hilos * EN_VUELO_POR_HILO)
+        self.por_usuario = Limitador(INTENTOS_LIBRES_USUARIO)
+        self.por_origen = Limitador(INTENTOS_LIBRES_ORIGEN, olvidar_al_exito=False)
+        self._hash_ficticio = None
+
+    @contextmanager
+    def _cupo(self):
+        """Reserva un lugar en el pool o rechaza de inmediato si está saturado"""
+        if not self._cupos.acquire(blocking=False):
+            raise ValueError("El servidor está ocupado procesando accesos, intente de nuevo en unos segundos")
+        try:
+            yield
+        finally:
+            self._cupos.release()
+
+    def _hashpw(self, password):
+        return bcrypt.hashpw(password, bcrypt.gensalt(self.costo)).decode()
+
+    def hash(self, password):
+        """Hash bcrypt de `password` con el costo configurado"""
+        password = password.encode()
+        if len(password) > BCRYPT_MAX_BYTES:
+            raise ValueError(f"La contraseña no puede superar {BCRYPT_MAX_BYTES} bytes")
+        with self._cupo():
+            return self._pool.submit(self._hashpw, password).result()
+
+    def _comprobar(self, password, hash_guardado):
+        if hash_guardado is None:
+            # Usuario inexistente: mismo costo que uno real para no revelar cuáles existen
+            if self._hash_ficticio is None:
+                self._hash_ficticio = self._hashpw(os.urandom(16)).encode()
+            bcrypt.checkpw(password, self._hash_ficticio)
+            return False
+        return bcrypt.checkpw(password, hash_guardado.encode())
+
+    def _rehash(self, db, usuario, password, hash_guardado):
+        nuevo = self._hashpw(password)
+        # Solo si nadie cambió la contraseña mientras tanto
+        db.ejecutar("UPDATE users SET password=? WHERE username=? AND password=?", (nuevo, usuario, hash_guardado))
+
+    def verificar(self, db, usuario, password, origen=None):
+        """
+        (name, role) si las credenciales son válidas y el usuario está activo,
+        None si no. Lanza ValueError sin ejecutar bcrypt si el usuario o el
+        origen están bloqueados por intentos fallidos o si el pool está saturado.
+        """
+        claves = [(self.por_usuario, usuario.strip().lower())]
+        if origen:
+            claves.append((self.por_origen, origen))
+        espera = max(limitador.espera(clave) for limitador, clave in claves)
+        if espera > 0:
+            raise ValueError(f"Demasiados intentos fallidos. Espere {int(espera) + 1} s antes de reintentar")
+
+        password = password.encode()
+        # Un rechazo por saturación no cuenta como intento fallido
+        with self._cupo():
+            for limitador, clave in claves:
+                limitador.intento(clave)
+            if not usuario or not password or len(password) > BCRYPT_MAX_BYTES:
+                return None
+            res = db.consultar_uno("SELECT password, name, role FROM users WHERE username=? AND active=1",
+                                   (usuario,))
+            if not self._pool.submit(self._comprobar, password, res[0] if res else None).result():
+                return None
+
+        for limitador, clave in claves:
+            limitador.exito(clave)
+        if costo_hash(res[0]) != self.costo and self._cupos.acquire(blocking=False):
+            # En segundo plano y solo si hay cupo: si no, se regenera en otro login
+            futuro = self._pool.submit(self._rehash, db, usuario, password, res[0])
+            futuro.add_done_callback(lambda _: self._cupos.release())
+        return res[1], res[2]
+
+autenticador = Autenticador()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera un hash bcrypt con el costo configurado")
+    parser.add_argument("--costo", type=int, default=COSTO_BCRYPT)
+    args = parser.parse_args()
+    inicio = time.perf_counter()
+    h = Autenticador(args.costo, hilos=1).hash(getpass.getpass("Contraseña: "))
+    print(h)
+    print(f"Costo {args.costo}: {time.perf_counter() - inicio:.2f} s por hash")
@@ -0,0 +1,987 @@
+import sqlite3
+import atexit
+import threading
+import queue
+import random
+import time
+import bcrypt
+import pandas as pd
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+DB_PATH = "nefrocardio_v2026.db"
+
+# Concurrencia: un escritor serializado + pool acotado de lectores (WAL)
+LECTORES_MAX = 8
+BUSY_TIMEOUT_MS = 5000
+REINTENTOS_LOCK = 6
+BACKOFF_BASE_S = 0.05
+
+# Auditoría: cola acotada + commits agrupados desde un hilo escritor
+AUDITORIA_COLA_MAX = 10000
+AUDITORIA_LOTE_MAX = 500
+AUDITORIA_ESPERA_S = 0.05
+
+# Historial: columnas que realmente se muestran y tipos compactos para pandas
+HISTORIAL_PAGINA = 50
+HISTORIAL_COLUMNAS = ["id", "px_name", "px_id", "date", "doctor", "tfg", "fevi", "potasio", "sys"]
+DTYPES_COMPACTOS = {
+    "sys": "float32", "tfg": "float32", "albuminuria": "float32", "potasio": "float32",
+    "bun_cr": "float32", "fevi": "float32", "troponina": "float32", "bnp": "float32",
+    "ldl": "float32", "sleep": "float32", "exercise": "float32", "edad": "float32",
+    "imc": "float32", "glucosa": "float32", "creatinina": "float32", "riesgo_erc": "float32",
+    "stress": "category", "doctor": "category",
+}
+
+# Caché de resultados: invalidada por la versión de escritura de cada tabla
+CACHE_CONSULTAS_MAX_BYTES = 128 * 1024 * 1024
+TABLAS_VERSIONADAS = ("clinical_records", "users", "audit_logs", "clinical_alerts", "audit_archivo_segmentos")
+
+# Resumen longitudinal: x = años desde J2000 (valores chicos: las sumas de x² no pierden precisión)
+EPOCA_JULIANA = 2451545.0
+SERIES_RESUMEN = ("tfg", "fevi")
+ULTIMOS_VALORES = ("px_name", "tfg", "fevi", "potasio", "sys", "riesgo_erc")
+
+# Rollup mensual por médico: (columna, límite inferior) de mayor a menor, como graficos.clasificacion_kdigo
+ETAPAS_KDIGO = (("g1", 90), ("g2", 60), ("g3a", 45), ("g3b", 30), ("g4", 15), ("g5", None))
+CATEGORIAS_FEVI = (("fevi_normal", 50), ("fevi_limitrofe", 40), ("fevi_reducida", None))
+
+# Espejo columnar (espejo.py): partición de cada consulta por mes de la fecha
+PARTICION_SIN_FECHA = "sin_fecha"
+
+# =============================================
+# MIGRACIONES DE ESQUEMA (PRAGMA user_version)
+# =============================================
+def _columnas(c, tabla):
+    return {fila[1] for fila in c.execute(f"PRAGMA table_info({tabla})")}
+
+def _m001_esquema_base(c):
+    """
+    Esquema inicial. Bases creadas antes del versionado pueden existir sin
+    las columnas añadidas posteriormente, por lo que se completan aquí.
+    """
+    c.execute("""CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password TEXT,
+        name TEXT,
+        role TEXT,
+        specialty TEXT,
+        active INTEGER DEFAULT 1,
+        created_date TEXT)""")
+
+    cols_users = _columnas(c, "users")
+    if "active" not in cols_users:
+        c.execute("ALTER TABLE users ADD COLUMN active INTEGER DEFAULT 1")
+    if "created_date" not in cols_users:
+        c.execute("ALTER TABLE users ADD COLUMN created_date TEXT")
+        c.execute("UPDATE users SET created_date = ? WHERE created_date IS NULL",
+                 (datetime.now().strftime("%Y-%m-%d"),))
+
+    c.execute("""CREATE TABLE IF NOT EXISTS clinical_records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        px_name TEXT,
+        px_id TEXT,
+        date TEXT,
+        doctor TEXT,
+        sys INT,
+        tfg REAL,
+        albuminuria REAL,
+        potasio REAL,
+        bun_cr REAL,
+        fevi REAL,
+        troponina REAL,
+        bnp REAL,
+        ldl REAL,
+        sleep REAL,
+        stress TEXT,
+        exercise INT,
+        obs TEXT)""")
+
+    if "exercise" not in _columnas(c, "clinical_records"):
+        c.execute("ALTER TABLE clinical_records ADD COLUMN exercise INTEGER DEFAULT 0")
+
+    c.execute("""CREATE TABLE IF NOT EXISTS audit_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        user TEXT,
+        action TEXT,
+        details TEXT)""")
+
+def _m002_usuario_admin(c):
+    """Crea el usuario admin de demostración si no existe"""
+    c.execute("SELECT 1 FROM users WHERE username='admin'")
+    if not c.fetchone():
+        pw = bcrypt.hashpw("Admin2026!".encode(), bcrypt.gensalt()).decode()
+        c.execute("INSERT INTO users VALUES ('admin', ?, 'Admin Master', 'admin', 'Sistemas', 1, ?)",
+                 (pw, datetime.now().strftime("%Y-%m-%d")))
+
+def fts5_disponible(c):
+    try:
+        c.execute("CREATE VIRTUAL TABLE temp._sonda_fts USING fts5(x)")
+        c.execute("DROP TABLE temp._sonda_fts")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _m003_indices_y_busqueda(c):
+    """
+    Índices para Historial y Auditoría + tabla FTS5 (contenido externo)
+    sobre nombre, cédula y observaciones, sincronizada por triggers.
+    """
+    c.execute("CREATE INDEX IF NOT EXISTS idx_records_px_date ON clinical_records(px_id, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_records_doctor_date ON clinical_records(doctor, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_user_id ON audit_logs(user, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_audit_action_id ON audit_logs(action, id)")
+
+    if not fts5_disponible(c):
+        print("SQLite sin FTS5: la búsqueda usará LIKE")
+        return
+
+    c.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS clinical_records_fts USING fts5(
+        px_name, px_id, obs,
+        content='clinical_records', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS clinical_records_fts_ai AFTER INSERT ON clinical_records BEGIN
+        INSERT INTO clinical_records_fts(rowid, px_name, px_id, obs)
+        VALUES (new.id, new.px_name, new.px_id, new.obs);
+    END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS clinical_records_fts_ad AFTER DELETE ON clinical_records BEGIN
+        INSERT INTO clinical_records_fts(clinical_records_fts, rowid, px_name, px_id, obs)
+        VALUES ('delete', old.id, old.px_name, old.px_id, old.obs);
+    END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS clinical_records_fts_au
+        AFTER UPDATE OF px_name, px_id, obs ON clinical_records BEGIN
+        INSERT INTO clinical_records_fts(clinical_records_fts, rowid, px_name, px_id, obs)
+        VALUES ('delete', old.id, old.px_name, old.px_id, old.obs);
+        INSERT INTO clinical_records_fts(rowid, px_name, px_id, obs)
+        VALUES (new.id, new.px_name, new.px_id, new.obs);
+    END""")
+    # Indexar los registros ya existentes
+    c.execute("INSERT INTO clinical_records_fts(clinical_records_fts) VALUES ('rebuild')")
+
+def _m004_indice_fecha(c):
+    """Índice para recorrer el historial por keyset (date, id)"""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_records_date_id ON clinical_records(date, id)")
+
+def _m005_rollups_auditoria(c):
+    """
+    Conteos preagregados de auditoría por hora y por día × usuario × acción,
+    mantenidos por trigger en cada INSERT. Las estadísticas del panel se leen
+    de aquí en lugar de recorrer audit_logs.
+    """
+    for tabla, periodo, largo in (("audit_rollup_hora", "hora", 13), ("audit_rollup_dia", "dia", 10)):
+        c.execute(f"""CREATE TABLE IF NOT EXISTS {tabla} (
+            {periodo} TEXT NOT NULL,
+            user TEXT NOT NULL,
+            action TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY ({periodo}, user, action)) WITHOUT ROWID""")
+        c.execute(f"""INSERT INTO {tabla} ({periodo}, user, action, n)
+            SELECT substr(timestamp, 1, {largo}), COALESCE(user, ''), COALESCE(action, ''), COUNT(*)
+            FROM audit_logs GROUP BY 1, 2, 3""")
+
+    c.execute("""CREATE TRIGGER IF NOT EXISTS audit_logs_rollup_ai AFTER INSERT ON audit_logs BEGIN
+        INSERT INTO audit_rollup_hora (hora, user, action, n)
+        VALUES (substr(new.timestamp, 1, 13), COALESCE(new.user, ''), COALESCE(new.action, ''), 1)
+        ON CONFLICT (hora, user, action) DO UPDATE SET n = n + 1;
+        INSERT INTO audit_rollup_dia (dia, user, action, n)
+        VALUES (substr(new.timestamp, 1, 10), COALESCE(new.user, ''), COALESCE(new.action, ''), 1)
+        ON CONFLICT (dia, user, action) DO UPDATE SET n = n + 1;
+    END""")
+
+def _m006_segmentos_archivo(c):
+    """Índice de los segmentos comprimidos de auditoría archivada (ver archivo_auditoria.py)"""
+    c.execute("""CREATE TABLE IF NOT EXISTS audit_archivo_segmentos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        archivo TEXT NOT NULL,
+        desde TEXT NOT NULL,
+        hasta TEXT NOT NULL,
+        id_min INTEGER NOT NULL,
+        id_max INTEGER NOT NULL,
+        filas INTEGER NOT NULL,
+        creado TEXT NOT NULL)""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_segmentos_rango ON audit_archivo_segmentos(hasta, desde)")
+
+def _m007_alertas(c):
+    """Lista de trabajo de alertas clínicas y marcas de agua de los barridos incrementales"""
+    c.execute("""CREATE TABLE IF NOT EXISTS clinical_alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        record_id INTEGER NOT NULL,
+        px_id TEXT,
+        px_name TEXT,
+        date TEXT,
+        doctor TEXT,
+        codigo TEXT NOT NULL,
+        alerta TEXT NOT NULL,
+        valor REAL,
+        detectada TEXT NOT NULL,
+        UNIQUE (record_id, codigo))""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_px_date ON clinical_alerts(px_id, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_codigo_date ON clinical_alerts(codigo, date)")
+    c.execute("""CREATE TABLE IF NOT EXISTS sweep_watermarks (
+        nombre TEXT PRIMARY KEY,
+        ultimo_id INTEGER NOT NULL,
+        actualizado TEXT)""")
+
+def _m008_variables_modelo(c):
+    """Variables del modelo de riesgo ERC (modelo_erc.joblib) y la probabilidad calculada"""
+    existentes = _columnas(c, "clinical_records")
+    for columna, tipo in (("edad", "INTEGER"), ("imc", "REAL"), ("glucosa", "REAL"),
+                          ("creatinina", "REAL"), ("riesgo_erc", "REAL")):
+        if columna not in existentes:
+            c.execute(f"ALTER TABLE clinical_records ADD COLUMN {columna} {tipo}")
+
+def _m009_version_modelo(c):
+    """Versión del modelo (registro_modelos.py) que produjo cada riesgo_erc"""
+    if "riesgo_modelo" not in _columnas(c, "clinical_records"):
+        c.execute("ALTER TABLE clinical_records ADD COLUMN riesgo_modelo TEXT")
+
+def _versionar(c, tabla):
+    """Triggers que incrementan la versión de `tabla` en cada INSERT, UPDATE o DELETE"""
+    c.execute("INSERT OR IGNORE INTO table_versions (tabla, version) VALUES (?, 0)", (tabla,))
+    for evento in ("INSERT", "UPDATE", "DELETE"):
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {tabla}_version_{evento.lower()} AFTER {evento} ON {tabla} BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE tabla = '{tabla}';
+        END""")
+
+def _m010_versiones_tablas(c):
+    """
+    Versión de escritura por tabla para la caché de consultas. Se mantiene por
+    trigger, así que la incrementa cualquier escritura: la app, los comandos
+    por lote y otros procesos, en la misma transacción que el cambio.
+    """
+    c.execute("""CREATE TABLE IF NOT EXISTS table_versions (
+        tabla TEXT PRIMARY KEY,
+        version INTEGER NOT NULL) WITHOUT ROWID""")
+    for tabla in TABLAS_VERSIONADAS:
+        _versionar(c, tabla)
+
+def _aportes(ref, columna):
+    """Expresiones SQL de lo que aporta la fila `ref` (new/old) a las sumas de mínimos cuadrados"""
+    valido = f"{ref}.{columna} IS NOT NULL AND julianday({ref}.date) IS NOT NULL"
+    x = f"((julianday({ref}.date) - {EPOCA_JULIANA}) / 365.25)"
+    y = f"{ref}.{columna}"
+    return {
+        f"n_{columna}": f"({valido})",
+        f"sx_{columna}": f"(CASE WHEN {valido} THEN {x} ELSE 0 END)",
+        f"sy_{columna}": f"(CASE WHEN {valido} THEN {y} ELSE 0 END)",
+        f"sxx_{columna}": f"(CASE WHEN {valido} THEN {x} * {x} ELSE 0 END)",
+        f"sxy_{columna}": f"(CASE WHEN {valido} THEN {x} * {y} ELSE 0 END)",
+    }
+
+def _sql_resumen_sumar(ref, signo):
+    asignaciones = [f"visitas = visitas {signo} 1"]
+    for columna in SERIES_RESUMEN:
+        asignaciones += [f"{suma} = {suma} {signo} {expr}" for suma, expr in _aportes(ref, columna).items()]
+    return f"UPDATE patient_summary SET {', '.join(asignaciones)} WHERE px_id = {ref}.px_id;"
+
+def _sql_resumen_refrescar(ref):
+    """Primera/última visita y valores de la última: búsquedas por el índice (px_id, date)"""
+    ultimos = ", ".join(ULTIMOS_VALORES)
+    return f"""UPDATE patient_summary SET
+            (ultimo_id, ultima, {ultimos}) = (SELECT id, date, {ultimos} FROM clinical_records
+                WHERE px_id = {ref}.px_id ORDER BY date DESC, id DESC LIMIT 1),
+            primera = (SELECT MIN(date) FROM clinical_records WHERE px_id = {ref}.px_id)
+        WHERE px_id = {ref}.px_id;
+        DELETE FROM patient_summary WHERE px_id = {ref}.px_id AND visitas <= 0;"""
+
+def _m011_resumen_pacientes(c):
+    """
+    Resumen longitudinal por px_id: primera y última visita, valores de la
+    última, número de visitas y sumas de mínimos cuadrados (n, Σx, Σy, Σx²,
+    Σxy; x en años) de TFG y FEVI, de las que salen las pendientes por año
+    como columnas generadas e indexadas. Lo mantienen triggers en cada
+    INSERT/UPDATE/DELETE de clinical_records.
+    """
+    sumas = []
+    pendientes = []
+    for col in SERIES_RESUMEN:
+        sumas += [f"n_{col} INTEGER NOT NULL DEFAULT 0"] + [
+            f"{s}_{col} REAL NOT NULL DEFAULT 0" for s in ("sx", "sy", "sxx", "sxy")]
+        denominador = f"(n_{col} * sxx_{col} - sx_{col} * sx_{col})"
+        pendientes.append(f"""pendiente_{col} REAL GENERATED ALWAYS AS (
+            CASE WHEN n_{col} >= 2 AND {denominador} > 1e-9
+                 THEN (n_{col} * sxy_{col} - sx_{col} * sy_{col}) / {denominador} END) VIRTUAL""")
+    c.execute(f"""CREATE TABLE IF NOT EXISTS patient_summary (
+        px_id TEXT PRIMARY KEY,
+        px_name TEXT,
+        primera TEXT,
+        ultima TEXT,
+        ultimo_id INTEGER,
+        visitas INTEGER NOT NULL DEFAULT 0,
+        tfg REAL,
+        fevi REAL,
+        potasio REAL,
+        sys REAL,
+        riesgo_erc REAL,
+        {", ".join(sumas)},
+        {", ".join(pendientes)})""")
+    for col in SERIES_RESUMEN:
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_summary_pendiente_{col} ON patient_summary(pendiente_{col})")
+
+    # Carga inicial desde el historial existente
+    agregados = ["COUNT(*)"]
+    columnas = ["px_id", "visitas"]
+    for col in SERIES_RESUMEN:
+        for suma, expr in _aportes("r", col).items():
+            columnas.append(suma)
+            agregados.append(f"TOTAL({expr})")
+    c.execute(f"""INSERT INTO patient_summary ({', '.join(columnas)})
+        SELECT r.px_id, {', '.join(agregados)} FROM clinical_records r
+        WHERE r.px_id IS NOT NULL GROUP BY r.px_id""")
+    ultimos = ", ".join(ULTIMOS_VALORES)
+    c.execute(f"""UPDATE patient_summary AS s SET
+        (ultimo_id, ultima, {ultimos}) = (SELECT id, date, {ultimos} FROM clinical_records
+            WHERE px_id = s.px_id ORDER BY date DESC, id DESC LIMIT 1),
+        primera = (SELECT MIN(date) FROM clinical_records WHERE px_id = s.px_id)""")
+
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_records_resumen_ai AFTER INSERT ON clinical_records
+        WHEN new.px_id IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO patient_summary (px_id) VALUES (new.px_id);
+        {_sql_resumen_sumar("new", "+")}
+        {_sql_resumen_refrescar("new")}
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_records_resumen_ad AFTER DELETE ON clinical_records
+        WHEN old.px_id IS NOT NULL BEGIN
+        {_sql_resumen_sumar("old", "-")}
+        {_sql_resumen_refrescar("old")}
+    END""")
+    # Solo las columnas que entran en el resumen: las demás actualizaciones no lo tocan
+    columnas_update = ", ".join(dict.fromkeys(["px_id", "date", *SERIES_RESUMEN, *ULTIMOS_VALORES]))
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_records_resumen_au AFTER UPDATE OF {columnas_update}
+        ON clinical_records BEGIN
+        {_sql_resumen_sumar("old", "-")}
+        INSERT OR IGNORE INTO patient_summary (px_id) SELECT new.px_id WHERE new.px_id IS NOT NULL;
+        {_sql_resumen_sumar("new", "+")}
+        {_sql_resumen_refrescar("old")}
+        {_sql_resumen_refrescar("new")}
+    END""")
+
+def condiciones_categorias(valor, categorias):
+    """{columna: condición SQL} de cada categoría de `valor` (rangos por índice); NULL no cae en ninguna"""
+    condiciones, superior = {}, None
+    for columna, inferior in categorias:
+        partes = [f"{valor} IS NOT NULL"]
+        if inferior is not None:
+            partes.append(f"{valor} >= {inferior}")
+        if superior is not None:
+            partes.append(f"{valor} < {superior}")
+        condiciones[columna] = " AND ".join(partes)
+        superior = inferior
+    return condiciones
+
+def _casos(valor, categorias):
+    return {c: f"(CASE WHEN {cond} THEN 1 ELSE 0 END)" for c, cond in condiciones_categorias(valor, categorias).items()}
+
+def _aportes_rollup(ref):
+    """Expresiones SQL de lo que aporta la consulta `ref` (new/old/r) a su fila del rollup"""
+    return {
+        "consultas": "1",
+        "tfg_n": f"({ref}.tfg IS NOT NULL)",
+        "tfg_suma": f"COALESCE({ref}.tfg, 0)",
+        **_casos(f"{ref}.tfg", ETAPAS_KDIGO),
+        "fevi_n": f"({ref}.fevi IS NOT NULL)",
+        "fevi_suma": f"COALESCE({ref}.fevi, 0)",
+        **_casos(f"{ref}.fevi", CATEGORIAS_FEVI),
+    }
+
+def _clave_rollup(ref):
+    return f"COALESCE(substr({ref}.date, 1, 7), ''), COALESCE({ref}.doctor, '')"
+
+def _sql_rollup_sumar(ref, signo):
+    aportes = _aportes_rollup(ref)
+    return f"""INSERT INTO clinical_rollup_mes (mes, doctor, {', '.join(aportes)})
+        VALUES ({_clave_rollup(ref)}, {', '.join(f"{signo}{e}" for e in aportes.values())})
+        ON CONFLICT (mes, doctor) DO UPDATE SET {', '.join(f"{c} = {c} + excluded.{c}" for c in aportes)};"""
+
+def _sql_rollup_alerta(ref, signo):
+    return f"""INSERT INTO clinical_rollup_mes (mes, doctor, con_alerta) VALUES ({_clave_rollup(ref)}, {signo}1)
+        ON CONFLICT (mes, doctor) DO UPDATE SET con_alerta = con_alerta + excluded.con_alerta;"""
+
+def _sql_rollup_limpiar(ref):
+    # Las alertas guardan mes y médico de cuando se barrieron: la fila queda mientras tenga alguna
+    return f"""DELETE FROM clinical_rollup_mes
+        WHERE (mes, doctor) = ({_clave_rollup(ref)}) AND consultas <= 0 AND con_alerta <= 0;"""
+
+def _m012_rollup_clinico(c):
+    """
+    Conteos preagregados de consultas por mes × médico: etapas KDIGO y
+    categorías de FEVI (CASE sobre cada consulta), sumas para los promedios y
+    consultas con al menos una alerta. Triggers en clinical_records y
+    clinical_alerts lo mantienen; el tablero poblacional (tablero.py) se lee
+    de aquí en lugar de recorrer el historial. Los índices de TFG y FEVI del
+    resumen por paciente cuentan la etapa actual de cada paciente por rangos.
+    """
+    aportes = _aportes_rollup("r")
+    c.execute(f"""CREATE TABLE IF NOT EXISTS clinical_rollup_mes (
+        mes TEXT NOT NULL,
+        doctor TEXT NOT NULL,
+        {", ".join(f"{col} {'REAL' if col.endswith('_suma') else 'INTEGER'} NOT NULL DEFAULT 0" for col in aportes)},
+        con_alerta INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (mes, doctor)) WITHOUT ROWID""")
+    for col in SERIES_RESUMEN:
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_summary_{col} ON patient_summary({col})")
+    c.execute(f"""INSERT INTO clinical_rollup_mes (mes, doctor, {', '.join(aportes)})
+        SELECT {_clave_rollup("r")}, {', '.join(f"TOTAL({e})" for e in aportes.values())}
+        FROM clinical_records r GROUP BY 1, 2""")
+    c.execute(f"""INSERT INTO clinical_rollup_mes (mes, doctor, con_alerta)
+        SELECT {_clave_rollup("a")}, COUNT(DISTINCT a.record_id) FROM clinical_alerts a WHERE true GROUP BY 1, 2
+        ON CONFLICT (mes, doctor) DO UPDATE SET con_alerta = excluded.con_alerta""")
+
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_records_rollup_ai AFTER INSERT ON clinical_records BEGIN
+        {_sql_rollup_sumar("new", "+")}
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_records_rollup_ad AFTER DELETE ON clinical_records BEGIN
+        {_sql_rollup_sumar("old", "-")}
+        {_sql_rollup_limpiar("old")}
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_records_rollup_au AFTER UPDATE OF date, doctor, tfg, fevi
+        ON clinical_records BEGIN
+        {_sql_rollup_sumar("old", "-")}
+        {_sql_rollup_sumar("new", "+")}
+        {_sql_rollup_limpiar("old")}
+    END""")
+    # Consultas con alerta, no alertas: solo cuenta la primera (o la última en irse) de cada registro
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_alerts_rollup_ai AFTER INSERT ON clinical_alerts
+        WHEN NOT EXISTS (SELECT 1 FROM clinical_alerts WHERE record_id = new.record_id AND id <> new.id) BEGIN
+        {_sql_rollup_alerta("new", "+")}
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_alerts_rollup_ad AFTER DELETE ON clinical_alerts
+        WHEN NOT EXISTS (SELECT 1 FROM clinical_alerts WHERE record_id = old.record_id) BEGIN
+        {_sql_rollup_alerta("old", "-")}
+        {_sql_rollup_limpiar("old")}
+    END""")
+
+def sql_particion(ref):
+    """Partición del espejo columnar ('YYYY-MM') de la fila `ref`"""
+    return f"COALESCE(NULLIF(substr({ref}.date, 1, 7), ''), '{PARTICION_SIN_FECHA}')"
+
+def _sql_particion_pendiente(ref):
+    return f"""INSERT INTO espejo_pendientes (particion, id_min, version) VALUES ({sql_particion(ref)}, {ref}.id, 1)
+        ON CONFLICT (particion) DO UPDATE SET id_min = MIN(id_min, excluded.id_min), version = version + 1;"""
+
+def _crear_trigger_espejo_au(c):
+    """
+    Anota las particiones solo si la fila cambió de verdad (alguna columna
+    IS NOT su valor anterior): reescribir el mismo valor, como un backfill de
+    riesgo que repite el puntaje, no obliga a reescribir la partición. La
+    lista de columnas se fija al crearlo: una migración que agregue columnas a
+    clinical_records debe volver a llamarlo (tests/test_triggers.py lo verifica).
+    """
+    cambios = " OR ".join(f"old.{col} IS NOT new.{col}" for col in sorted(_columnas(c, "clinical_records")))
+    c.execute("DROP TRIGGER IF EXISTS clinical_records_espejo_au")
+    c.execute(f"""CREATE TRIGGER clinical_records_espejo_au AFTER UPDATE ON clinical_records
+        WHEN {cambios} BEGIN
+        {_sql_particion_pendiente("old")}
+        {_sql_particion_pendiente("new")}
+    END""")
+
+def _m013_espejo_pendientes(c):
+    """
+    Particiones del espejo columnar con filas modificadas o borradas. El
+    espejo agrega las filas nuevas desde su marca de agua; las que cambian
+    después de copiadas se anotan aquí (con el menor id afectado) para que la
+    sincronización reescriba solo esas particiones.
+    """
+    c.execute("""CREATE TABLE IF NOT EXISTS espejo_pendientes (
+        particion TEXT PRIMARY KEY,
+        id_min INTEGER NOT NULL,
+        version INTEGER NOT NULL) WITHOUT ROWID""")
+    _crear_trigger_espejo_au(c)
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS clinical_records_espejo_ad AFTER DELETE ON clinical_records BEGIN
+        {_sql_particion_pendiente("old")}
+    END""")
+
+# El índice de cada migración + 1 es la versión que deja aplicada.
+# Nunca reordenar ni editar una migración ya publicada: agregar una nueva.
+MIGRACIONES = [
+    _m001_esquema_base,
+    _m002_usuario_admin,
+    _m003_indices_y_busqueda,
+    _m004_indice_fecha,
+    _m005_rollups_auditoria,
+    _m006_segmentos_archivo,
+    _m007_alertas,
+    _m008_variables_modelo,
+    _m009_version_modelo,
+    _m010_versiones_tablas,
+    _m011_resumen_pacientes,
+    _m012_rollup_clinico,
+    _m013_espejo_pendientes,
+]
+
+def migrar(conn):
+    """
+    Aplica las migraciones pendientes según PRAGMA user_version.
+    Cada migración corre en su propia transacción junto con el cambio de versión.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRACIONES):
+        return version
+
+    for numero, migracion in enumerate(MIGRACIONES[version:], start=version + 1):
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # Otro proceso pudo haber migrado mientras esperábamos el lock
+            if c.execute("PRAGMA user_version").fetchone()[0] >= numero:
+                conn.commit()
+                continue
+            migracion(c)
+            c.execute(f"PRAGMA user_version = {numero}")
+            conn.commit()
+            print(f"Migración {numero} aplicada: {migracion.__name__}")
+        except Exception:
+            conn.rollback()
+            raise
+    return len(MIGRACIONES)
+
+def compactar(df):
+    """Reduce la memoria del DataFrame: float32 para signos vitales/laboratorio y categorías"""
+    return df.astype({c: t for c, t in DTYPES_COMPACTOS.items() if c in df.columns})
+
+def consulta_fts(texto):
+    """
+    Convierte el texto del buscador en una consulta FTS5 segura: cada palabra
+    se cita (evita que '-' u operadores se interpreten) y se busca por prefijo.
+    """
+    terminos = [t.replace('"', '""') for t in texto.split()]
+    return " ".join(f'"{t}"*' for t in terminos if t)
+
+# =============================================
+# CONEXIONES
+# =============================================
+def abrir_conexion(path, solo_lectura=False):
+    """
+    Abre una conexión configurada para acceso concurrente: WAL permite que
+    los lectores no bloqueen al escritor y synchronous=NORMAL evita un fsync
+    por transacción (sigue siendo seguro ante caídas del proceso en WAL).
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    if not solo_lectura:
+        conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    if solo_lectura:
+        conn.execute("PRAGMA query_only = 1")
+    return conn
+
+def es_bloqueo(error):
+    return isinstance(error, sqlite3.OperationalError) and (
+        "locked" in str(error) or "busy" in str(error))
+
+def con_reintentos(fn, reintentos=REINTENTOS_LOCK):
+    """Ejecuta fn() reintentando con backoff exponencial + jitter si la base está bloqueada"""
+    for intento in range(reintentos + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not es_bloqueo(e) or intento == reintentos:
+                raise
+            time.sleep(BACKOFF_BASE_S * (2 ** intento) * (0.5 + random.random()))
+
+class PoolLectores:
+    """
+    Pool acotado de conexiones de solo lectura. Las conexiones se crean bajo
+    demanda hasta `maximo`; si todas están en uso, la petición espera.
+    """
+    def __init__(self, path, maximo=LECTORES_MAX):
+        self.path = path
+        self.maximo = maximo
+        self._libres = queue.LifoQueue()
+        self._creadas = 0
+        self._lock = threading.Lock()
+
+    def _obtener(self):
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._creadas < self.maximo:
+                self._creadas += 1
+                crear = True
+            else:
+                crear = False
+        if crear:
+            try:
+                return abrir_conexion(self.path, solo_lectura=True)
+            except Exception:
+                with self._lock:
+                    self._creadas -= 1
+                raise
+        return self._libres.get()
+
+    @contextmanager
+    def conexion(self):
+        conn = self._obtener()
+        try:
+            yield conn
+        finally:
+            # Nunca devolver al pool una conexión con una lectura abierta
+            if conn.in_transaction:
+                conn.rollback()
+            self._libres.put(conn)
+
+    def cerrar(self):
+        while True:
+            try:
+                self._libres.get_nowait().close()
+            except queue.Empty:
+                break
+
+# =============================================
+# CACHÉ DE CONSULTAS VERSIONADA
+# =============================================
+class CacheConsultas:
+    """
+    LRU acotado por bytes de DataFrames, compartido por todas las sesiones del
+    proceso. Cada resultado guarda las versiones de escritura de las tablas
+    que leyó; solo se entrega si siguen siendo las actuales, así que nunca
+    devuelve datos anteriores a una escritura confirmada.
+    """
+    def __init__(self, max_bytes=CACHE_CONSULTAS_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._resultados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, versiones):
+        with self._lock:
+            entrada = self._resultados.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] != versiones:
+                # Obsoleta: se libera ya en lugar de esperar a que la expulse el LRU
+                del self._resultados[clave]
+                self.bytes -= entrada[2]
+                return None
+            self._resultados.move_to_end(clave)
+            return entrada[1]
+
+    def guardar(self, clave, versiones, df):
+        tamano = int(df.memory_usage(index=True, deep=True).sum())
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._resultados.pop(clave, None)
+            if anterior is not None:
+                self.bytes -= anterior[2]
+            self._resultados[clave] = (versiones, df, tamano)
+            self.bytes += tamano
+            while self.bytes > self.max_bytes:
+                _, expulsada = self._resultados.popitem(last=False)
+                self.bytes -= expulsada[2]
+
+    def vaciar(self):
+        with self._lock:
+            self._resultados.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._resultados)
+
+# =============================================
+# AUDITORÍA CON COMMIT AGRUPADO
+# =============================================
+SQL_AUDITORIA = "INSERT INTO audit_logs (timestamp, user, action, details) VALUES (?,?,?,?)"
+
+def evento_auditoria(user, action, details):
+    return (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), user, action, details)
+
+class EscritorAuditoria:
+    """
+    Hilo de fondo que agrupa los eventos de auditoría de todas las sesiones
+    y los escribe en una sola transacción por lote (un fsync por lote en vez
+    de uno por clic). La cola es acotada: si se llena, el evento se escribe de
+    forma síncrona en lugar de perderse. Al cerrar se vacía la cola.
+    """
+    _FIN = object()
+
+    def __init__(self, db, maximo=AUDITORIA_COLA_MAX):
+        self.db = db
+        self.cola = queue.Queue(maxsize=maximo)
+        self._hilo = threading.Thread(target=self._bucle, name="escritor-auditoria", daemon=True)
+        self._hilo.start()
+
+    def registrar(self, evento):
+        if not self._hilo.is_alive():
+            self._escribir([evento])
+            return
+        try:
+            self.cola.put(evento, timeout=AUDITORIA_ESPERA_S)
+        except queue.Full:
+            self._escribir([evento])
+
+    def _siguiente_lote(self):
+        lote = [self.cola.get()]
+        limite = time.monotonic() + AUDITORIA_ESPERA_S
+        while len(lote) < AUDITORIA_LOTE_MAX and lote[-1] is not self._FIN:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self.cola.get(timeout=restante) if restante > 0 else self.cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        while True:
+            lote = self._siguiente_lote()
+            eventos = [e for e in lote if e is not self._FIN]
+            try:
+                if eventos:
+                    self._escribir(eventos)
+            except sqlite3.Error as e:
+                print(f"Auditoría: no se pudieron escribir {len(eventos)} eventos: {e}")
+            finally:
+                for _ in lote:
+                    self.cola.task_done()
+            if len(eventos) < len(lote):
+                return
+
+    def _escribir(self, eventos):
+        with self.db.transaccion() as conn:
+            conn.executemany(SQL_AUDITORIA, eventos)
+
+    def flush(self):
+        """Espera a que todos los eventos encolados estén confirmados en disco"""
+        if self._hilo.is_alive():
+            self.cola.join()
+
+    def cerrar(self):
+        if self._hilo.is_alive():
+            self.cola.put(self._FIN)
+            self._hilo.join()
+
+# =============================================
+# CAPA DE ACCESO A DATOS
+# =============================================
+class AppDatabase:
+    def __init__(self, path=DB_PATH, lectores=LECTORES_MAX):
+        self.path = path
+        # SQLite admite un solo escritor: se serializa en el proceso con un lock
+        # y entre procesos con BEGIN IMMEDIATE + busy_timeout + reintentos
+        self._escritor = abrir_conexion(path)
+        self._lock_escritura = threading.RLock()
+        self.init_db()
+        self.fts = self._escritor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='clinical_records_fts'").fetchone() is not None
+        self.lectores = PoolLectores(path, lectores)
+        self.cache = CacheConsultas()
+        self.auditoria = EscritorAuditoria(self)
+        atexit.register(self.cerrar)
+
+    def init_db(self):
+        with self._lock_escritura:
+            con_reintentos(lambda: migrar(self._escritor))
+
+    @contextmanager
+    def lectura(self):
+        """Conexión de solo lectura del pool; no bloquea a los escritores"""
+        with self.lectores.conexion() as conn:
+            yield conn
+
+    @contextmanager
+    def transaccion(self):
+        """
+        Transacción de escritura: toma el lock de escritura (BEGIN IMMEDIATE)
+        antes de ejecutar, de modo que un "database is locked" solo puede
+        ocurrir al inicio y se reintenta con backoff.
+        """
+        with self._lock_escritura:
+            conn = self._escritor
+            con_reintentos(lambda: conn.execute("BEGIN IMMEDIATE"))
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def ejecutar(self, sql, params=(), auditoria=None):
+        """
+        Ejecuta una sentencia de escritura en su propia transacción. Si se da
+        `auditoria` = (user, action, details), el evento se confirma en la
+        misma transacción que el cambio.
+        """
+        with self.transaccion() as conn:
+            filas = conn.execute(sql, params).rowcount
+            if auditoria:
+                conn.execute(SQL_AUDITORIA, evento_auditoria(*auditoria))
+            return filas
+
+    def guardar_consulta(self, registro, usuario):
+        """
+        Inserta una consulta (dict columna -> valor) y su evento de auditoría
+        como una sola unidad de trabajo. Devuelve el id del registro.
+        """
+        columnas = list(registro)
+        with self.transaccion() as conn:
+            cur = conn.execute(
+                f"INSERT INTO clinical_records ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})",
+                [registro[c] for c in columnas])
+            conn.execute(SQL_AUDITORIA, evento_auditoria(
+                usuario, "Consulta Creada", f"Paciente: {registro['px_name']} ({registro['px_id']})"))
+            return cur.lastrowid
+
+    def consultar(self, sql, params=()):
+        with self.lectura() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def consultar_uno(self, sql, params=()):
+        with self.lectura() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def leer_df(self, sql, params=None, tablas=None):
+        """
+        DataFrame de una consulta. Si se dan las `tablas` que lee, el resultado
+        se sirve desde la caché mientras ninguna de ellas haya sido escrita.
+        """
+        if not tablas:
+            with self.lectura() as conn:
+                return pd.read_sql(sql, conn, params=params if params else None)
+
+        tablas = tuple(sorted(set(tablas)))
+        clave = (sql, tuple(params or ()))
+        with self.lectura() as conn:
+            df = self.cache.obtener(clave, self._versiones(conn, tablas))
+            if df is None:
+                # Versiones y datos de la misma instantánea de lectura
+                conn.execute("BEGIN")
+                try:
+                    versiones = self._versiones(conn, tablas)
+                    df = pd.read_sql(sql, conn, params=params if params else None)
+                finally:
+                    conn.rollback()
+                self.cache.guardar(clave, versiones, df)
+        return df.copy()
+
+    def version_tabla(self, tabla):
+        """Versión de escritura actual de `tabla` (cambia con cada INSERT/UPDATE/DELETE)"""
+        with self.lectura() as conn:
+            return self._versiones(conn, (tabla,))[0]
+
+    @staticmethod
+    def _versiones(conn, tablas):
+        marcas = ", ".join("?" * len(tablas))
+        versiones = dict(conn.execute(
+            f"SELECT tabla, version FROM table_versions WHERE tabla IN ({marcas})", tablas).fetchall())
+        faltantes = [t for t in tablas if t not in versiones]
+        if faltantes:
+            raise ValueError(f"Tablas sin versión de escritura: {', '.join(faltantes)}")
+        return tuple(versiones[t] for t in tablas)
+
+    def filtro_historial(self, texto=None, desde=None, hasta=None, doctor=None):
+        """
+        Origen y condiciones del historial (alias r = clinical_records).
+        Filtra por nombre, cédula u observaciones (prefijo, vía FTS si está
+        disponible), rango de fechas inclusive y médico.
+        Devuelve (origen, condiciones, params).
+        """
+        origen = "clinical_records r"
+        condiciones, params = [], []
+
+        if texto and self.fts:
+            origen = "clinical_records_fts f JOIN clinical_records r ON r.id = f.rowid"
+            condiciones.append("clinical_records_fts MATCH ?")
+            params.append(consulta_fts(texto))
+        elif texto:
+            patron = f"%{texto}%"
+            condiciones.append("(r.px_name LIKE ? OR r.px_id LIKE ? OR r.obs LIKE ?)")
+            params += [patron, patron, patron]
+
+        if desde:
+            condiciones.append("r.date >= ?")
+            params.append(str(desde))
+        if hasta:
+            condiciones.append("r.date <= ?")
+            params.append(str(hasta))
+        if doctor:
+            condiciones.append("r.doctor = ?")
+            params.append(doctor)
+        return origen, condiciones, params
+
+    def pagina_historial(self, texto=None, cursor=None, tamano=HISTORIAL_PAGINA,
+                         columnas=HISTORIAL_COLUMNAS):
+        """
+        Una página del historial ordenada por (date, id) descendente.
+        Paginación por keyset: `cursor` es el (date, id) del último registro de
+        la página anterior, así el costo no crece con el número de página.
+        Filtra por nombre, cédula u observaciones (prefijo) si se da `texto`.
+        Devuelve (DataFrame, cursor_siguiente | None).
+        """
+        columnas = list(columnas) + [c for c in ("id", "date") if c not in columnas]
+        origen, condiciones, params = self.filtro_historial(texto)
+
+        if cursor:
+            condiciones.append("(r.date, r.id) < (?, ?)")
+            params += list(cursor)
+
+        sql = f"SELECT {', '.join('r.' + c for c in columnas)} FROM {origen}"
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+        sql += " ORDER BY r.date DESC, r.id DESC LIMIT ?"
+        params.append(tamano + 1)
+
+        df = compactar(self.leer_df(sql, params, tablas=("clinical_records",)))
+        siguiente = None
+        if len(df) > tamano:
+            df = df.iloc[:tamano]
+            siguiente = (df['date'].iloc[-1], int(df['id'].iloc[-1]))
+        return df, siguiente
+
+    def estadisticas_auditoria(self, desde=None, hasta=None, usuario=None, accion=None,
+                               granularidad="dia"):
+        """
+        Conteos de auditoría desde las tablas de rollup.
+        `desde`/`hasta` son fechas (inclusive) o textos 'YYYY-MM-DD[ HH]'.
+        granularidad: 'dia' | 'hora' -> filas (periodo, user, action, n);
+        None -> totales por (user, action) sobre todo el rango.
+        """
+        tabla, col, largo = (("audit_rollup_hora", "hora", 13) if granularidad == "hora"
+                             else ("audit_rollup_dia", "dia", 10))
+        condiciones, params = [], []
+        if desde:
+            condiciones.append(f"{col} >= ?")
+            params.append(str(desde)[:largo])
+        if hasta:
+            # Inclusive: todo lo que empiece por el límite superior cuenta
+            condiciones.append(f"{col} <= ?")
+            params.append(str(hasta)[:largo] + "~")
+        if usuario:
+            condiciones.append("user = ?")
+            params.append(usuario)
+        if accion:
+            condiciones.append("action = ?")
+            params.append(accion)
+        where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+        if granularidad is None:
+            sql = f"SELECT user, action, SUM(n) AS n FROM {tabla}{where} GROUP BY user, action ORDER BY n DESC"
+        else:
+            sql = f"SELECT {col} AS periodo, user, action, n FROM {tabla}{where} ORDER BY {col}"
+        # Los rollups solo cambian con audit_logs (trigger de INSERT)
+        return self.leer_df(sql, params, tablas=("audit_logs",))
+
+    def marca_agua(self, nombre):
+        """Último rowid procesado por el barrido incremental `nombre` (0 si nunca corrió)"""
+        fila = self.consultar_uno("SELECT ultimo_id FROM sweep_watermarks WHERE nombre = ?", (nombre,))
+        return fila[0] if fila else 0
+
+    @staticmethod
+    def fijar_marca_agua(conn, nombre, ultimo_id):
+        """Avanza la marca de agua dentro de la transacción que confirma el lote"""
+        conn.execute("""INSERT INTO sweep_watermarks (nombre, ultimo_id, actualizado) VALUES (?,?,?)
+            ON CONFLICT (nombre) DO UPDATE SET ultimo_id = excluded.ultimo_id, actualizado = excluded.actualizado""",
+            (nombre, ultimo_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+    def log_action(self, user, action, details):
+        """Encola el evento para el escritor de auditoría (no bloquea la interfaz)"""
+        self.auditoria.registrar(evento_auditoria(user, action, details))
+
+    def cerrar(self):
+        self.auditoria.cerrar()
+        self.lectores.cerrar()
+        with self._lock_escritura:
+            self._escritor.close()
@@ -0,0 +1,163 @@
+"""
+Reentrenamiento incremental (out-of-core) del modelo de riesgo ERC a partir
+de clinical_records. Los registros se leen de SQLite en bloques de tamaño
+fijo, así que la memoria no depende del tamaño de la tabla:
+
+  1. pasada de estadísticas: media y varianza de cada variable (Chan et al.)
+  2. pasadas de ajuste: SGDClassifier(loss="log_loss").partial_fit por bloque
+  3. pasada de evaluación sobre el conjunto reservado (id % 10 == 0)
+
+El escalado se incorpora a los coeficientes, de modo que la versión publicada
+en el registro de modelos usa las variables en sus unidades originales.
+Etiqueta: ERC = TFG < 60 ml/min/1.73m² (KDIGO G3a o peor).
+
+Con --espejo los bloques se leen del espejo columnar (espejo.py), que se
+sincroniza antes de empezar: las pasadas no tocan el archivo SQLite.
+
+Uso por línea de comandos:
+    python entrenamiento.py [--lote 50000] [--epocas 3] [--activar] [--espejo]
+"""
+import argparse
+import numpy as np
+import pyarrow.dataset as ds
+from sklearn.linear_model import SGDClassifier
+from database import AppDatabase, DB_PATH
+from espejo import lotes, sincronizar
+from registro_modelos import activar, modelo_activo, registrar
+from riesgo import VARIABLES
+
+LOTE = 50_000
+EPOCAS = 3
+UMBRAL_TFG = 60
+RESERVA_MODULO = 10  # id % 10 == 0 -> evaluación
+BINS_AUC = 1000
+
+def _bloques_espejo(db, lote, reservados):
+    columnas = ["id", *VARIABLES.values(), "tfg"]
+    # IS NOT NULL empujado a los row groups; el reparto por id % RESERVA_MODULO se hace en NumPy
+    completas = ds.field("tfg").is_valid()
+    for c in VARIABLES.values():
+        completas = completas & ds.field(c).is_valid()
+    for b in lotes(db, columnas, completas, lote):
+        datos = np.column_stack([b.column(i).to_numpy(zero_copy_only=False).astype(np.float64)
+                                 for i in range(b.num_columns)])
+        datos = datos[(datos[:, 0] % RESERVA_MODULO == 0) == reservados]
+        if len(datos):
+            yield datos[:, 1:-1], (datos[:, -1] < UMBRAL_TFG).astype(np.int8)
+
+def _bloques(db, lote, reservados, espejo=False):
+    """(X, y) por bloques; `reservados` elige el conjunto de evaluación o el de ajuste"""
+    if espejo:
+        yield from _bloques_espejo(db, lote, reservados)
+        return
+    columnas = ", ".join(VARIABLES.values())
+    completas = " AND ".join(f"{c} IS NOT NULL" for c in [*VARIABLES.values(), "tfg"])
+    condicion = "=" if reservados else "!="
+    ultimo = 0
+    while True:
+        filas = db.consultar(
+            f"""SELECT id, {columnas}, tfg FROM clinical_records
+                WHERE id > ? AND {completas} AND id % {RESERVA_MODULO} {condicion} 0
+                ORDER BY id LIMIT ?""", (ultimo, lote))
+        if not filas:
+            return
+        datos = np.asarray(filas, dtype=np.float64)
+        ultimo = int(datos[-1, 0])
+        yield datos[:, 1:-1], (datos[:, -1] < UMBRAL_TFG).astype(np.int8)
+
+def estadisticas(db, lote=LOTE, espejo=False):
+    """Media y desviación estándar por variable combinando bloques (sin cargar la tabla)"""
+    n, media, m2 = 0, None, None
+    for X, _ in _bloques(db, lote, reservados=False, espejo=espejo):
+        nb = len(X)
+        media_b, var_b = X.mean(axis=0), X.var(axis=0)
+        if media is None:
+            n, media, m2 = nb, media_b, var_b * nb
+            continue
+        delta = media_b - media
+        total = n + nb
+        media = media + delta * nb / total
+        m2 = m2 + var_b * nb + delta ** 2 * n * nb / total
+        n = total
+    if not n:
+        raise ValueError("No hay registros completos para entrenar")
+    desv = np.sqrt(m2 / n)
+    desv[desv == 0] = 1.0
+    return n, media, desv
+
+def _evaluar(db, lote, puntuar, espejo=False):
+    """Log-loss, exactitud y AUC (por histograma) sobre el conjunto reservado"""
+    n = perdida = aciertos = 0
+    hist_pos = np.zeros(BINS_AUC)
+    hist_neg = np.zeros(BINS_AUC)
+    for X, y in _bloques(db, lote, reservados=True, espejo=espejo):
+        p = np.clip(puntuar(X), 1e-12, 1 - 1e-12)
+        perdida += -(y * np.log(p) + (1 - y) * np.log(1 - p)).sum()
+        aciertos += ((p >= 0.5) == y).sum()
+        n += len(y)
+        bins = np.minimum((p * BINS_AUC).astype(int), BINS_AUC - 1)
+        hist_pos += np.bincount(bins[y == 1], minlength=BINS_AUC)
+        hist_neg += np.bincount(bins[y == 0], minlength=BINS_AUC)
+    if not n:
+        return {}
+    # AUC = P(score positivo > score negativo), empates dentro del bin cuentan 1/2
+    neg_debajo = np.cumsum(hist_neg) - hist_neg
+    pares = hist_pos.sum() * hist_neg.sum()
+    auc = float(((hist_pos * neg_debajo).sum() + 0.5 * (hist_pos * hist_neg).sum()) / pares) if pares else None
+    return {"n": int(n), "logloss": float(perdida / n), "exactitud": float(aciertos / n), "auc": auc}
+
+def entrenar(db, lote=LOTE, epocas=EPOCAS, publicar=True, activar_version=False, espejo=False):
+    """
+    Ajusta un modelo logístico por SGD en streaming, lo evalúa contra el
+    reservado (junto con el modelo activo, como referencia) y lo publica como
+    nueva versión del registro. Devuelve (versión | None, métricas).
+    """
+    if espejo:
+        sincronizar(db)
+    n, media, desv = estadisticas(db, lote, espejo)
+    modelo = SGDClassifier(loss="log_loss", penalty="l2", alpha=1e-4, random_state=42)
+    rng = np.random.default_rng(42)
+    for _ in range(epocas):
+        for X, y in _bloques(db, lote, reservados=False, espejo=espejo):
+            orden = rng.permutation(len(y))
+            modelo.partial_fit((X[orden] - media) / desv, y[orden], classes=[0, 1])
+
+    # Deshacer el escalado: w·(x - μ)/σ + b  ==  (w/σ)·x + (b - Σ w μ/σ)
+    w = modelo.coef_[0] / desv
+    b = float(modelo.intercept_[0] - (modelo.coef_[0] * media / desv).sum())
+    variables = list(VARIABLES)
+
+    def puntuar_nuevo(X):
+        return 1.0 / (1.0 + np.exp(-(X @ w + b)))
+
+    activo = modelo_activo()
+    orden_activo = [variables.index(v) for v in activo.variables]
+    metricas = _evaluar(db, lote, puntuar_nuevo, espejo)
+    referencia = _evaluar(db, lote, lambda X: activo.puntuar_matriz(X[:, orden_activo]), espejo)
+    metricas = {**metricas, "filas_entrenamiento": int(n), "epocas": epocas,
+                "etiqueta": f"tfg < {UMBRAL_TFG}",
+                f"logloss_{activo.version}": referencia.get("logloss"),
+                f"auc_{activo.version}": referencia.get("auc")}
+
+    if not publicar:
+        return None, metricas
+    version = registrar(variables, w, b, metadatos={"origen": "SGDClassifier (streaming)", **metricas})
+    if activar_version:
+        activar(version)
+    return version, metricas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reentrenamiento incremental del modelo de riesgo ERC")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--lote", type=int, default=LOTE)
+    parser.add_argument("--epocas", type=int, default=EPOCAS)
+    parser.add_argument("--activar", action="store_true", help="Activar la nueva versión al terminar")
+    parser.add_argument("--sin-publicar", action="store_true", help="Solo evaluar, sin registrar la versión")
+    parser.add_argument("--espejo", action="store_true", help="Leer del espejo columnar en vez de SQLite")
+    args = parser.parse_args()
+    version, metricas = entrenar(AppDatabase(args.db), args.lote, args.epocas,
+                                 publicar=not args.sin_publicar, activar_version=args.activar, espejo=args.espejo)
+    for clave, valor in metricas.items():
+        print(f"{clave}: {valor}")
+    if version:
+        print(f"Versión publicada: {version}{' (activa)' if args.activar else ''}")
@@ -0,0 +1,391 @@
+"""
+Espejo columnar de clinical_records: archivos Parquet particionados por mes
+(carpetas `<base>_espejo/particion=YYYY-MM`) para las lecturas analíticas
+(exportaciones, entrenamiento, análisis de cohorte). Se leen con
+pyarrow.dataset, que solo abre las columnas pedidas, descarta particiones
+enteras por rango de fechas y empuja el resto de los filtros a las
+estadísticas de cada row group, así los recorridos pesados no compiten con
+las escrituras sobre el archivo SQLite.
+
+La sincronización es incremental: agrega las filas con id mayor que la marca
+de agua (un archivo por partición y bloque) y reescribe solo las particiones
+anotadas en espejo_pendientes por UPDATE/DELETE posteriores a la copia. Las
+particiones con demasiados archivos pequeños se compactan en la misma pasada.
+Si se borra la carpeta del espejo, la siguiente sincronización lo reconstruye
+completo. Las sincronizaciones se serializan con un lock del sistema
+operativo sobre un archivo del espejo, también entre procesos (la app y un
+cron, por ejemplo).
+
+Los lectores abren los archivos de cada partición antes de leerla: una
+reescritura o compactación concurrente los reemplaza, pero los ya abiertos
+siguen legibles hasta terminar, así que nunca se mezclan filas viejas y nuevas.
+
+La exportación del historial de la app y los reportes PDF por lote leen con
+historial(), que usa el espejo solo si está al día (al_dia) y si no vuelve a
+SQLite; las exportaciones y el entrenamiento por línea de comandos lo eligen
+con --espejo.
+
+Uso por línea de comandos:
+    python espejo.py sincronizar [--lote 50000]
+    python espejo.py estado
+    python espejo.py consultar [--columnas px_id,date,tfg] [--desde AAAA-MM-DD] [--hasta ...] [--doctor ...] [--salida x.csv]
+"""
+import argparse
+import os
+import threading
+import time
+from contextlib import contextmanager
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from database import AppDatabase, DB_PATH, PARTICION_SIN_FECHA, compactar, sql_particion
+from exportacion import BLOQUE, COLUMNAS_HISTORIAL, arreglo_arrow, tipos_arrow
+from exportacion import bloques_historial as bloques_historial_sqlite
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+MARCA = "espejo"
+LOTE = 50_000
+ARCHIVOS_MAX_PARTICION = 16  # más archivos que esto: se compacta en uno
+CAMPO_PARTICION = "particion"
+ARCHIVO_LOCK = "_sincronizar.lock"  # el prefijo '_' lo excluye del dataset
+ESPERA_REESCRITURA_S = 0.05
+
+_lock_sincronizar = threading.Lock()
+
+def directorio_espejo(db):
+    """Junto a la base y con su nombre: la marca de agua está en la base, el espejo no se comparte"""
+    return os.path.splitext(os.path.abspath(db.path))[0] + "_espejo"
+
+def esquema(db):
+    """Esquema Arrow de clinical_records según los tipos declarados en SQLite"""
+    columnas = [fila[1] for fila in db.consultar("PRAGMA table_info(clinical_records)")]
+    return pa.schema(list(zip(columnas, tipos_arrow(db, "clinical_records", columnas))))
+
+def _tabla(filas, esq):
+    return pa.Table.from_arrays([arreglo_arrow(list(v), t) for v, t in zip(zip(*filas), esq.types)], schema=esq)
+
+def _carpeta(db, particion):
+    return os.path.join(directorio_espejo(db), f"{CAMPO_PARTICION}={particion}")
+
+def _nombre(id_min, id_max):
+    return f"parte_{id_min:012d}_{id_max:012d}.parquet"
+
+def _archivos(carpeta):
+    return sorted(f for f in os.listdir(carpeta) if f.endswith(".parquet")) if os.path.isdir(carpeta) else []
+
+def _particiones(db):
+    raiz = directorio_espejo(db)
+    prefijo = f"{CAMPO_PARTICION}="
+    return sorted(d[len(prefijo):] for d in os.listdir(raiz) if d.startswith(prefijo)) if os.path.isdir(raiz) else []
+
+def _rango(nombre):
+    """'parte_000000000010_000000000020.parquet' -> (10, 20)"""
+    partes = nombre[:-len(".parquet")].split("_")
+    return int(partes[1]), int(partes[2])
+
+def _id_min(nombre):
+    return _rango(nombre)[0]
+
+def _publicar(tabla, ruta):
+    """Escribe en un temporal y publica con un rename atómico (un lector nunca ve un archivo a medias)"""
+    carpeta, nombre = os.path.split(ruta)
+    os.makedirs(carpeta, exist_ok=True)
+    tmp = os.path.join(carpeta, f"_{nombre}.tmp")  # el prefijo '_' lo excluye del dataset
+    pq.write_table(tabla, tmp, compression="zstd")
+    os.replace(tmp, ruta)
+
+# =============================================
+# SINCRONIZACIÓN
+# =============================================
+@contextmanager
+def _exclusivo(db):
+    """Un solo sincronizador por espejo: el lock del sistema operativo se libera solo si el proceso muere"""
+    raiz = directorio_espejo(db)
+    os.makedirs(raiz, exist_ok=True)
+    with _lock_sincronizar, open(os.path.join(raiz, ARCHIVO_LOCK), "a+b") as f:
+        if os.name == "nt":
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK se rinde tras 10 s; otro proceso sigue sincronizando
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def _limpiar_huerfanos(db, ultimo):
+    """Archivos de una sincronización interrumpida antes de avanzar la marca: se vuelven a copiar"""
+    for particion in _particiones(db):
+        carpeta = _carpeta(db, particion)
+        for nombre in os.listdir(carpeta):
+            if nombre.endswith(".tmp") or (nombre.endswith(".parquet") and _id_min(nombre) > ultimo):
+                os.remove(os.path.join(carpeta, nombre))
+
+def _agregar(db, esq, lote):
+    """Copia las filas nuevas desde la marca de agua; cada bloque se confirma avanzando la marca"""
+    ultimo = db.marca_agua(MARCA) if _particiones(db) else 0
+    _limpiar_huerfanos(db, ultimo)
+    pos_id = esq.names.index("id")
+    total = 0
+    while True:
+        filas = db.consultar(
+            f"SELECT {sql_particion('r')}, {', '.join('r.' + c for c in esq.names)} FROM clinical_records r "
+            "WHERE r.id > ? ORDER BY r.id LIMIT ?", (ultimo, lote))
+        if not filas:
+            return ultimo, total
+        grupos = {}
+        for fila in filas:
+            grupos.setdefault(fila[0], []).append(fila[1:])
+        for particion, grupo in grupos.items():
+            _publicar(_tabla(grupo, esq), os.path.join(_carpeta(db, particion),
+                                                       _nombre(grupo[0][pos_id], grupo[-1][pos_id])))
+        ultimo = filas[-1][1 + pos_id]
+        with db.transaccion() as conn:
+            db.fijar_marca_agua(conn, MARCA, ultimo)
+        total += len(filas)
+
+def _reescribir(db, esq, particion, hasta_id, lote):
+    """Reemplaza la partición por un único archivo con sus filas actuales de id <= hasta_id"""
+    if particion == PARTICION_SIN_FECHA:
+        condicion, params = f"{sql_particion('r')} = ?", [particion]
+    else:
+        # Rango sobre el índice (date, id); substr descarta fechas más cortas con el mismo prefijo
+        condicion, params = "r.date >= ? AND r.date < ? AND substr(r.date, 1, 7) = ?", [particion, particion + "~", particion]
+    carpeta = _carpeta(db, particion)
+    anteriores = _archivos(carpeta)
+    tmp = os.path.join(carpeta, "_reescritura.tmp")
+    os.makedirs(carpeta, exist_ok=True)
+    id_min = id_max = None
+    with db.lectura() as conn:
+        cur = conn.execute(f"SELECT {', '.join('r.' + c for c in esq.names)} FROM clinical_records r "
+                           f"WHERE {condicion} AND r.id <= ? ORDER BY r.id", params + [hasta_id])
+        pos_id = esq.names.index("id")
+        with pq.ParquetWriter(tmp, esq, compression="zstd") as escritor:
+            while filas := cur.fetchmany(lote):
+                id_min = filas[0][pos_id] if id_min is None else id_min
+                id_max = filas[-1][pos_id]
+                escritor.write_table(_tabla(filas, esq))
+    nuevo = None
+    if id_min is None:
+        os.remove(tmp)
+    else:
+        nuevo = _nombre(id_min, id_max)
+        os.replace(tmp, os.path.join(carpeta, nuevo))
+    for nombre in anteriores:
+        if nombre != nuevo:
+            os.remove(os.path.join(carpeta, nombre))
+    if nuevo is None and not os.listdir(carpeta):
+        os.rmdir(carpeta)
+
+def sincronizar(db, lote=LOTE):
+    """
+    Pone el espejo al día: agrega las filas nuevas, reescribe las particiones
+    con cambios pendientes y compacta las fragmentadas.
+    Devuelve (filas agregadas, particiones reescritas).
+    """
+    with _exclusivo(db):
+        esq = esquema(db)
+        ultimo, agregadas = _agregar(db, esq, lote)
+        reescritas = set()
+        for particion, id_min, version in db.consultar("SELECT particion, id_min, version FROM espejo_pendientes"):
+            # Si todos los cambios son de filas aún no copiadas, las trae el próximo _agregar
+            if id_min <= ultimo:
+                _reescribir(db, esq, particion, ultimo, lote)
+                reescritas.add(particion)
+            with db.transaccion() as conn:
+                # Solo si nadie la modificó mientras se reescribía
+                conn.execute("DELETE FROM espejo_pendientes WHERE particion = ? AND version = ?", (particion, version))
+        for particion in _particiones(db):
+            if particion not in reescritas and len(_archivos(_carpeta(db, particion))) > ARCHIVOS_MAX_PARTICION:
+                _reescribir(db, esq, particion, ultimo, lote)
+                reescritas.add(particion)
+        return agregadas, len(reescritas)
+
+def estado(db):
+    """Marca de agua, filas sin copiar, particiones pendientes y tamaño del espejo"""
+    ultimo = db.marca_agua(MARCA)
+    archivos = [os.path.join(_carpeta(db, p), a) for p in _particiones(db) for a in _archivos(_carpeta(db, p))]
+    return {
+        "marca_agua": ultimo,
+        "filas_sin_copiar": db.consultar_uno("SELECT COUNT(*) FROM clinical_records WHERE id > ?", (ultimo,))[0],
+        "particiones_pendientes": db.consultar_uno("SELECT COUNT(*) FROM espejo_pendientes")[0],
+        "particiones": len(_particiones(db)),
+        "archivos": len(archivos),
+        "bytes": sum(os.path.getsize(a) for a in archivos),
+    }
+
+# =============================================
+# CONSULTAS
+# =============================================
+def dataset(db):
+    """Dataset del espejo con el esquema actual (columnas agregadas después se leen como nulas en archivos viejos)"""
+    raiz = directorio_espejo(db)
+    os.makedirs(raiz, exist_ok=True)
+    particion = pa.schema([(CAMPO_PARTICION, pa.string())])
+    return ds.dataset(raiz, schema=pa.unify_schemas([esquema(db), particion]), format="parquet",
+                      partitioning=ds.partitioning(particion, flavor="hive"))
+
+def filtro(desde=None, hasta=None, doctor=None, condicion=None):
+    """
+    Expresión de filtro: el rango de fechas poda particiones completas y
+    también se empuja a los row groups, igual que `doctor` y `condicion`
+    (cualquier pyarrow.dataset.Expression). None si no hay filtros.
+    """
+    partes = []
+    if desde:
+        partes += [ds.field(CAMPO_PARTICION) >= str(desde)[:7], ds.field("date") >= str(desde)]
+    if hasta:
+        # Como en SQLite, date = '' pasa `date <= hasta`; esas filas están en la partición sin fecha
+        partes += [(ds.field(CAMPO_PARTICION) <= str(hasta)[:7]) | (ds.field(CAMPO_PARTICION) == PARTICION_SIN_FECHA),
+                   ds.field("date") <= str(hasta)]
+    if doctor:
+        partes.append(ds.field("doctor") == doctor)
+    if condicion is not None:
+        partes.append(condicion)
+    if not partes:
+        return None
+    expresion = partes[0]
+    for parte in partes[1:]:
+        expresion = expresion & parte
+    return expresion
+
+def _abrir(db, particion):
+    """
+    Abre los archivos actuales de la partición. Si una reescritura borra uno
+    entre el listado y la apertura, o aún no borró los que acaba de reemplazar
+    (rangos de id solapados), se vuelve a listar.
+    """
+    carpeta = _carpeta(db, particion)
+    while True:
+        nombres = _archivos(carpeta)
+        rangos = sorted(_rango(n) for n in nombres)
+        if any(anterior[1] >= siguiente[0] for anterior, siguiente in zip(rangos, rangos[1:])):
+            time.sleep(ESPERA_REESCRITURA_S)
+            continue
+        abiertos = []
+        try:
+            for nombre in nombres:
+                abiertos.append(pa.OSFile(os.path.join(carpeta, nombre)))
+            return abiertos
+        except FileNotFoundError:
+            for f in abiertos:
+                f.close()
+
+def _particiones_filtradas(completo, expresion):
+    """Particiones con algún archivo que el filtro no descarta"""
+    prefijo = f"{CAMPO_PARTICION}="
+    return sorted({os.path.basename(os.path.dirname(f.path))[len(prefijo):]
+                   for f in completo.get_fragments(filter=expresion)})
+
+def _lotes_particion(db, completo, particion, columnas, expresion, tamano):
+    archivos = _abrir(db, particion)
+    try:
+        formato = ds.ParquetFileFormat()
+        fragmentos = [formato.make_fragment(f, partition_expression=ds.field(CAMPO_PARTICION) == particion)
+                      for f in archivos]
+        yield from ds.FileSystemDataset(fragmentos, completo.schema, formato).to_batches(
+            columns=columnas, filter=expresion, batch_size=tamano)
+    finally:
+        for f in archivos:
+            f.close()
+
+def lotes(db, columnas=None, expresion=None, tamano=LOTE):
+    """
+    RecordBatches del espejo leyendo del disco solo `columnas` y los row groups
+    que pasan el filtro, partición por partición (las que el filtro descarta
+    ni se abren).
+    """
+    completo = dataset(db)
+    for particion in _particiones_filtradas(completo, expresion):
+        yield from _lotes_particion(db, completo, particion, columnas, expresion, tamano)
+
+def consultar(db, columnas=None, desde=None, hasta=None, doctor=None, condicion=None):
+    """DataFrame (tipos compactos) con las `columnas` pedidas de las filas que pasan el filtro"""
+    esq = dataset(db).schema
+    if columnas:
+        esq = pa.schema([esq.field(c) for c in columnas])
+    tabla = pa.Table.from_batches(lotes(db, columnas, filtro(desde, hasta, doctor, condicion)), schema=esq)
+    return compactar(tabla.to_pandas())
+
+def bloques_historial(db, desde=None, hasta=None, doctor=None, columnas=COLUMNAS_HISTORIAL, bloque=LOTE):
+    """
+    (columnas, tipos, generador de bloques) del historial leído del espejo, más
+    reciente primero como exportacion.bloques_historial: recorre las particiones
+    de la más nueva a la más vieja (sin fecha al final) y ordena cada una en
+    memoria, de a una. Sin búsqueda por texto.
+    """
+    esq = esquema(db)
+    columnas = [c for c in columnas if c in esq.names]
+    leidas = columnas + [c for c in ("date", "id") if c not in columnas]
+
+    def generar():
+        completo = dataset(db)
+        expresion = filtro(desde, hasta, doctor)
+        particiones = _particiones_filtradas(completo, expresion)
+        orden = sorted((p for p in particiones if p != PARTICION_SIN_FECHA), reverse=True)
+        orden += [p for p in particiones if p == PARTICION_SIN_FECHA]
+        for particion in orden:
+            tabla = pa.Table.from_batches(list(_lotes_particion(db, completo, particion, leidas, expresion, bloque)),
+                                          schema=pa.schema([esq.field(c) for c in leidas]))
+            # Como ORDER BY date DESC, id DESC en SQLite: los nulos al final
+            tabla = tabla.sort_by([("date", "descending"), ("id", "descending")]).select(columnas)
+            for b in tabla.to_batches(max_chunksize=bloque):
+                yield list(zip(*(b.column(i).to_pylist() for i in range(b.num_columns))))
+
+    return columnas, [esq.field(c).type for c in columnas], generar()
+
+def al_dia(db):
+    """
+    True si el espejo tiene todas las filas de clinical_records y ninguna
+    partición pendiente de reescribir. Las escrituras posteriores a la
+    comprobación no se ven, igual que en una lectura de SQLite ya empezada.
+    """
+    ultimo = db.marca_agua(MARCA)
+    if not ultimo or not os.path.isdir(directorio_espejo(db)):
+        return False
+    return not db.consultar_uno("SELECT EXISTS (SELECT 1 FROM clinical_records WHERE id > ?) "
+                                "OR EXISTS (SELECT 1 FROM espejo_pendientes)", (ultimo,))[0]
+
+def historial(db, texto=None, desde=None, hasta=None, doctor=None, columnas=COLUMNAS_HISTORIAL, bloque=BLOQUE):
+    """
+    exportacion.bloques_historial leído del espejo cuando está al día y no hay
+    búsqueda por texto (el espejo no tiene FTS); si no, de SQLite.
+    """
+    if texto or not al_dia(db):
+        return bloques_historial_sqlite(db, texto, desde, hasta, doctor, columnas, bloque)
+    return bloques_historial(db, desde, hasta, doctor, columnas, bloque)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Espejo columnar (Parquet) de clinical_records")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_sinc = sub.add_parser("sincronizar", help="Copia las filas nuevas y reescribe las particiones modificadas")
+    p_sinc.add_argument("--lote", type=int, default=LOTE)
+    sub.add_parser("estado", help="Marca de agua y tamaño del espejo")
+    p_cons = sub.add_parser("consultar", help="Lee columnas filtradas del espejo")
+    p_cons.add_argument("--columnas", default=None, help="Separadas por coma (por defecto todas)")
+    p_cons.add_argument("--desde", default=None)
+    p_cons.add_argument("--hasta", default=None)
+    p_cons.add_argument("--doctor", default=None)
+    p_cons.add_argument("--salida", default=None, help="CSV de salida (si no, se imprime un resumen)")
+    args = parser.parse_args()
+    db = AppDatabase(args.db)
+    if args.comando == "sincronizar":
+        agregadas, reescritas = sincronizar(db, args.lote)
+        print(f"{agregadas} filas agregadas, {reescritas} particiones reescritas")
+    elif args.comando == "estado":
+        for clave, valor in estado(db).items():
+            print(f"{clave}: {valor}")
+    else:
+        df = consultar(db, args.columnas.split(",") if args.columnas else None, args.desde, args.hasta, args.doctor)
+        if args.salida:
+            df.to_csv(args.salida, index=False)
+            print(f"{len(df)} filas -> {args.salida}")
+        else:
+            print(df.describe(include="all").to_string())
@@ -0,0 +1,217 @@
+"""
+Exportación en streaming del historial clínico y de la auditoría a CSV, XLSX
+(openpyxl en modo write_only) o Parquet (pyarrow, un row group por bloque).
+Las filas se leen del cursor SQLite con fetchmany y se escriben bloque a
+bloque, de modo que exportar un año de datos no carga la tabla en memoria.
+Los filtros son los mismos de las pantallas de Historial y Auditoría.
+Con --espejo el historial se lee del espejo columnar (espejo.py) en lugar de SQLite.
+
+Uso por línea de comandos:
+    python exportacion.py historial salida.parquet [--texto ...] [--desde AAAA-MM-DD] [--hasta ...] [--doctor ...] [--espejo]
+    python exportacion.py auditoria salida.csv [--usuario ...] [--accion ...] [--desde ...] [--hasta ...]
+"""
+import argparse
+import csv
+import io
+import os
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database import AppDatabase, DB_PATH
+from archivo_auditoria import COLUMNAS as COLUMNAS_AUDITORIA, directorio_archivo, leer_segmento, segmentos
+
+BLOQUE = 10_000
+FILAS_HOJA_XLSX = 1_048_575  # límite de Excel por hoja, sin contar el encabezado
+FORMATOS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+COLUMNAS_HISTORIAL = [
+    "id", "px_name", "px_id", "date", "doctor", "sys", "tfg", "albuminuria", "potasio", "bun_cr", "fevi",
+    "troponina", "bnp", "ldl", "edad", "imc", "glucosa", "creatinina", "sleep", "stress", "exercise",
+    "riesgo_erc", "riesgo_modelo", "obs",
+]
+
+def _cursor(db, sql, params, bloque):
+    """Bloques de filas de una consulta; la conexión lectora se retiene solo mientras se itera"""
+    with db.lectura() as conn:
+        cur = conn.execute(sql, params)
+        while filas := cur.fetchmany(bloque):
+            yield filas
+
+def tipos_arrow(db, tabla, columnas):
+    """Tipo Arrow de cada columna según el tipo declarado en SQLite"""
+    declarados = {fila[1]: (fila[2] or "").upper() for fila in db.consultar(f"PRAGMA table_info({tabla})")}
+    tipos = []
+    for c in columnas:
+        t = declarados.get(c, "")
+        tipos.append(pa.int64() if "INT" in t else
+                     pa.float64() if any(x in t for x in ("REAL", "FLOA", "DOUB")) else pa.string())
+    return tipos
+
+def bloques_historial(db, texto=None, desde=None, hasta=None, doctor=None,
+                      columnas=COLUMNAS_HISTORIAL, bloque=BLOQUE):
+    """(columnas, tipos, generador de bloques) del historial filtrado, más reciente primero"""
+    columnas = [c for c in columnas if c in {fila[1] for fila in db.consultar("PRAGMA table_info(clinical_records)")}]
+    origen, condiciones, params = db.filtro_historial(texto, desde, hasta, doctor)
+    sql = f"SELECT {', '.join('r.' + c for c in columnas)} FROM {origen}"
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    sql += " ORDER BY r.date DESC, r.id DESC"
+    return columnas, tipos_arrow(db, "clinical_records", columnas), _cursor(db, sql, params, bloque)
+
+def bloques_auditoria(db, usuario=None, accion=None, desde=None, hasta=None, incluir_archivo=True,
+                      bloque=BLOQUE):
+    """
+    (columnas, tipos, generador de bloques) de la auditoría filtrada, más
+    reciente primero: tabla viva y después los segmentos archivados.
+    """
+    condiciones, params = [], []
+    if usuario:
+        condiciones.append("user = ?")
+        params.append(usuario)
+    if accion:
+        condiciones.append("action = ?")
+        params.append(accion)
+    if desde:
+        condiciones.append("timestamp >= ?")
+        params.append(str(desde))
+    if hasta:
+        condiciones.append("timestamp <= ?")
+        params.append(str(hasta) + "~")
+    where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    sql = f"SELECT {', '.join(COLUMNAS_AUDITORIA)} FROM audit_logs{where} ORDER BY id DESC"
+
+    def generar():
+        yield from _cursor(db, sql, params, bloque)
+        if not incluir_archivo:
+            return
+        carpeta = directorio_archivo(db)
+        for seg in segmentos(db, desde, hasta).itertuples():
+            ruta = os.path.join(carpeta, seg.archivo)
+            if not os.path.exists(ruta):
+                continue
+            # Los segmentos están en orden de id: se invierte uno a la vez (como mucho
+            # FILAS_POR_SEGMENTO filas en memoria)
+            partes = list(leer_segmento(ruta, usuario, accion, desde, hasta))
+            for parte in reversed(partes):
+                parte = parte.iloc[::-1].astype(object)
+                yield list(parte.where(parte.notna(), None).itertuples(index=False, name=None))
+
+    return COLUMNAS_AUDITORIA, tipos_arrow(db, "audit_logs", COLUMNAS_AUDITORIA), generar()
+
+def _escribir_csv(destino, columnas, bloques):
+    n = 0
+    texto = io.TextIOWrapper(destino, encoding="utf-8", newline="")
+    w = csv.writer(texto)
+    w.writerow(columnas)
+    for filas in bloques:
+        w.writerows(filas)
+        n += len(filas)
+    texto.flush()
+    texto.detach()  # el llamador decide cuándo cerrar el destino
+    return n
+
+def _escribir_xlsx(destino, columnas, bloques):
+    from openpyxl import Workbook
+    libro = Workbook(write_only=True)
+    hoja, en_hoja, n = None, FILAS_HOJA_XLSX, 0
+    for filas in bloques:
+        for fila in filas:
+            if en_hoja >= FILAS_HOJA_XLSX:
+                hoja = libro.create_sheet(f"Datos {len(libro.worksheets) + 1}")
+                hoja.append(columnas)
+                en_hoja = 0
+            hoja.append(fila)
+            en_hoja += 1
+        n += len(filas)
+    if hoja is None:
+        libro.create_sheet("Datos 1").append(columnas)
+    libro.save(destino)
+    return n
+
+def arreglo_arrow(valores, tipo):
+    try:
+        return pa.array(valores, type=tipo)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # SQLite no impone tipos: se normalizan los valores atípicos de filas antiguas
+        if pa.types.is_string(tipo):
+            return pa.array([None if v is None else str(v) for v in valores], type=tipo)
+        return pa.array([_numero(v) for v in valores], type=pa.float64()).cast(tipo, safe=False)
+
+def _numero(v):
+    try:
+        return None if v is None else float(v)
+    except (TypeError, ValueError):
+        return None
+
+def _escribir_parquet(destino, columnas, tipos, bloques):
+    esquema = pa.schema(list(zip(columnas, tipos)))
+    n = 0
+    with pq.ParquetWriter(destino, esquema, compression="zstd") as escritor:
+        for filas in bloques:
+            arreglos = [arreglo_arrow(list(valores), t) for valores, t in zip(zip(*filas), tipos)]
+            escritor.write_table(pa.Table.from_arrays(arreglos, schema=esquema))
+            n += len(filas)
+    return n
+
+def exportar(origen, formato, destino):
+    """
+    Escribe `origen` = (columnas, tipos, bloques) en `destino` (ruta o archivo
+    binario abierto) con el formato 'csv' | 'xlsx' | 'parquet'.
+    Devuelve el número de filas exportadas.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}")
+    columnas, tipos, bloques = origen
+    if isinstance(destino, (str, os.PathLike)):
+        with open(destino, "wb") as f:
+            return exportar(origen, formato, f)
+    if formato == "csv":
+        return _escribir_csv(destino, columnas, bloques)
+    if formato == "xlsx":
+        return _escribir_xlsx(destino, columnas, bloques)
+    return _escribir_parquet(destino, columnas, tipos, bloques)
+
+def exportar_temporal(origen, formato):
+    """
+    Exporta a un archivo temporal en disco (se borra al cerrarlo), posicionado
+    al inicio. Se devuelve el FileIO sin buffer, que es lo que acepta
+    st.download_button; la escritura pasa por un buffer propio.
+    """
+    f = tempfile.TemporaryFile(buffering=0)
+    escritor = io.BufferedWriter(f)
+    exportar(origen, formato, escritor)
+    escritor.flush()
+    escritor.detach()
+    f.seek(0)
+    return f
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportación del historial clínico o la auditoría")
+    parser.add_argument("datos", choices=["historial", "auditoria"])
+    parser.add_argument("salida", help="Archivo de salida; el formato se toma de la extensión")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--desde", default=None)
+    parser.add_argument("--hasta", default=None)
+    parser.add_argument("--texto", default=None, help="Historial: nombre, cédula u observaciones")
+    parser.add_argument("--doctor", default=None, help="Historial: médico")
+    parser.add_argument("--usuario", default=None, help="Auditoría: usuario")
+    parser.add_argument("--accion", default=None, help="Auditoría: acción")
+    parser.add_argument("--espejo", action="store_true", help="Historial: leer del espejo columnar (sin --texto)")
+    args = parser.parse_args()
+    db = AppDatabase(args.db)
+    if args.datos == "historial" and args.espejo:
+        if args.texto:
+            parser.error("--texto no está disponible con --espejo")
+        from espejo import bloques_historial as bloques_espejo, sincronizar
+        sincronizar(db)
+        origen = bloques_espejo(db, args.desde, args.hasta, args.doctor)
+    elif args.datos == "historial":
+        origen = bloques_historial(db, args.texto, args.desde, args.hasta, args.doctor)
+    else:
+        db.auditoria.flush()
+        origen = bloques_auditoria(db, args.usuario, args.accion, args.desde, args.hasta)
+    n = exportar(origen, os.path.splitext(args.salida)[1].lstrip(".").lower(), args.salida)
+    print(f"{n} filas exportadas a {args.salida}")
@@ -0,0 +1,188 @@
+"""
+Figuras del panel de resultados de la consulta. Cada figura depende solo de
+unos pocos valores escalares, así que se construye una vez por combinación de
+entradas y se reutiliza en los reruns (cambiar de pestaña, descargar el PDF o
+volver a abrir el mismo análisis no vuelve a armar ni validar la figura).
+
+Las figuras devueltas son compartidas: no deben modificarse.
+"""
+from functools import lru_cache
+import plotly.graph_objects as go
+
+FIGURAS_EN_CACHE = 256  # por tipo de figura
+MESES_PROYECCION = (0, 2, 4, 6, 12)
+PUNTAJE_ESTRES = {'Alto': 30, 'Moderado': 60, 'Bajo': 90}
+
+def clasificacion_kdigo(tfg):
+    """(categoría, color) KDIGO según la TFG"""
+    if tfg >= 90:
+        return "G1 - Normal", "green"
+    if tfg >= 60:
+        return "G2 - Leve ↓", "lightgreen"
+    if tfg >= 45:
+        return "G3a - Moderada ↓", "yellow"
+    if tfg >= 30:
+        return "G3b - Moderada-Severa ↓", "orange"
+    if tfg >= 15:
+        return "G4 - Severa ↓", "darkorange"
+    return "G5 - Falla Renal", "red"
+
+def estado_cardiaco(fevi):
+    """(categoría, color) según la FEVI"""
+    if fevi >= 50:
+        return "Normal", "green"
+    if fevi >= 40:
+        return "FE Limítrofe", "orange"
+    return "IC con FE Reducida", "red"
+
+@lru_cache(maxsize=FIGURAS_EN_CACHE)
+def figura_tfg(tfg):
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number+delta",
+        value=tfg,
+        title={'text': "Función Renal (TFG)<br><span style='font-size:0.8em'>ml/min/1.73m²</span>", 'font': {'size': 20}},
+        delta={'reference': 90, 'increasing': {'color': "green"}},
+        gauge={
+            'axis': {'range': [None, 120], 'tickwidth': 1},
+            'bar': {'color': "darkblue"},
+            'bgcolor': "white",
+            'steps': [
+                {'range': [0, 15], 'color': "#8B0000", 'name': 'G5'},
+                {'range': [15, 30], 'color': "#FF4500", 'name': 'G4'},
+                {'range': [30, 45], 'color': "#FFA500", 'name': 'G3b'},
+                {'range': [45, 60], 'color': "#FFD700", 'name': 'G3a'},
+                {'range': [60, 90], 'color': "#90EE90", 'name': 'G2'},
+                {'range': [90, 120], 'color': "#32CD32", 'name': 'G1'}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': 60
+            }
+        }
+    ))
+    fig.update_layout(height=350, margin=dict(l=20, r=20, t=80, b=20))
+    return fig
+
+@lru_cache(maxsize=FIGURAS_EN_CACHE)
+def figura_fevi(fevi):
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=fevi,
+        title={'text': "Función Cardíaca (FEVI)<br><span style='font-size:0.8em'>Fracción de Eyección %</span>", 'font': {'size': 20}},
+        gauge={
+            'axis': {'range': [0, 80]},
+            'bar': {'color': "crimson"},
+            'steps': [
+                {'range': [0, 40], 'color': "rgba(255, 0, 0, 0.3)"},
+                {'range': [40, 50], 'color': "rgba(255, 165, 0, 0.3)"},
+                {'range': [50, 80], 'color': "rgba(0, 128, 0, 0.3)"}
+            ],
+            'threshold': {
+                'line': {'color': "orange", 'width': 4},
+                'thickness': 0.75,
+                'value': 50
+            }
+        }
+    ))
+    fig.update_layout(height=350, margin=dict(l=20, r=20, t=80, b=20))
+    return fig
+
+@lru_cache(maxsize=FIGURAS_EN_CACHE)
+def figura_tendencia(meses, tfg, fevi):
+    """Proyección (pronostico.py) a `meses` desde hoy; tfg / fevi son tuplas o None sin mediciones"""
+    fechas = ["Hoy" if m == 0 else f"+{m} meses" for m in meses]
+    fig = go.Figure()
+    if tfg is not None:
+        fig.add_trace(go.Scatter(
+            x=fechas, y=tfg,
+            mode='lines+markers',
+            name="TFG Proyectada",
+            line=dict(color='royalblue', width=3),
+            marker=dict(size=10)
+        ))
+    if fevi is not None:
+        fig.add_trace(go.Scatter(
+            x=fechas, y=fevi,
+            mode='lines+markers',
+            name="FEVI Proyectada",
+            line=dict(color='crimson', width=3, dash='dash'),
+            marker=dict(size=10, symbol='diamond')
+        ))
+    fig.update_layout(
+        title="Evolución Proyectada según la Trayectoria del Paciente",
+        xaxis_title="Tiempo",
+        yaxis_title="Valor",
+        hovermode='x unified',
+        height=400,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+@lru_cache(maxsize=FIGURAS_EN_CACHE)
+def figura_parametros(sys_p, potasio, sleep):
+    # Gráfico de barras comparativo
+    parametros = ['Presión\nSistólica', 'Potasio\n(K+)', 'Horas\nSueño']
+    valores = [sys_p, potasio*25, sleep*15]
+    valores_objetivo = [120, 4.5*25, 7.5*15]
+
+    fig = go.Figure(data=[
+        go.Bar(name='Valor Actual', x=parametros, y=valores, marker_color='lightsalmon'),
+        go.Bar(name='Valor Objetivo', x=parametros, y=valores_objetivo, marker_color='lightgreen')
+    ])
+    fig.update_layout(
+        title="Comparación con Valores Objetivo",
+        barmode='group',
+        height=350,
+        yaxis_title="Valor (escala normalizada)"
+    )
+    return fig
+
+@lru_cache(maxsize=FIGURAS_EN_CACHE)
+def figura_estilo(sleep, exercise, stress):
+    # Gráfico de radar para estilo de vida
+    categories = ['Sueño\n(h/día)', 'Ejercicio\n(min/sem)', 'Control\nEstrés']
+    valores_actuales = [
+        (sleep / 8) * 100,
+        ((exercise or 0) / 150) * 100,
+        PUNTAJE_ESTRES.get(stress, 60)
+    ]
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatterpolar(
+        r=valores_actuales,
+        theta=categories,
+        fill='toself',
+        name='Actual',
+        line_color='coral'
+    ))
+    fig.add_trace(go.Scatterpolar(
+        r=[100, 100, 100],
+        theta=categories,
+        fill='toself',
+        name='Objetivo',
+        line_color='lightgreen',
+        opacity=0.5
+    ))
+    fig.update_layout(
+        polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
+        title="Evaluación de Estilo de Vida",
+        height=350
+    )
+    return fig
+
+def figuras_resultado(d, proyeccion=None):
+    """
+    Todas las figuras del panel para los datos de una consulta. Sin
+    `proyeccion` (pronostico.proyeccion_paciente) la tendencia queda plana.
+    """
+    if proyeccion is None:
+        proyeccion = {"meses": MESES_PROYECCION, "tfg": (d['tfg'],) * len(MESES_PROYECCION),
+                      "fevi": (d['fevi'],) * len(MESES_PROYECCION)}
+    return {
+        "tfg": figura_tfg(d['tfg']),
+        "fevi": figura_fevi(d['fevi']),
+        "tendencia": figura_tendencia(proyeccion["meses"], proyeccion["tfg"], proyeccion["fevi"]),
+        "parametros": figura_parametros(d['sys'], d['potasio'], d['sleep']),
+        "estilo": figura_estilo(d['sleep'], d.get('exercise', 0), d['stress']),
+    }
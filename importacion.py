@@ -0,0 +1,257 @@
+"""
+Importación masiva de consultas históricas desde CSV o Excel (.xlsx). El
+archivo se lee en streaming (csv.reader / openpyxl en modo read_only), cada
+fila se valida con los mismos rangos del formulario "Nueva Consulta" y las
+filas válidas se insertan con executemany en transacciones grandes. Las filas
+rechazadas se escriben en un CSV de reporte junto con el motivo, y la
+importación deja un único evento de auditoría con el resumen.
+
+Uso por línea de comandos:
+    python importacion.py archivo.csv|archivo.xlsx --usuario admin [--rechazos rechazos.csv]
+"""
+import argparse
+import csv
+import os
+import re
+import numpy as np
+import pandas as pd
+from datetime import date, datetime
+from database import AppDatabase, DB_PATH, SQL_AUDITORIA, evento_auditoria
+from riesgo import puntuar_lote
+
+LOTE = 20_000
+
+# Mismos límites que los number_input / slider del formulario
+RANGOS = {
+    "sys": (80, 220),
+    "tfg": (0.0, 150.0),
+    "potasio": (2.0, 8.0),
+    "fevi": (5.0, 80.0),
+    "edad": (18, 110),
+    "imc": (10.0, 60.0),
+    "glucosa": (40.0, 600.0),
+    "creatinina": (0.2, 15.0),
+    "sleep": (3.0, 12.0),
+    "exercise": (0, 500),
+}
+ENTEROS = {"sys", "edad", "exercise"}
+NIVELES_ESTRES = ("Bajo", "Moderado", "Alto")
+OBLIGATORIAS = ("px_name", "px_id", "date")
+COLUMNAS = ["px_name", "px_id", "date", "doctor", *RANGOS, "stress", "obs", "riesgo_erc", "riesgo_modelo"]
+
+# Encabezados habituales en planillas -> columna de clinical_records
+ALIAS = {
+    "nombre": "px_name", "paciente": "px_name",
+    "cedula": "px_id", "cédula": "px_id",
+    "fecha": "date",
+    "medico": "doctor", "médico": "doctor",
+    "presion_sistolica": "sys", "sistolica": "sys",
+    "observaciones": "obs",
+    "estres": "stress", "estrés": "stress",
+    "sueno": "sleep", "sueño": "sleep",
+    "ejercicio": "exercise",
+}
+# AAAA-MM-DD / AAAA/MM/DD (con hora opcional) o DD/MM/AAAA / DD-MM-AAAA
+RE_FECHA = re.compile(r"(?P<anio>\d{4})[-/](?P<mes>\d{1,2})[-/](?P<dia>\d{1,2})(?:[ T].*)?$"
+                      r"|(?P<dia2>\d{1,2})[-/](?P<mes2>\d{1,2})[-/](?P<anio2>\d{4})$")
+
+def _encabezado(valores):
+    columnas = []
+    for v in valores:
+        nombre = str(v or "").strip().lower().replace(" ", "_")
+        columnas.append(ALIAS.get(nombre, nombre))
+    # "id" es la cédula solo si no viene otra columna que lo sea (si no, suele ser un correlativo)
+    if "px_id" not in columnas and "id" in columnas:
+        columnas[columnas.index("id")] = "px_id"
+    return columnas
+
+def _filas_csv(ruta):
+    with open(ruta, newline="", encoding="utf-8-sig") as f:
+        muestra = f.read(4096)
+        f.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;\t")
+        except csv.Error:
+            dialecto = csv.excel
+        lector = csv.reader(f, dialecto)
+        columnas = _encabezado(next(lector, []))
+        yield columnas
+        for fila in lector:
+            yield dict(zip(columnas, fila))
+
+def _filas_xlsx(ruta):
+    from openpyxl import load_workbook
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        columnas = _encabezado(next(filas, ()))
+        yield columnas
+        for fila in filas:
+            if any(v is not None and v != "" for v in fila):
+                yield dict(zip(columnas, fila))
+    finally:
+        libro.close()
+
+def leer_filas(ruta):
+    """
+    (columnas normalizadas del encabezado, generador de dicts columna -> valor
+    crudo) según la extensión del archivo. Los lectores entregan primero el
+    encabezado y luego las filas.
+    """
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        filas = _filas_xlsx(ruta)
+    elif extension in (".csv", ".txt"):
+        filas = _filas_csv(ruta)
+    else:
+        raise ValueError(f"Formato no soportado: {extension} (use .csv o .xlsx)")
+    return next(filas), filas
+
+def _vacio(v):
+    return v is None or (isinstance(v, str) and not v.strip())
+
+def _fecha(v):
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d")
+    if isinstance(v, date):
+        return v.isoformat()
+    # Regex + date() en vez de strptime: strptime domina el costo por fila
+    m = RE_FECHA.match(str(v).strip())
+    try:
+        if m and m["anio"]:
+            return date(int(m["anio"]), int(m["mes"]), int(m["dia"])).isoformat()
+        if m:
+            return date(int(m["anio2"]), int(m["mes2"]), int(m["dia2"])).isoformat()
+    except ValueError:
+        pass
+    raise ValueError(f"fecha inválida '{v}'")
+
+def validar_fila(crudo, medico=None):
+    """
+    Normaliza una fila al esquema de clinical_records. Los campos clínicos
+    vacíos quedan en NULL; los presentes deben respetar los rangos del
+    formulario. Lanza ValueError con el motivo si la fila no es válida.
+    """
+    faltan = [c for c in OBLIGATORIAS if _vacio(crudo.get(c))]
+    if faltan:
+        raise ValueError(f"faltan campos obligatorios: {', '.join(faltan)}")
+    fila = {
+        "px_name": str(crudo["px_name"]).strip(),
+        "px_id": str(crudo["px_id"]).strip(),
+        "date": _fecha(crudo["date"]),
+        "doctor": medico if _vacio(crudo.get("doctor")) else str(crudo["doctor"]).strip(),
+        "obs": None if _vacio(crudo.get("obs")) else str(crudo["obs"]).strip(),
+    }
+    fila.update(validar_clinicos(crudo))
+    return fila
+
+def validar_clinicos(crudo):
+    """
+    Parámetros clínicos de una fila (RANGOS + stress) normalizados; los vacíos
+    quedan en None. Lanza ValueError con el motivo si alguno no es válido.
+    """
+    fila = {}
+    for campo, (minimo, maximo) in RANGOS.items():
+        v = crudo.get(campo)
+        if _vacio(v):
+            fila[campo] = None
+            continue
+        try:
+            v = float(str(v).strip().replace(",", ".")) if isinstance(v, str) else float(v)
+        except (TypeError, ValueError):
+            raise ValueError(f"{campo}: '{crudo.get(campo)}' no es numérico") from None
+        if not minimo <= v <= maximo:
+            raise ValueError(f"{campo}: {v:g} fuera de rango [{minimo}, {maximo}]")
+        if campo in ENTEROS:
+            if not v.is_integer():
+                raise ValueError(f"{campo}: {v:g} debe ser entero")
+            v = int(v)
+        fila[campo] = v
+    estres = crudo.get("stress")
+    if _vacio(estres):
+        fila["stress"] = None
+    else:
+        estres = str(estres).strip().capitalize()
+        if estres not in NIVELES_ESTRES:
+            raise ValueError(f"stress: '{crudo['stress']}' no es {', '.join(NIVELES_ESTRES)}")
+        fila["stress"] = estres
+    return fila
+
+def _insertar(conn, lote):
+    """Puntúa el lote con el modelo activo (vectorizado) y lo inserta"""
+    riesgos, version = puntuar_lote(pd.DataFrame(lote))
+    for fila, r in zip(lote, riesgos):
+        fila["riesgo_erc"] = None if np.isnan(r) else float(r)
+        fila["riesgo_modelo"] = None if np.isnan(r) else version
+    conn.executemany(
+        f"INSERT INTO clinical_records ({', '.join(COLUMNAS)}) VALUES ({', '.join('?' * len(COLUMNAS))})",
+        [[fila[c] for c in COLUMNAS] for fila in lote])
+
+def importar(db, ruta, usuario, medico=None, ruta_rechazos=None, lote=LOTE, nombre=None):
+    """
+    Importa `ruta` en bloques de `lote` filas, cada bloque en su transacción.
+    `medico` se usa cuando la fila no trae columna doctor. Si se indica
+    `ruta_rechazos`, allí se escribe (fila, motivo, valores originales) de cada
+    fila rechazada. Devuelve un dict con leídas, insertadas y rechazadas.
+    """
+    resumen = {"leidas": 0, "insertadas": 0, "rechazadas": 0}
+    pendientes = []
+    reporte = escritor = None
+    nombre = nombre or os.path.basename(ruta)
+
+    def evento(estado="", insertadas=None):
+        insertadas = resumen["insertadas"] if insertadas is None else insertadas
+        return evento_auditoria(
+            usuario, "Importación Masiva",
+            f"Archivo: {nombre}{estado} | Leídas: {resumen['leidas']} | Insertadas: {insertadas} | "
+            f"Rechazadas: {resumen['rechazadas']}")
+
+    columnas, filas = leer_filas(ruta)  # valida el formato antes de empezar
+    try:
+        for n, crudo in enumerate(filas, start=2):  # fila 1 = encabezado
+            resumen["leidas"] += 1
+            try:
+                pendientes.append(validar_fila(crudo, medico))
+            except ValueError as e:
+                resumen["rechazadas"] += 1
+                if ruta_rechazos:
+                    if escritor is None:
+                        # Encabezado completo del archivo: las filas cortas dejan en blanco lo que no traen
+                        reporte = open(ruta_rechazos, "w", newline="", encoding="utf-8")
+                        escritor = csv.DictWriter(reporte, ["fila", "motivo", *dict.fromkeys(columnas)], restval="")
+                        escritor.writeheader()
+                    escritor.writerow({**crudo, "fila": n, "motivo": str(e)})
+                continue
+            if len(pendientes) >= lote:
+                with db.transaccion() as conn:
+                    _insertar(conn, pendientes)
+                resumen["insertadas"] += len(pendientes)
+                pendientes = []
+        # Un solo evento de auditoría por importación, junto con el último bloque
+        with db.transaccion() as conn:
+            if pendientes:
+                _insertar(conn, pendientes)
+            conn.execute(SQL_AUDITORIA, evento(insertadas=resumen["insertadas"] + len(pendientes)))
+        resumen["insertadas"] += len(pendientes)
+    except Exception:
+        # Los bloques ya confirmados quedan en la base: se audita lo que entró
+        with db.transaccion() as conn:
+            conn.execute(SQL_AUDITORIA, evento(" (interrumpida)"))
+        raise
+    finally:
+        filas.close()
+        if reporte:
+            reporte.close()
+    return resumen
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importación masiva de consultas desde CSV/XLSX")
+    parser.add_argument("archivo")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--usuario", required=True, help="Usuario que figura en la auditoría")
+    parser.add_argument("--medico", default=None, help="Médico para filas sin columna doctor")
+    parser.add_argument("--rechazos", default=None, help="CSV donde escribir las filas rechazadas")
+    parser.add_argument("--lote", type=int, default=LOTE)
+    args = parser.parse_args()
+    r = importar(AppDatabase(args.db), args.archivo, args.usuario, args.medico, args.rechazos, args.lote)
+    print(f"{r['leidas']} filas leídas, {r['insertadas']} insertadas, {r['rechazadas']} rechazadas")
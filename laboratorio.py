@@ -0,0 +1,213 @@
+"""
+Ingesta de resultados de laboratorio desde exportaciones NDJSON (una
+Observation FHIR, un Bundle FHIR o un objeto plano por línea). El archivo se
+procesa como una cadena de generadores (líneas -> recursos -> observaciones
+-> lotes), así que la memoria es constante sin importar el tamaño. Cada
+observación se asigna a la visita existente del paciente en esa fecha
+(px_id + date) y los valores se actualizan por lotes en una transacción.
+
+Formatos aceptados por línea:
+    {"resourceType": "Observation", "subject": {"reference": "Patient/001-..."},
+     "effectiveDateTime": "2024-03-01T08:00:00Z",
+     "code": {"coding": [{"system": "http://loinc.org", "code": "2823-3"}]},
+     "valueQuantity": {"value": 5.8, "unit": "mmol/L"}}
+    {"resourceType": "Bundle", "entry": [{"resource": {...Observation...}}, ...]}
+    {"px_id": "001-...", "date": "2024-03-01", "codigo": "potasio", "valor": 5.8}
+
+Uso por línea de comandos:
+    python laboratorio.py resultados.ndjson[.gz] --usuario admin [--no-asignadas pendientes.ndjson]
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+from itertools import islice
+from alertas import MARCA as MARCA_ALERTAS, reevaluar_registros
+from database import AppDatabase, DB_PATH, SQL_AUDITORIA, evento_auditoria
+
+LOTE = 5_000
+
+# Código LOINC -> columna de clinical_records
+LOINC = {
+    "33914-3": "tfg", "62238-1": "tfg", "98979-8": "tfg", "48642-3": "tfg", "48643-1": "tfg",
+    "2823-3": "potasio", "6298-4": "potasio",
+    "30934-4": "bnp", "42637-9": "bnp",
+    "6598-7": "troponina", "10839-9": "troponina", "89579-7": "troponina",
+    "2089-1": "ldl", "13457-7": "ldl", "18262-6": "ldl",
+    "9318-7": "albuminuria", "14959-1": "albuminuria", "32294-1": "albuminuria",
+}
+COLUMNAS_LAB = ("tfg", "potasio", "bnp", "troponina", "ldl", "albuminuria")
+# (columna, unidad recibida) -> factor a la unidad del sistema
+CONVERSIONES = {("ldl", "mmol/l"): 38.67}
+RE_FECHA = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+def _lineas(ruta):
+    abrir = gzip.open if ruta.endswith(".gz") else open
+    with abrir(ruta, "rt", encoding="utf-8") as f:
+        for n, linea in enumerate(f, start=1):
+            if linea.strip():
+                yield n, linea
+
+def _recursos(lineas, descartar):
+    """Decodifica cada línea y expande los Bundle en sus recursos"""
+    for n, linea in lineas:
+        try:
+            recurso = json.loads(linea)
+        except json.JSONDecodeError:
+            descartar(n, "JSON inválido", linea.strip())
+            continue
+        if not isinstance(recurso, dict):
+            descartar(n, "Recurso no es un objeto JSON", linea.strip())
+        elif recurso.get("resourceType") == "Bundle":
+            for entrada in recurso.get("entry") or ():
+                contenido = entrada.get("resource") if isinstance(entrada, dict) else None
+                if isinstance(contenido, dict):
+                    yield n, contenido
+                else:
+                    descartar(n, "Recurso no es un objeto JSON", entrada)
+        else:
+            yield n, recurso
+
+def _objeto(r, clave):
+    """r[clave] si es un objeto JSON ({} si falta); ValueError si trae otro tipo"""
+    valor = r.get(clave)
+    if valor is None:
+        return {}
+    if not isinstance(valor, dict):
+        raise ValueError(f"{clave} no es un objeto")
+    return valor
+
+def _paciente(r):
+    if "px_id" in r:
+        return r["px_id"]
+    sujeto = _objeto(r, "subject")
+    if sujeto.get("reference"):
+        return str(sujeto["reference"]).rsplit("/", 1)[-1]
+    return _objeto(sujeto, "identifier").get("value")
+
+def _fecha(r):
+    periodo = _objeto(r, "effectivePeriod")
+    valor = r.get("date") or r.get("fecha") or r.get("effectiveDateTime") or periodo.get("start") or r.get("issued")
+    m = RE_FECHA.match(str(valor or ""))
+    return m.group(0) if m else None
+
+def _columna(r):
+    codigo = r.get("codigo")
+    if codigo:
+        if not isinstance(codigo, str):
+            raise ValueError("codigo no es texto")
+        return codigo if codigo in COLUMNAS_LAB else LOINC.get(codigo)
+    codings = _objeto(r, "code").get("coding") or ()
+    if not isinstance(codings, list) or not all(isinstance(c, dict) for c in codings):
+        raise ValueError("code.coding no es una lista de objetos")
+    for coding in codings:
+        if isinstance(coding.get("code"), str) and coding["code"] in LOINC:
+            return LOINC[coding["code"]]
+    return None
+
+def _valor(r, columna):
+    cantidad = _objeto(r, "valueQuantity")
+    valor = r.get("valor", r.get("value", cantidad.get("value", r.get("valueDecimal"))))
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return None
+    unidad = str(cantidad.get("unit") or r.get("unidad") or "").lower()
+    return float(valor) * CONVERSIONES.get((columna, unidad), 1.0)
+
+def observaciones(recursos, descartar):
+    """Normaliza recursos a (línea, px_id, fecha, columna, valor); el resto va a `descartar`"""
+    for n, r in recursos:
+        if r.get("resourceType", "Observation") != "Observation":
+            continue
+        if r.get("status") in ("entered-in-error", "cancelled"):
+            continue
+        try:
+            columna = _columna(r)
+            if columna is None:
+                continue  # análisis que el sistema no registra
+            px_id, fecha, valor = _paciente(r), _fecha(r), _valor(r, columna)
+        except ValueError:
+            descartar(n, "estructura inválida", r)
+            continue
+        if not px_id or not fecha or valor is None:
+            descartar(n, "falta paciente, fecha o valor numérico", r)
+            continue
+        yield n, str(px_id), fecha, columna, valor
+
+def _lotes(iterable, tamano):
+    iterador = iter(iterable)
+    while lote := list(islice(iterador, tamano)):
+        yield lote
+
+def _visitas(conn, claves):
+    """(px_id, fecha) -> id de la visita (la última si hubo varias ese día)"""
+    valores = ", ".join("(?, ?)" for _ in claves)
+    filas = conn.execute(
+        f"""SELECT px_id, date, MAX(id) FROM clinical_records
+            WHERE (px_id, date) IN (VALUES {valores}) GROUP BY px_id, date""",
+        [x for clave in claves for x in clave]).fetchall()
+    return {(px_id, fecha): i for px_id, fecha, i in filas}
+
+def ingerir(db, ruta, usuario, ruta_no_asignadas=None, lote=LOTE):
+    """
+    Aplica los resultados de `ruta` sobre las visitas existentes, un lote por
+    transacción (si una misma visita y análisis se repiten, gana la última
+    línea del archivo). Las observaciones sin visita o inválidas se escriben en
+    `ruta_no_asignadas` (NDJSON con línea y motivo). Las alertas de los
+    registros ya barridos se recalculan. Devuelve un dict de totales.
+    """
+    resumen = {"observaciones": 0, "aplicadas": 0, "no_asignadas": 0}
+    salida = open(ruta_no_asignadas, "w", encoding="utf-8") if ruta_no_asignadas else None
+
+    def descartar(n, motivo, original):
+        # Se escribe al momento: nada se acumula aunque el archivo sea inválido entero
+        resumen["no_asignadas"] += 1
+        if salida:
+            salida.write(json.dumps({"linea": n, "motivo": motivo, "original": original},
+                                    ensure_ascii=False) + "\n")
+
+    estado = " (interrumpida)"
+    try:
+        flujo = observaciones(_recursos(_lineas(ruta), descartar), descartar)
+        for bloque in _lotes(flujo, lote):
+            resumen["observaciones"] += len(bloque)
+            por_columna = {}
+            with db.transaccion() as conn:
+                visitas = _visitas(conn, list({(px_id, fecha) for _, px_id, fecha, _, _ in bloque}))
+                for n, px_id, fecha, columna, valor in bloque:
+                    record_id = visitas.get((px_id, fecha))
+                    if record_id is None:
+                        descartar(n, f"sin visita para {px_id} el {fecha}",
+                                  {"px_id": px_id, "date": fecha, "codigo": columna, "valor": valor})
+                    else:
+                        por_columna.setdefault(columna, []).append((valor, record_id))
+                for columna, valores in por_columna.items():
+                    conn.executemany(f"UPDATE clinical_records SET {columna} = ? WHERE id = ?", valores)
+            actualizados = {i for valores in por_columna.values() for _, i in valores}
+            resumen["aplicadas"] += sum(len(v) for v in por_columna.values())
+            # Los registros por encima de la marca los toma el próximo barrido
+            marca = db.marca_agua(MARCA_ALERTAS)
+            reevaluar_registros(db, [i for i in actualizados if i <= marca])
+        estado = ""
+    finally:
+        if salida:
+            salida.close()
+        with db.transaccion() as conn:
+            conn.execute(SQL_AUDITORIA, evento_auditoria(
+                usuario, "Ingesta Laboratorio",
+                f"Archivo: {os.path.basename(ruta)}{estado} | Observaciones: {resumen['observaciones']} | "
+                f"Aplicadas: {resumen['aplicadas']} | "
+                f"No asignadas: {resumen['no_asignadas']}"))
+    return resumen
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingesta de resultados de laboratorio (NDJSON/FHIR)")
+    parser.add_argument("archivo")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--usuario", required=True, help="Usuario que figura en la auditoría")
+    parser.add_argument("--no-asignadas", default=None, help="NDJSON donde escribir lo que no se pudo asignar")
+    parser.add_argument("--lote", type=int, default=LOTE)
+    args = parser.parse_args()
+    r = ingerir(AppDatabase(args.db), args.archivo, args.usuario, args.no_asignadas, args.lote)
+    print(f"{r['observaciones']} observaciones, {r['aplicadas']} aplicadas, "
+          f"{r['no_asignadas']} no asignadas")
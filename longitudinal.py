@@ -0,0 +1,43 @@
+"""
+Consultas sobre el resumen longitudinal por paciente (tabla patient_summary,
+mantenida por triggers en database.py): tendencia de un paciente y pacientes
+con el descenso más rápido. Cada consulta es una búsqueda por índice, sin
+recorrer el historial completo.
+
+Las pendientes están en unidades por año (ml/min/1.73m² por año para la TFG,
+puntos de FEVI por año), ajustadas por mínimos cuadrados sobre todas las
+visitas del paciente con ese valor.
+"""
+from database import SERIES_RESUMEN
+
+COLUMNAS_RESUMEN = ["px_id", "px_name", "primera", "ultima", "visitas", "tfg", "fevi", "potasio", "sys",
+                    "riesgo_erc", "n_tfg", "pendiente_tfg", "n_fevi", "pendiente_fevi"]
+MINIMO_VISITAS = 3
+MINIMO_DIAS = 90  # con visitas muy juntas la pendiente anualizada es puro ruido
+
+def resumenes(db, px_ids):
+    """DataFrame de resumen de los pacientes dados (los que no tienen visitas no aparecen)"""
+    px_ids = sorted({str(p) for p in px_ids})
+    if not px_ids:
+        return db.leer_df(f"SELECT {', '.join(COLUMNAS_RESUMEN)} FROM patient_summary WHERE 0")
+    marcas = ", ".join("?" * len(px_ids))
+    return db.leer_df(f"SELECT {', '.join(COLUMNAS_RESUMEN)} FROM patient_summary WHERE px_id IN ({marcas})",
+                      px_ids, tablas=("clinical_records",))
+
+def resumen_paciente(db, px_id):
+    """Resumen de un paciente como dict, o None si no tiene visitas"""
+    df = resumenes(db, [px_id])
+    return None if df.empty else df.iloc[0].to_dict()
+
+def pacientes_en_descenso(db, serie="tfg", limite=20, minimo_visitas=MINIMO_VISITAS, minimo_dias=MINIMO_DIAS):
+    """
+    Pacientes con la pendiente más negativa de `serie` ('tfg' | 'fevi'),
+    recorriendo el índice de la pendiente de menor a mayor.
+    """
+    if serie not in SERIES_RESUMEN:
+        raise ValueError(f"Serie no soportada: {serie}")
+    return db.leer_df(f"""SELECT {', '.join(COLUMNAS_RESUMEN)} FROM patient_summary
+        WHERE pendiente_{serie} < 0 AND n_{serie} >= ?
+          AND julianday(ultima) - julianday(primera) >= ?
+        ORDER BY pendiente_{serie} LIMIT ?""",
+        [int(minimo_visitas), float(minimo_dias), int(limite)], tablas=("clinical_records",))
@@ -0,0 +1,365 @@
+import bisect
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from datetime import date
+from fpdf import FPDF
+
+# =============================================
+# MOTOR DE RECOMENDACIONES Y PDF
+# =============================================
+RUTA_REGLAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reglas_clinicas.json")
+RECARGA_INTERVALO_S = 1.0
+CATEGORIAS = ("dieta", "estilo", "clinico", "seguimiento")
+_INTERVALO = re.compile(r"^\s*([\[(])\s*(-inf|[-+]?\d+(?:\.\d+)?)\s*,\s*(inf|[-+]?\d+(?:\.\d+)?)\s*([\])])\s*$")
+
+def _parsear_intervalo(texto):
+    """'[30, 60)' -> (30.0, True, 60.0, False): límites y si cada extremo es cerrado"""
+    m = _INTERVALO.match(texto)
+    if not m:
+        raise ValueError(f"Intervalo inválido: {texto!r}")
+    abre, minimo, maximo, cierra = m.groups()
+    minimo, maximo = float(minimo), float(maximo)
+    if minimo > maximo:
+        raise ValueError(f"Intervalo vacío: {texto!r}")
+    return minimo, abre == "[", maximo, cierra == "]"
+
+class ParametroCompilado:
+    """
+    Reglas de un parámetro numérico reducidas a segmentos elementales.
+    Cada límite se guarda en `der` (el valor límite pertenece al segmento de su
+    derecha) o en `izq` (pertenece al de su izquierda); el segmento de un valor
+    es bisect_right(der, v) + bisect_left(izq, v), y cada segmento tiene
+    precalculadas sus salidas en el orden de la tabla.
+    """
+    def __init__(self, nombre, defecto, reglas):
+        self.nombre = nombre
+        self.defecto = defecto
+        der, izq = set(), set()
+        for r in reglas:
+            minimo, min_cerrado, maximo, max_cerrado = r["_intervalo"]
+            if minimo != -math.inf:
+                (der if min_cerrado else izq).add(minimo)
+            if maximo != math.inf:
+                (izq if max_cerrado else der).add(maximo)
+        self.der = sorted(der)
+        self.izq = sorted(izq)
+
+        # Un punto representativo por segmento: cada límite y los puntos medios
+        limites = sorted(der | izq)
+        puntos = list(limites) + [(a + b) / 2 for a, b in zip(limites, limites[1:])]
+        puntos += [limites[0] - 1, limites[-1] + 1] if limites else [0.0]
+        self.segmentos = [()] * (len(self.der) + len(self.izq) + 1)
+        self.alertas = {}  # código de alerta -> segmentos donde aplica
+        for p in puntos:
+            aplican = [r for r in reglas if _contiene(r["_intervalo"], p)]
+            seg = self.segmento(p)
+            self.segmentos[seg] = tuple(r["_salida"] for r in aplican)
+            for r in aplican:
+                if r["_codigo"]:
+                    self.alertas.setdefault(r["_codigo"], set()).add(seg)
+
+    def segmento(self, v):
+        return bisect.bisect_right(self.der, v) + bisect.bisect_left(self.izq, v)
+
+    def segmentos_np(self, valores):
+        """Versión vectorizada de segmento() para un arreglo NumPy"""
+        return (np.searchsorted(np.asarray(self.der, dtype=np.float64), valores, side="right")
+                + np.searchsorted(np.asarray(self.izq, dtype=np.float64), valores, side="left"))
+
+    def salidas(self, v):
+        if v != v:
+            return ()
+        return self.segmentos[bisect.bisect_right(self.der, v) + bisect.bisect_left(self.izq, v)]
+
+class ParametroCategorico:
+    def __init__(self, nombre, defecto, reglas):
+        self.nombre = nombre
+        self.defecto = defecto
+        self.tabla = {}
+        self.alertas = {}  # código de alerta -> valores donde aplica
+        for r in reglas:
+            self.tabla.setdefault(r["valor"], []).append(r["_salida"])
+            if r["_codigo"]:
+                self.alertas.setdefault(r["_codigo"], set()).add(r["valor"])
+
+    def salidas(self, v):
+        return self.tabla.get(v, ())
+
+def _contiene(intervalo, v):
+    minimo, min_cerrado, maximo, max_cerrado = intervalo
+    return ((v >= minimo if min_cerrado else v > minimo) and
+            (v <= maximo if max_cerrado else v < maximo))
+
+class MotorReglas:
+    """Tabla de reglas compilada e inmutable; se reemplaza completa al recargar"""
+    def __init__(self, tabla):
+        self.version = str(tabla["version"])
+        parametros = tabla["parametros"]
+        por_parametro = {}
+        self.alertas = []
+        for r in tabla["reglas"]:
+            r = dict(r)
+            nombre = r["parametro"]
+            if nombre not in parametros:
+                raise ValueError(f"Parámetro sin declarar: {nombre}")
+            if ("intervalo" in r) == ("valor" in r):
+                raise ValueError(f"La regla de {nombre} necesita 'intervalo' o 'valor' (solo uno)")
+            codigo = r.get("alerta")
+            if codigo is None and r.get("categoria") not in CATEGORIAS:
+                raise ValueError(f"Categoría inválida: {r.get('categoria')!r}")
+            if "intervalo" in r:
+                r["_intervalo"] = _parsear_intervalo(r["intervalo"])
+            # (lista destino: índice de categoría o -1 si es alerta, mensaje, lleva {valor})
+            r["_salida"] = (-1 if codigo else CATEGORIAS.index(r["categoria"]), r["mensaje"],
+                            "{valor}" in r["mensaje"])
+            r["_codigo"] = codigo
+            if codigo:
+                self.alertas.append((codigo, nombre, r["mensaje"]))
+            por_parametro.setdefault(nombre, []).append(r)
+
+        self.parametros = []
+        for nombre, reglas in por_parametro.items():
+            tipos = {"intervalo" in r for r in reglas}
+            if len(tipos) > 1:
+                raise ValueError(f"El parámetro {nombre} mezcla reglas numéricas y categóricas")
+            clase = ParametroCompilado if tipos == {True} else ParametroCategorico
+            self.parametros.append(clase(nombre, parametros[nombre]["defecto"], reglas))
+        self.por_nombre = {p.nombre: p for p in self.parametros}
+
+    def evaluar(self, d):
+        listas = [[], [], [], [], []]  # CATEGORIAS + alertas
+        for p in self.parametros:
+            v = d.get(p.nombre, p.defecto)
+            if v is None:
+                v = p.defecto
+            for destino, mensaje, con_valor in p.salidas(v):
+                listas[destino].append(mensaje.replace("{valor}", str(v)) if con_valor else mensaje)
+        return dict(zip(CATEGORIAS, listas)), listas[-1]
+
+def cargar_reglas(ruta=RUTA_REGLAS):
+    with open(ruta, encoding="utf-8") as f:
+        return MotorReglas(json.load(f))
+
+_motor = None
+_firma = None
+_ultimo_chequeo = 0.0
+_lock_motor = threading.Lock()
+
+def motor_reglas():
+    """
+    Motor compilado vigente. Revisa (como mucho una vez por segundo) si el
+    archivo de reglas cambió y lo recompila; si la nueva tabla es inválida se
+    conserva la versión anterior.
+    """
+    global _motor, _firma, _ultimo_chequeo
+    if _motor is not None and time.monotonic() - _ultimo_chequeo < RECARGA_INTERVALO_S:
+        return _motor
+    with _lock_motor:
+        info = os.stat(RUTA_REGLAS)
+        firma = (info.st_mtime_ns, info.st_size)
+        if firma != _firma:
+            try:
+                nuevo = cargar_reglas()
+            except (ValueError, KeyError, TypeError, json.JSONDecodeError) as e:
+                if _motor is None:
+                    raise
+                print(f"Reglas clínicas inválidas, se mantiene la versión {_motor.version}: {e}")
+            else:
+                if _motor is not None:
+                    print(f"Reglas clínicas recargadas: versión {nuevo.version}")
+                _motor = nuevo
+            _firma = firma
+        _ultimo_chequeo = time.monotonic()
+    return _motor
+
+def generar_plan_cientifico(d):
+    """
+    Genera recomendaciones basadas en guías KDIGO 2024 y AHA/ACC 2023
+    (tabla de reglas en reglas_clinicas.json)
+    """
+    return motor_reglas().evaluar(d)
+
+# Fuentes base del PDF = latin-1: equivalentes ASCII para los símbolos de las reglas
+SUSTITUCIONES_PDF = {"≥": ">=", "≤": "<=", "•": "*", "–": "-", "—": "-", "“": '"', "”": '"',
+                     "‘": "'", "’": "'", "…": "...", "→": "->"}
+_NO_LATIN1 = re.compile(r"[^\x00-\xff]+ ?")
+
+def texto_latin1(texto):
+    for simbolo, reemplazo in SUSTITUCIONES_PDF.items():
+        texto = texto.replace(simbolo, reemplazo)
+    return _NO_LATIN1.sub("", texto)  # emojis y demás caracteres sin equivalente
+
+class ReportePDF(FPDF):
+    """FPDF que adapta el texto a latin-1 en vez de fallar con emojis o símbolos"""
+    def normalize_text(self, text):
+        return super().normalize_text(texto_latin1(text))
+
+# Subir al cambiar el diseño de crear_pdf: invalida los PDF en caché
+PLANTILLA_PDF = "3"
+CACHE_PDF_MAX_BYTES = 64 * 1024 * 1024
+
+def _fecha_reporte(fecha):
+    """'2026-10-16' -> '16/10/2026'; lo que no sea una fecha ISO se imprime tal cual"""
+    try:
+        return date.fromisoformat(str(fecha)[:10]).strftime('%d/%m/%Y')
+    except ValueError:
+        return str(fecha)
+
+def crear_pdf(datos, recoms, alertas, medico, fecha):
+    """
+    Genera PDF profesional con datos clínicos y recomendaciones. `fecha` es la
+    de la consulta (no la de generación: el PDF puede servirse desde la caché).
+    """
+    pdf = ReportePDF()
+    pdf.add_page()
+    
+    # Encabezado
+    pdf.set_font("Arial", 'B', 18)
+    pdf.set_text_color(0, 51, 102)
+    pdf.cell(0, 12, "REPORTE MEDICO CARDIORRENAL", ln=True, align='C')
+    pdf.set_text_color(0, 0, 0)
+    pdf.ln(5)
+    
+    # Información del paciente
+    pdf.set_font("Arial", 'B', 13)
+    pdf.set_fill_color(230, 240, 250)
+    pdf.cell(0, 10, "DATOS DEL PACIENTE", ln=True, fill=True)
+    pdf.set_font("Arial", '', 11)
+    pdf.cell(95, 8, f"Nombre: {datos['px_name']}", border=1)
+    pdf.cell(95, 8, f"ID: {datos['px_id']}", border=1, ln=True)
+    pdf.cell(95, 8, f"Fecha: {_fecha_reporte(fecha)}", border=1)
+    pdf.cell(95, 8, f"Medico: Dr. {medico}", border=1, ln=True)
+    pdf.ln(8)
+    
+    # Resultados clínicos
+    pdf.set_font("Arial", 'B', 13)
+    pdf.set_fill_color(230, 240, 250)
+    pdf.cell(0, 10, "RESULTADOS CLINICOS", ln=True, fill=True)
+    pdf.set_font("Arial", '', 11)
+    
+    # Registros históricos o importados pueden no traer todos los valores
+    resultados = [
+        ("Presion Sistolica", 'sys', " mmHg"),
+        ("TFG (Funcion Renal)", 'tfg', " ml/min/1.73m2"),
+        ("Potasio (K+)", 'potasio', " mEq/L"),
+        ("FEVI (Fraccion Eyeccion)", 'fevi', "%"),
+        ("Horas de Sueno", 'sleep', " horas/dia"),
+        ("Nivel de Estres", 'stress', "")
+    ]
+    
+    for label, clave, unidad in resultados:
+        valor = datos.get(clave)
+        pdf.cell(95, 7, label, border=1)
+        pdf.cell(95, 7, "N/A" if valor is None else f"{valor}{unidad}", border=1, ln=True)
+    pdf.ln(5)
+    
+    # Alertas críticas
+    if alertas:
+        pdf.set_font("Arial", 'B', 12)
+        pdf.set_text_color(220, 20, 60)
+        pdf.cell(0, 8, "ALERTAS CLINICAS", ln=True)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font("Arial", '', 10)
+        for alerta in alertas:
+            pdf.multi_cell(0, 6, f"* {alerta}", new_x="LMARGIN", new_y="NEXT")
+        pdf.ln(3)
+    
+    # Recomendaciones
+    pdf.set_font("Arial", 'B', 13)
+    pdf.set_fill_color(230, 240, 250)
+    pdf.cell(0, 10, "PLAN DE TRATAMIENTO Y RECOMENDACIONES", ln=True, fill=True)
+    pdf.ln(2)
+    
+    categorias = {
+        'clinico': ('MANEJO CLINICO', (0, 100, 0)),
+        'dieta': ('INTERVENCION NUTRICIONAL', (139, 69, 19)),
+        'estilo': ('MODIFICACION DE ESTILO DE VIDA', (0, 51, 102)),
+        'seguimiento': ('PLAN DE SEGUIMIENTO', (75, 0, 130))
+    }
+    
+    for cat, items in recoms.items():
+        if items:
+            titulo, color = categorias.get(cat, (cat.upper(), (0, 0, 0)))
+            pdf.set_font("Arial", 'B', 11)
+            pdf.set_text_color(*color)
+            pdf.cell(0, 8, titulo, ln=True)
+            pdf.set_text_color(0, 0, 0)
+            pdf.set_font("Arial", '', 10)
+            for item in items:
+                pdf.multi_cell(0, 6, f"  * {item}", new_x="LMARGIN", new_y="NEXT")
+            pdf.ln(3)
+    
+    # Disclaimer
+    pdf.ln(5)
+    pdf.set_font("Arial", 'I', 9)
+    pdf.set_text_color(128, 128, 128)
+    pdf.multi_cell(0, 5, "AVISO LEGAL: Este reporte es una herramienta de apoyo clinico basada en guias KDIGO 2024 y AHA/ACC 2023. No sustituye el juicio clinico profesional ni la evaluacion individualizada del paciente. Todas las decisiones terapeuticas deben ser validadas por el medico tratante considerando el contexto clinico completo del paciente.", new_x="LMARGIN", new_y="NEXT")
+    
+    # Firma
+    pdf.ln(8)
+    pdf.set_text_color(0, 0, 0)
+    pdf.set_font("Arial", '', 10)
+    pdf.cell(0, 6, "_" * 40, ln=True, align='C')
+    pdf.cell(0, 6, f"Dr. {medico}", ln=True, align='C')
+    pdf.cell(0, 6, "Firma y Sello Profesional", ln=True, align='C')
+    
+    return bytes(pdf.output())
+
+class CachePDF:
+    """
+    LRU acotado por bytes de PDFs ya generados, compartido por todas las
+    sesiones del proceso. La clave es un hash del contenido, así que dos
+    reportes idénticos (mismo paciente, recomendaciones, médico y plantilla)
+    se generan una sola vez.
+    """
+    def __init__(self, max_bytes=CACHE_PDF_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._pdfs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            pdf = self._pdfs.get(clave)
+            if pdf is not None:
+                self._pdfs.move_to_end(clave)
+            return pdf
+
+    def guardar(self, clave, pdf):
+        if len(pdf) > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._pdfs.pop(clave, None)
+            if anterior is not None:
+                self.bytes -= len(anterior)
+            self._pdfs[clave] = pdf
+            self.bytes += len(pdf)
+            while self.bytes > self.max_bytes:
+                _, expulsado = self._pdfs.popitem(last=False)
+                self.bytes -= len(expulsado)
+
+    def __len__(self):
+        return len(self._pdfs)
+
+cache_pdf = CachePDF()
+
+def clave_pdf(datos, recoms, alertas, medico, fecha):
+    contenido = json.dumps([PLANTILLA_PDF, datos, recoms, alertas, medico, fecha],
+                           sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+def pdf_reporte(datos, recoms, alertas, medico, fecha):
+    """crear_pdf con caché: solo genera si ese mismo reporte (incluida la fecha) no está ya en memoria"""
+    clave = clave_pdf(datos, recoms, alertas, medico, fecha)
+    pdf = cache_pdf.obtener(clave)
+    if pdf is None:
+        pdf = crear_pdf(datos, recoms, alertas, medico, fecha)
+        cache_pdf.guardar(clave, pdf)
+    return pdf
@@ -0,0 +1,34 @@
+"""
+Pool de procesos para el trabajo CPU-bound (puntaje de riesgo por lote,
+reportes PDF y la API). Los procesos se crean con spawn: no heredan las
+conexiones SQLite ni los hilos del proceso que los lanza, y cada uno carga
+una sola vez lo que necesita con `inicializar` (modelo, motor de reglas).
+"""
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+EN_VUELO_POR_PROCESO = 2  # tareas pendientes por proceso: mantiene ocupado al pool con memoria acotada
+
+def procesos_por_defecto(procesos=None):
+    return procesos or os.cpu_count() or 1
+
+def pool_spawn(procesos=None, inicializar=None):
+    """ProcessPoolExecutor con `procesos` procesos (por defecto uno por núcleo) arrancados con spawn"""
+    return ProcessPoolExecutor(max_workers=procesos_por_defecto(procesos), initializer=inicializar,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+def mapa_acotado(pool, fn, tareas, procesos, en_vuelo=EN_VUELO_POR_PROCESO):
+    """
+    fn(tarea) para cada tarea en el pool, en el orden de `tareas`. Como mucho
+    `en_vuelo` tareas por proceso están pendientes, así que `tareas` (un
+    generador) se consume al ritmo del pool y no se acumula en memoria.
+    """
+    pendientes = deque()
+    for tarea in tareas:
+        pendientes.append(pool.submit(fn, tarea))
+        if len(pendientes) >= en_vuelo * procesos:
+            yield pendientes.popleft().result()
+    while pendientes:
+        yield pendientes.popleft().result()
@@ -0,0 +1,178 @@
+"""
+Pronóstico de TFG y FEVI a partir de la trayectoria de cada paciente. La
+pendiente sale de las sumas de mínimos cuadrados de patient_summary (todas
+las visitas del paciente), con contracción hacia la pendiente típica de la
+cohorte: con pocas visitas o muy juntas domina la cohorte, con años de
+seguimiento domina el propio paciente. La proyección parte del último valor
+medido y se calcula para toda la cohorte a la vez con arreglos NumPy.
+
+Uso por línea de comandos:
+    python pronostico.py paciente 001-0000000-0
+    python pronostico.py g4 [--meses 12] [--salida proyectados_g4.csv]
+"""
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+from database import AppDatabase, DB_PATH, EPOCA_JULIANA, SERIES_RESUMEN
+
+HORIZONTES_MESES = (0, 2, 4, 6, 12)
+RANGOS = {"tfg": (0.0, 150.0), "fevi": (5.0, 80.0)}
+UMBRAL_G4 = 30.0  # TFG < 30: KDIGO G4
+# Contracción (ridge sobre la pendiente): equivale a λ años² de dispersión de visitas "prestados" de la cohorte
+PESO_COHORTE = 0.5
+# Pendiente de la cohorte: mediana de pacientes con trayectoria bien determinada
+PENDIENTE_DEFECTO = {"tfg": -1.0, "fevi": 0.0}
+COHORTE_MIN_VISITAS = 3
+COHORTE_MIN_SXX = 0.25  # años²: p. ej. 3 visitas repartidas en más de un año
+COHORTE_MIN_PACIENTES = 30
+COHORTE_INTERVALO_S = 3600
+CACHE_PACIENTES_MAX = 10_000
+
+def _columnas_sumas():
+    return [f"{s}_{c}" for c in SERIES_RESUMEN for s in ("n", "sx", "sy", "sxx", "sxy")]
+
+def _x(fecha):
+    """Fecha -> años desde J2000 (la misma escala de las sumas de patient_summary)"""
+    return (fecha.toordinal() + 1721424.5 - EPOCA_JULIANA) / 365.25
+
+def _centradas(df, serie):
+    """Σ(x-x̄)², Σ(x-x̄)(y-ȳ), x̄, ȳ por paciente (NaN sin mediciones)"""
+    n = df[f"n_{serie}"].to_numpy(np.float64)
+    sx, sy = df[f"sx_{serie}"].to_numpy(np.float64), df[f"sy_{serie}"].to_numpy(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mx, my = sx / n, sy / n
+    sxx_c = np.maximum(df[f"sxx_{serie}"].to_numpy(np.float64) - sx * mx, 0.0)
+    sxy_c = df[f"sxy_{serie}"].to_numpy(np.float64) - sx * my
+    return n, sxx_c, sxy_c, mx, my
+
+def pendiente_cohorte(df, serie):
+    """Mediana de las pendientes (por año) de los pacientes con trayectoria bien determinada"""
+    n, sxx_c, sxy_c, _, _ = _centradas(df, serie)
+    bien = (n >= COHORTE_MIN_VISITAS) & (sxx_c >= COHORTE_MIN_SXX)
+    if bien.sum() < COHORTE_MIN_PACIENTES:
+        return PENDIENTE_DEFECTO[serie]
+    return float(np.median(sxy_c[bien] / sxx_c[bien]))
+
+def proyectar(df, serie, x_destinos, pendiente_prior, peso=PESO_COHORTE):
+    """
+    Matriz (pacientes × destinos) con el valor proyectado de `serie` en cada
+    x de `x_destinos` (años desde J2000). `df` trae las sumas de la serie,
+    el último valor medido y `x_ultima`. NaN si el paciente no tiene mediciones.
+    """
+    n, sxx_c, sxy_c, mx, my = _centradas(df, serie)
+    pendiente = (sxy_c + peso * pendiente_prior) / (sxx_c + peso)
+    # Punto de partida: el último valor medido; si la última visita no lo trae, la recta ajustada
+    ultimo = df[serie].to_numpy(np.float64)
+    x_ultima = df["x_ultima"].to_numpy(np.float64)
+    ajustado = my + pendiente * (x_ultima - mx)
+    inicio = np.where(np.isnan(ultimo), ajustado, ultimo)
+    valores = inicio[:, None] + pendiente[:, None] * (np.asarray(x_destinos, np.float64)[None, :] - x_ultima[:, None])
+    valores[n == 0] = np.nan
+    return np.clip(valores, *RANGOS[serie])
+
+# =============================================
+# COHORTE Y CACHÉ POR PACIENTE
+# =============================================
+_COLUMNAS = ["px_id", "px_name", "ultima", "ultimo_id", "visitas", "tfg", "fevi", *_columnas_sumas()]
+_SQL_COHORTE = (f"SELECT {', '.join(_COLUMNAS)}, (julianday(ultima) - {EPOCA_JULIANA}) / 365.25 AS x_ultima "
+                "FROM patient_summary")
+
+_prior = None
+_prior_calculado = 0.0
+_lock_prior = threading.Lock()
+_cache = OrderedDict()
+_lock_cache = threading.Lock()
+
+def pendientes_cohorte(db):
+    """Pendiente de la cohorte por serie; se recalcula como mucho una vez por COHORTE_INTERVALO_S"""
+    global _prior, _prior_calculado
+    if _prior is not None and time.monotonic() - _prior_calculado < COHORTE_INTERVALO_S:
+        return _prior
+    with _lock_prior:
+        if _prior is None or time.monotonic() - _prior_calculado >= COHORTE_INTERVALO_S:
+            sumas = db.leer_df(f"SELECT {', '.join(_columnas_sumas())} FROM patient_summary",
+                               tablas=("clinical_records",))
+            _prior = {serie: pendiente_cohorte(sumas, serie) for serie in SERIES_RESUMEN}
+            _prior_calculado = time.monotonic()
+    return _prior
+
+def proyeccion_paciente(db, px_id, hoy=None, horizontes=HORIZONTES_MESES):
+    """
+    {"meses": (...), "tfg": (...), "fevi": (...)} proyectados desde `hoy` o None
+    si el paciente no tiene visitas. Se cachea por paciente mientras su
+    resumen (última visita y sumas) y la pendiente de la cohorte no cambien.
+    """
+    hoy = hoy or date.today()
+    df = db.leer_df(f"{_SQL_COHORTE} WHERE px_id = ?", [str(px_id)], tablas=("clinical_records",))
+    if df.empty:
+        return None
+    prior = pendientes_cohorte(db)
+    fila = df.iloc[0]
+    clave = (tuple(None if v != v else v for v in fila.tolist()), tuple(prior.items()), hoy, tuple(horizontes))
+    with _lock_cache:
+        if clave in _cache:
+            _cache.move_to_end(clave)
+            return _cache[clave]
+
+    x_destinos = [_x(hoy) + m / 12 for m in horizontes]
+    resultado = {"meses": tuple(horizontes)}
+    for serie in SERIES_RESUMEN:
+        valores = proyectar(df, serie, x_destinos, prior[serie])[0]
+        resultado[serie] = None if np.isnan(valores).all() else tuple(round(float(v), 2) for v in valores)
+    with _lock_cache:
+        _cache[clave] = resultado
+        while len(_cache) > CACHE_PACIENTES_MAX:
+            _cache.popitem(last=False)
+    return resultado
+
+def proyectados_g4(db, meses=12, hoy=None):
+    """
+    Pacientes hoy por encima de G4 (última TFG >= 30) cuya TFG proyectada
+    cae por debajo de 30 dentro de `meses`, con los meses estimados hasta
+    cruzar el umbral. Toda la cohorte se proyecta en una sola operación.
+    """
+    hoy = hoy or date.today()
+    df = db.leer_df(f"{_SQL_COHORTE} WHERE n_tfg > 0", tablas=("clinical_records",))
+    prior = pendientes_cohorte(db)["tfg"]
+    x_hoy = _x(hoy)
+    actual, final = proyectar(df, "tfg", [x_hoy, x_hoy + meses / 12], prior).T
+    n, sxx_c, sxy_c, _, _ = _centradas(df, "tfg")
+    pendiente = (sxy_c + PESO_COHORTE * prior) / (sxx_c + PESO_COHORTE)
+    en_riesgo = (actual >= UMBRAL_G4) & (final < UMBRAL_G4)
+
+    salida = df.loc[en_riesgo, ["px_id", "px_name", "ultima", "visitas", "tfg"]].copy()
+    salida["tfg_proyectada_hoy"] = actual[en_riesgo].round(1)
+    salida[f"tfg_{meses}m"] = final[en_riesgo].round(1)
+    salida["pendiente_anual"] = pendiente[en_riesgo].round(2)
+    salida["meses_hasta_g4"] = ((UMBRAL_G4 - actual[en_riesgo]) / pendiente[en_riesgo] * 12).round(1)
+    return salida.sort_values("meses_hasta_g4").reset_index(drop=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pronóstico de TFG/FEVI por trayectoria del paciente")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_pac = sub.add_parser("paciente", help="Proyección de un paciente")
+    p_pac.add_argument("px_id")
+    p_g4 = sub.add_parser("g4", help="Pacientes proyectados a G4")
+    p_g4.add_argument("--meses", type=int, default=12)
+    p_g4.add_argument("--salida", default=None, help="CSV de salida (si no, se imprime)")
+    args = parser.parse_args()
+    db = AppDatabase(args.db)
+    if args.comando == "paciente":
+        p = proyeccion_paciente(db, args.px_id)
+        if p is None:
+            print("Sin visitas registradas")
+        else:
+            for serie in SERIES_RESUMEN:
+                print(f"{serie.upper()}: " + ("sin mediciones" if p[serie] is None else
+                      "  ".join(f"+{m}m {v:.1f}" for m, v in zip(p["meses"], p[serie]))))
+    else:
+        df = proyectados_g4(db, args.meses)
+        if args.salida:
+            df.to_csv(args.salida, index=False)
+            print(f"{len(df)} pacientes proyectados a G4 en {args.meses} meses -> {args.salida}")
+        else:
+            print(df.to_string(index=False))
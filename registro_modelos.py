@@ -0,0 +1,174 @@
+"""
+Registro de modelos de riesgo ERC. Cada versión es un JSON en DIR_MODELOS con
+coeficientes, intercepto, orden de variables y metadatos; DIR_MODELOS/activo.json
+apunta a la versión en uso. DIR_MODELOS se toma de NEFROCARDIO_DIR_MODELOS o,
+por defecto, es modelos/ junto a la base (DB_PATH), fuera del código fuente. La inferencia es una regresión logística en
+NumPy puro (sin scikit-learn) y la versión activa se puede cambiar en caliente:
+los procesos detectan el cambio del puntero y recargan sin reiniciar.
+"""
+import json
+import math
+import os
+import threading
+import time
+import numpy as np
+from datetime import datetime
+from database import DB_PATH
+
+DIR_MODELOS = os.path.abspath(os.environ.get("NEFROCARDIO_DIR_MODELOS")
+                              or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "modelos"))
+RUTA_ACTIVO = os.path.join(DIR_MODELOS, "activo.json")
+RUTA_MODELO_INICIAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelo_erc.joblib")
+VERSION_INICIAL = "erc-v1"
+RECARGA_INTERVALO_S = 1.0
+
+class ScorerLogistico:
+    """p = 1 / (1 + exp(-(b + x·w))), equivalente a LogisticRegression.predict_proba[:, 1]"""
+    def __init__(self, version, variables, coeficientes, intercepto, metadatos=None):
+        self.version = version
+        self.variables = list(variables)
+        self.coef = np.asarray(coeficientes, dtype=np.float64)
+        self.intercepto = float(intercepto)
+        self.metadatos = metadatos or {}
+        self._coef_py = [float(c) for c in self.coef]
+        if len(self._coef_py) != len(self.variables):
+            raise ValueError(f"{version}: {len(self._coef_py)} coeficientes para {len(self.variables)} variables")
+
+    def puntuar_fila(self, valores):
+        """Una fila (secuencia en el orden de `variables`); aritmética de Python, sin NumPy"""
+        z = self.intercepto
+        for c, x in zip(self._coef_py, valores):
+            z += c * x
+        if z >= 0:
+            return 1.0 / (1.0 + math.exp(-z))
+        e = math.exp(z)
+        return e / (1.0 + e)
+
+    def puntuar_matriz(self, X):
+        """Matriz (n, variables) -> probabilidades; filas con NaN devuelven NaN"""
+        z = np.asarray(X, dtype=np.float64) @ self.coef + self.intercepto
+        # Sigmoide estable para |z| grande
+        with np.errstate(invalid="ignore"):
+            return np.exp(-np.logaddexp(0.0, -z))
+
+def _escribir_json(ruta, datos, reemplazar=True):
+    """
+    Publica con un rename atómico desde un temporal propio de este proceso e
+    hilo. Con reemplazar=False falla con FileExistsError si `ruta` ya existe.
+    """
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        if reemplazar:
+            os.replace(tmp, ruta)
+        else:
+            os.link(tmp, ruta)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def _ruta_version(version):
+    if not version or os.sep in version or version.startswith("."):
+        raise ValueError(f"Nombre de versión inválido: {version!r}")
+    return os.path.join(DIR_MODELOS, f"{version}.json")
+
+def registrar(variables, coeficientes, intercepto, version=None, metadatos=None):
+    """Guarda una nueva versión (inmutable). Devuelve el nombre de la versión."""
+    version = version or datetime.now().strftime("erc-%Y%m%d-%H%M%S")
+    ruta = _ruta_version(version)
+    if os.path.exists(ruta):
+        raise ValueError(f"La versión {version} ya existe")
+    ScorerLogistico(version, variables, coeficientes, intercepto)  # valida dimensiones
+    os.makedirs(DIR_MODELOS, exist_ok=True)
+    datos = {
+        "version": version,
+        "tipo": "logistica",
+        "variables": list(variables),
+        "coeficientes": [float(c) for c in coeficientes],
+        "intercepto": float(intercepto),
+        "creado": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "metadatos": metadatos or {},
+    }
+    try:
+        _escribir_json(ruta, datos, reemplazar=False)
+    except FileExistsError:
+        raise ValueError(f"La versión {version} ya existe") from None
+    return version
+
+def registrar_sklearn(modelo, version=None, metadatos=None):
+    """Extrae coeficientes de un LogisticRegression/SGDClassifier binario ya entrenado"""
+    return registrar(modelo.feature_names_in_, modelo.coef_[0], modelo.intercept_[0],
+                     version, {"origen": type(modelo).__name__, **(metadatos or {})})
+
+def cargar(version):
+    with open(_ruta_version(version), encoding="utf-8") as f:
+        m = json.load(f)
+    return ScorerLogistico(m["version"], m["variables"], m["coeficientes"], m["intercepto"],
+                           {"creado": m.get("creado"), **m.get("metadatos", {})})
+
+def versiones():
+    """Metadatos de todas las versiones registradas, la más reciente primero"""
+    if not os.path.isdir(DIR_MODELOS):
+        return []
+    salida = []
+    for nombre in os.listdir(DIR_MODELOS):
+        if nombre.endswith(".json") and nombre != os.path.basename(RUTA_ACTIVO):
+            with open(os.path.join(DIR_MODELOS, nombre), encoding="utf-8") as f:
+                m = json.load(f)
+            salida.append({"version": m["version"], "creado": m.get("creado"), **m.get("metadatos", {})})
+    return sorted(salida, key=lambda m: m.get("creado") or "", reverse=True)
+
+def version_activa():
+    if not os.path.exists(RUTA_ACTIVO):
+        return None
+    with open(RUTA_ACTIVO, encoding="utf-8") as f:
+        return json.load(f)["version"]
+
+def activar(version):
+    """Cambia la versión activa con un rename atómico del puntero"""
+    cargar(version)  # falla antes de tocar el puntero si la versión no es válida
+    os.makedirs(DIR_MODELOS, exist_ok=True)
+    _escribir_json(RUTA_ACTIVO, {"version": version,
+                                 "activado": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+
+def _inicializar():
+    """Primera ejecución: importa modelo_erc.joblib como versión inicial"""
+    import joblib
+    version = VERSION_INICIAL
+    if not os.path.exists(_ruta_version(version)):
+        try:
+            registrar_sklearn(joblib.load(RUTA_MODELO_INICIAL), version,
+                              {"fuente": os.path.basename(RUTA_MODELO_INICIAL)})
+        except ValueError:
+            # Otro proceso (p. ej. otro worker del pool) la registró primero
+            if not os.path.exists(_ruta_version(version)):
+                raise
+    activar(version)
+
+_activo = None
+_firma = None
+_ultimo_chequeo = 0.0
+_lock = threading.Lock()
+
+def modelo_activo():
+    """
+    Scorer de la versión activa. Revisa el puntero como mucho una vez por
+    segundo; si cambió, carga la nueva versión y la publica con una sola
+    asignación (las llamadas en curso terminan con la versión anterior).
+    """
+    global _activo, _firma, _ultimo_chequeo
+    if _activo is not None and time.monotonic() - _ultimo_chequeo < RECARGA_INTERVALO_S:
+        return _activo
+    with _lock:
+        if not os.path.exists(RUTA_ACTIVO):
+            _inicializar()
+        info = os.stat(RUTA_ACTIVO)
+        firma = (info.st_mtime_ns, info.st_size)
+        if firma != _firma:
+            _activo = cargar(version_activa())
+            _firma = firma
+        _ultimo_chequeo = time.monotonic()
+    return _activo
@@ -0,0 +1,121 @@
+"""
+Reportes PDF por lote: selecciona consultas por rango de fechas y médico,
+vuelve a evaluar el motor de recomendaciones y genera los PDF en un pool de
+procesos (fpdf2 es CPU-bound y no libera el GIL). Los PDF se escriben en un
+ZIP a medida que terminan, con memoria acotada a los bloques en vuelo. Las
+consultas se leen del espejo columnar si está al día (espejo.historial).
+
+Uso por línea de comandos:
+    python reportes_lote.py reportes.zip --desde 2026-09-01 --hasta 2026-09-30 [--doctor "..."] [--procesos 4]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import zipfile
+from database import AppDatabase, DB_PATH, SQL_AUDITORIA, evento_auditoria
+from espejo import historial
+from motor import crear_pdf, generar_plan_cientifico, motor_reglas
+from procesos import mapa_acotado, pool_spawn, procesos_por_defecto
+from registro_modelos import DIR_MODELOS
+
+BLOQUE = 32  # consultas por tarea: amortiza el envío entre procesos
+COLUMNAS = ["id", "px_name", "px_id", "date", "doctor", "sys", "tfg", "potasio", "fevi",
+            "sleep", "stress", "exercise"]
+
+def _nombre_archivo(d):
+    px_id = re.sub(r"[^\w.-]+", "_", str(d["px_id"]))
+    return f"{d['date']}_{px_id}_{d['id']}.pdf"
+
+def _renderizar(filas):
+    """Tarea del pool: [(columna -> valor), ...] -> [(nombre, pdf), ...]"""
+    salida = []
+    for d in filas:
+        recoms, alertas = generar_plan_cientifico(d)
+        salida.append((_nombre_archivo(d), crear_pdf(d, recoms, alertas, d["doctor"] or "", d["date"])))
+    return salida
+
+def contar(db, desde=None, hasta=None, doctor=None):
+    origen, condiciones, params = db.filtro_historial(None, desde, hasta, doctor)
+    where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    return db.consultar_uno(f"SELECT COUNT(*) FROM {origen}{where}", params)[0]
+
+def generar_zip(db, destino, desde=None, hasta=None, doctor=None, procesos=None, progreso=None,
+                usuario=None):
+    """
+    Escribe en `destino` (ruta o archivo binario) un ZIP con un PDF por
+    consulta. `progreso(hechos, total)` se llama al confirmar cada bloque.
+    Devuelve el número de reportes generados.
+    """
+    procesos = procesos_por_defecto(procesos)
+    total = contar(db, desde, hasta, doctor)
+    columnas, _, bloques = historial(db, None, desde, hasta, doctor, COLUMNAS, BLOQUE)
+    tareas = ([dict(zip(columnas, f)) for f in filas] for filas in bloques)
+    hechos = 0
+    with zipfile.ZipFile(destino, "w") as archivo, pool_spawn(procesos, motor_reglas) as pool:
+        for reportes in mapa_acotado(pool, _renderizar, tareas, procesos):
+            for nombre, pdf in reportes:
+                # Los PDF ya vienen comprimidos: se guardan sin volver a comprimir
+                archivo.writestr(nombre, pdf, compress_type=zipfile.ZIP_STORED)
+            hechos += len(reportes)
+            if progreso:
+                progreso(hechos, total)
+
+    if usuario:
+        filtros = f"{desde or '...'} a {hasta or '...'}" + (f" | Médico: {doctor}" if doctor else "")
+        with db.transaccion() as conn:
+            conn.execute(SQL_AUDITORIA, evento_auditoria(
+                usuario, "Reportes PDF por Lote", f"Periodo: {filtros} | Reportes: {hechos}"))
+    return hechos
+
+def generar_zip_subproceso(db, destino, desde=None, hasta=None, doctor=None, progreso=None, usuario=None):
+    """
+    generar_zip ejecutado como comando aparte. Desde Streamlit hace falta:
+    spawn vuelve a ejecutar el módulo __main__ en cada proceso del pool y bajo
+    Streamlit __main__ es app.py. Lanza ValueError si el comando falla.
+    """
+    comando = [sys.executable, os.path.abspath(__file__), os.path.abspath(destino), "--db", os.path.abspath(db.path),
+               "--progreso-lineas"]
+    for opcion, valor in (("--desde", desde), ("--hasta", hasta), ("--doctor", doctor), ("--usuario", usuario)):
+        if valor:
+            comando += [opcion, str(valor)]
+    # El comando corre en otro directorio: se le fija el mismo registro de modelos
+    proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env={**os.environ, "NEFROCARDIO_DIR_MODELOS": DIR_MODELOS})
+    hechos = 0
+    for linea in proceso.stdout:
+        m = re.fullmatch(r"(\d+)/(\d+)", linea.strip())
+        if m:
+            hechos = int(m[1])
+            if progreso:
+                progreso(hechos, int(m[2]))
+    error = proceso.stderr.read()
+    if proceso.wait() != 0:
+        detalle = error.strip().splitlines()[-1] if error.strip() else f"código {proceso.returncode}"
+        raise ValueError(f"La generación de reportes falló: {detalle}")
+    return hechos
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generación de reportes PDF por lote")
+    parser.add_argument("salida", help="Archivo ZIP de salida")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--desde", default=None)
+    parser.add_argument("--hasta", default=None)
+    parser.add_argument("--doctor", default=None)
+    parser.add_argument("--procesos", type=int, default=None)
+    parser.add_argument("--usuario", default=None, help="Usuario que figura en la auditoría")
+    parser.add_argument("--progreso-lineas", action="store_true", help="Solo 'hechos/total' por línea (para la app)")
+    args = parser.parse_args()
+
+    def mostrar(hechos, total):
+        if args.progreso_lineas:
+            print(f"{hechos}/{total}", flush=True)
+        else:
+            print(f"\r{hechos}/{total} reportes", end="", flush=True)
+
+    n = generar_zip(AppDatabase(args.db), args.salida, args.desde, args.hasta, args.doctor,
+                    args.procesos, mostrar, args.usuario)
+    if not args.progreso_lineas:
+        print(f"\n{n} reportes generados en {args.salida}")
@@ -0,0 +1,100 @@
+"""
+Puntaje de riesgo ERC con la versión activa del registro de modelos
+(registro_modelos.py). Incluye un backfill por lotes que recorre
+clinical_records en bloques, los puntúa en un pool de procesos y guarda los
+puntajes y la versión del modelo con un checkpoint reanudable.
+
+Uso por línea de comandos:
+    python riesgo.py [--lote 100000] [--procesos 4] [--reiniciar]
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from database import AppDatabase, DB_PATH
+from procesos import mapa_acotado, pool_spawn, procesos_por_defecto
+from registro_modelos import modelo_activo
+
+MARCA = "riesgo_backfill"
+LOTE = 100_000
+
+# Variable del modelo -> columna de clinical_records / clave del formulario
+VARIABLES = {
+    "edad": "edad",
+    "imc": "imc",
+    "presion_sistolica": "sys",
+    "glucosa_ayunas": "glucosa",
+    "creatinina": "creatinina",
+}
+
+def _matriz(df, modelo):
+    return np.column_stack([
+        pd.to_numeric(df[VARIABLES[variable]], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        for variable in modelo.variables
+    ])
+
+def puntuar_lote(df):
+    """
+    Probabilidad de ERC para cada fila de `df` (columnas de clinical_records)
+    con el modelo activo. Filas con alguna variable faltante quedan en NaN.
+    Devuelve (riesgos, versión del modelo).
+    """
+    modelo = modelo_activo()
+    return modelo.puntuar_matriz(_matriz(df, modelo)), modelo.version
+
+def puntuar(d):
+    """
+    Riesgo de una consulta (dict) -> (riesgo, versión del modelo).
+    riesgo es None si falta alguna variable del modelo.
+    """
+    modelo = modelo_activo()
+    valores = [d.get(VARIABLES[v]) for v in modelo.variables]
+    if any(x is None for x in valores):
+        return None, modelo.version
+    return modelo.puntuar_fila([float(x) for x in valores]), modelo.version
+
+def _puntuar_bloque(bloque):
+    ids, df = bloque
+    return (ids, *puntuar_lote(df))
+
+def _leer_bloques(db, desde_id, lote):
+    columnas = ", ".join(["id", *VARIABLES.values()])
+    ultimo = desde_id
+    while True:
+        df = db.leer_df(f"SELECT {columnas} FROM clinical_records WHERE id > ? ORDER BY id LIMIT ?",
+                        [ultimo, lote])
+        if df.empty:
+            return
+        ultimo = int(df["id"].iloc[-1])
+        yield df["id"].to_numpy(), df
+
+def backfill(db, lote=LOTE, procesos=None, reiniciar=False):
+    """
+    Calcula riesgo_erc para los registros posteriores al checkpoint
+    (todos, si `reiniciar`: p. ej. tras activar una nueva versión del modelo).
+    Los bloques se puntúan en paralelo pero se confirman en orden de id, cada
+    uno junto con el avance del checkpoint: si se interrumpe, la siguiente
+    ejecución continúa desde el último bloque confirmado. Devuelve las filas
+    procesadas.
+    """
+    procesos = procesos_por_defecto(procesos)
+    total = 0
+    with pool_spawn(procesos, modelo_activo) as pool:
+        desde = 0 if reiniciar else db.marca_agua(MARCA)
+        for ids, riesgo, version in mapa_acotado(pool, _puntuar_bloque, _leer_bloques(db, desde, lote), procesos):
+            valores = [(None, None) if np.isnan(r) else (float(r), version) for r in riesgo]
+            with db.transaccion() as conn:
+                conn.executemany("UPDATE clinical_records SET riesgo_erc = ?, riesgo_modelo = ? WHERE id = ?",
+                                 [(r, v, i) for (r, v), i in zip(valores, ids.tolist())])
+                db.fijar_marca_agua(conn, MARCA, int(ids[-1]))
+            total += len(ids)
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill del puntaje de riesgo ERC")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--lote", type=int, default=LOTE)
+    parser.add_argument("--procesos", type=int, default=None)
+    parser.add_argument("--reiniciar", action="store_true", help="Volver a puntuar desde el primer registro")
+    args = parser.parse_args()
+    n = backfill(AppDatabase(args.db), args.lote, args.procesos, args.reiniciar)
+    print(f"{n} registros puntuados")
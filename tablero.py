@@ -0,0 +1,109 @@
+"""
+Tablero poblacional para administradores: distribución de etapas KDIGO y
+categorías de FEVI, volumen y tasa de alertas por médico y tendencias
+mensuales. Todo se agrega en SQL (GROUP BY / CASE) sobre el rollup mensual
+clinical_rollup_mes y el resumen por paciente, nunca sobre las filas del
+historial, y cada resultado queda en la caché de consultas hasta la próxima
+escritura en clinical_records o clinical_alerts.
+
+La tasa de alertas cuenta consultas con al menos una alerta según el último
+barrido (alertas.py); las consultas aún no barridas cuentan como sin alerta.
+"""
+import pandas as pd
+from database import CATEGORIAS_FEVI, ETAPAS_KDIGO, condiciones_categorias
+
+ETIQUETAS = {
+    "g1": "G1 - Normal", "g2": "G2 - Leve ↓", "g3a": "G3a - Moderada ↓", "g3b": "G3b - Moderada-Severa ↓",
+    "g4": "G4 - Severa ↓", "g5": "G5 - Falla Renal",
+    "fevi_normal": "Normal", "fevi_limitrofe": "FE Limítrofe", "fevi_reducida": "IC con FE Reducida",
+}
+CATEGORIAS = {"tfg": ETAPAS_KDIGO, "fevi": CATEGORIAS_FEVI}
+# El rollup y el resumen por paciente solo cambian con estas tablas (triggers)
+TABLAS = ("clinical_records", "clinical_alerts")
+
+def _filtro(desde=None, hasta=None, medico=None):
+    """WHERE sobre el rollup; `desde`/`hasta` son fechas o 'YYYY-MM[-DD]' (se comparan por mes, inclusive)"""
+    condiciones, params = ["mes <> ''"], []
+    if desde:
+        condiciones.append("mes >= ?")
+        params.append(str(desde)[:7])
+    if hasta:
+        condiciones.append("mes <= ?")
+        params.append(str(hasta)[:7])
+    if medico:
+        condiciones.append("doctor = ?")
+        params.append(medico)
+    return " WHERE " + " AND ".join(condiciones), params
+
+def _porcentaje(parte, total):
+    return f"ROUND(100.0 * {parte} / NULLIF({total}, 0), 1)"
+
+def _distribucion(df, serie, columna):
+    """Una fila de totales por categoría -> (categoria, `columna`, porcentaje) en orden clínico"""
+    claves = [c for c, _ in CATEGORIAS[serie]]
+    fila = df.iloc[0] if not df.empty else pd.Series(0, index=claves)
+    salida = pd.DataFrame({"categoria": [ETIQUETAS[c] for c in claves],
+                           columna: [int(fila[c] or 0) for c in claves]})
+    total = salida[columna].sum()
+    salida["porcentaje"] = (100 * salida[columna] / total).round(1) if total else 0.0
+    return salida
+
+def distribucion_consultas(db, serie="tfg", desde=None, hasta=None, medico=None):
+    """Consultas del periodo por etapa KDIGO (serie 'tfg') o categoría de FEVI ('fevi')"""
+    if serie not in CATEGORIAS:
+        raise ValueError(f"Serie no soportada: {serie}")
+    where, params = _filtro(desde, hasta, medico)
+    columnas = ", ".join(f"SUM({c}) AS {c}" for c, _ in CATEGORIAS[serie])
+    df = db.leer_df(f"SELECT {columnas} FROM clinical_rollup_mes{where}", params, tablas=TABLAS)
+    return _distribucion(df, serie, "consultas")
+
+def distribucion_pacientes(db, serie="tfg"):
+    """
+    Pacientes por etapa (o categoría de FEVI) según el valor de su visita más
+    reciente: un conteo por rango sobre el índice de la serie en patient_summary.
+    """
+    if serie not in CATEGORIAS:
+        raise ValueError(f"Serie no soportada: {serie}")
+    condiciones = condiciones_categorias(serie, CATEGORIAS[serie])
+    columnas = ", ".join(f"(SELECT COUNT(*) FROM patient_summary WHERE {cond}) AS {c}"
+                         for c, cond in condiciones.items())
+    df = db.leer_df(f"SELECT {columnas}", tablas=TABLAS)
+    return _distribucion(df, serie, "pacientes")
+
+def _agregados():
+    return f"""SUM(consultas) AS consultas,
+        SUM(con_alerta) AS con_alerta,
+        {_porcentaje("SUM(con_alerta)", "SUM(consultas)")} AS tasa_alerta,
+        ROUND(SUM(tfg_suma) / NULLIF(SUM(tfg_n), 0), 1) AS tfg_media,
+        ROUND(SUM(fevi_suma) / NULLIF(SUM(fevi_n), 0), 1) AS fevi_media,
+        {_porcentaje("SUM(g4 + g5)", "SUM(tfg_n)")} AS pct_g4_g5,
+        {_porcentaje("SUM(fevi_reducida)", "SUM(fevi_n)")} AS pct_fevi_reducida"""
+
+def volumen_medicos(db, desde=None, hasta=None):
+    """Consultas, tasa de alertas y perfil de gravedad por médico en el periodo"""
+    where, params = _filtro(desde, hasta)
+    return db.leer_df(f"""SELECT NULLIF(doctor, '') AS doctor, {_agregados()}
+        FROM clinical_rollup_mes{where} GROUP BY doctor ORDER BY consultas DESC""", params, tablas=TABLAS)
+
+def tendencia_mensual(db, desde=None, hasta=None, medico=None):
+    """Una fila por mes con volumen, tasa de alertas, promedios y proporción de casos graves"""
+    where, params = _filtro(desde, hasta, medico)
+    return db.leer_df(f"SELECT mes, {_agregados()} FROM clinical_rollup_mes{where} GROUP BY mes ORDER BY mes",
+                      params, tablas=TABLAS)
+
+def medicos(db):
+    """Médicos con consultas registradas"""
+    df = db.leer_df("SELECT DISTINCT doctor FROM clinical_rollup_mes WHERE doctor <> '' ORDER BY doctor",
+                    tablas=TABLAS)
+    return df["doctor"].tolist()
+
+def tablero(db, desde=None, hasta=None, medico=None):
+    """Todas las vistas del tablero para el periodo y médico dados"""
+    return {
+        "kdigo_pacientes": distribucion_pacientes(db, "tfg"),
+        "fevi_pacientes": distribucion_pacientes(db, "fevi"),
+        "kdigo_consultas": distribucion_consultas(db, "tfg", desde, hasta, medico),
+        "fevi_consultas": distribucion_consultas(db, "fevi", desde, hasta, medico),
+        "medicos": volumen_medicos(db, desde, hasta),
+        "mensual": tendencia_mensual(db, desde, hasta, medico),
+    }
@@ -0,0 +1,6 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Costo mínimo de bcrypt: las pruebas verifican el flujo, no la resistencia del hash
+os.environ.setdefault("NEFROCARDIO_COSTO_BCRYPT", "4")
@@ -0,0 +1,52 @@
+import asyncio
+import base64
+from types import SimpleNamespace
+
+import bcrypt
+import pytest
+
+from api import Credenciales, ErrorHTTP, _usuario
+from autenticacion import autenticador
+from database import AppDatabase
+
+PASSWORD = "Clave-Prueba-1"
+
+@pytest.fixture
+def app(tmp_path):
+    db = AppDatabase(str(tmp_path / "api.db"))
+    hash_ = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(autenticador.costo)).decode()
+    with db.transaccion() as c:
+        c.execute("INSERT INTO users (username, password, name, role, specialty, active) VALUES (?, ?, ?, ?, ?, 1)",
+                  ("dra.prueba", hash_, "Dra. Prueba", "doctor", "Nefrología"))
+    yield SimpleNamespace(state=SimpleNamespace(db=db, credenciales=Credenciales()))
+    db.cerrar()
+
+def _peticion(app, usuario, password):
+    token = base64.b64encode(f"{usuario}:{password}".encode()).decode()
+    return SimpleNamespace(app=app, client=None, headers={"authorization": f"Basic {token}"})
+
+def _autenticar(app, usuario="dra.prueba", password=PASSWORD):
+    return asyncio.run(_usuario(_peticion(app, usuario, password)))
+
+def test_credenciales_en_cache_no_repiten_bcrypt(app, monkeypatch):
+    assert _autenticar(app) == ("dra.prueba", "Dra. Prueba", "doctor")
+    monkeypatch.setattr(autenticador, "verificar", lambda *a: pytest.fail("bcrypt con credenciales en caché"))
+    assert _autenticar(app) == ("dra.prueba", "Dra. Prueba", "doctor")
+
+def test_usuario_desactivado_pierde_acceso(app):
+    assert _autenticar(app)[0] == "dra.prueba"
+    with app.state.db.transaccion() as c:
+        c.execute("UPDATE users SET active=0 WHERE username=?", ("dra.prueba",))
+    with pytest.raises(ErrorHTTP) as e:
+        _autenticar(app)
+    assert e.value.estado == 401
+
+def test_cambio_de_contrasena_invalida_la_anterior(app):
+    assert _autenticar(app)[0] == "dra.prueba"
+    nuevo = bcrypt.hashpw(b"Otra-Clave-2", bcrypt.gensalt(autenticador.costo)).decode()
+    with app.state.db.transaccion() as c:
+        c.execute("UPDATE users SET password=? WHERE username=?", (nuevo, "dra.prueba"))
+    with pytest.raises(ErrorHTTP) as e:
+        _autenticar(app)
+    assert e.value.estado == 401
+    assert _autenticar(app, password="Otra-Clave-2")[0] == "dra.prueba"
@@ -0,0 +1,33 @@
+import time
+
+import bcrypt
+import pytest
+
+from autenticacion import COSTO_BCRYPT, Autenticador, costo_hash
+from database import AppDatabase
+
+@pytest.fixture
+def db(tmp_path):
+    db = AppDatabase(str(tmp_path / "auth.db"))
+    yield db
+    db.cerrar()
+
+def _password(db, usuario):
+    return db.consultar_uno("SELECT password FROM users WHERE username=?", (usuario,))[0]
+
+def test_costo_desde_el_entorno():
+    assert COSTO_BCRYPT == 4
+    assert costo_hash(Autenticador().hash("Clave-1")) == 4
+
+def test_login_regenera_hash_con_el_costo_configurado(db):
+    autenticador = Autenticador()
+    hash_ = bcrypt.hashpw(b"Clave-1", bcrypt.gensalt(5)).decode()
+    with db.transaccion() as c:
+        c.execute("INSERT INTO users (username, password, name, role, active) VALUES (?, ?, ?, ?, 1)",
+                  ("dr.costo", hash_, "Dr. Costo", "doctor"))
+    assert autenticador.verificar(db, "dr.costo", "Clave-1") == ("Dr. Costo", "doctor")
+    limite = time.monotonic() + 5
+    while costo_hash(_password(db, "dr.costo")) != 4 and time.monotonic() < limite:
+        time.sleep(0.05)
+    assert costo_hash(_password(db, "dr.costo")) == 4
+    assert autenticador.verificar(db, "dr.costo", "Clave-1") == ("Dr. Costo", "doctor")
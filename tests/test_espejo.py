@@ -0,0 +1,72 @@
+"""
+El historial leído del espejo debe ser el mismo, fila por fila y en el mismo
+orden, que el leído de SQLite; historial() solo usa el espejo si está al día.
+"""
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import espejo
+from database import AppDatabase
+from exportacion import bloques_historial
+
+MEDICOS = ["Dra. Ruiz", "Dr. Soto", None]
+
+def _fecha(rng):
+    if rng.random() < 0.1:
+        return rng.choice([None, ""])
+    return (date(2025, 11, 1) + timedelta(days=rng.randrange(120))).isoformat()
+
+def _consulta(rng):
+    return (f"001-{rng.randrange(40):07d}-0", f"Paciente {rng.randrange(40)}", _fecha(rng), rng.choice(MEDICOS),
+            None if rng.random() < 0.2 else round(rng.uniform(5, 120), 1), rng.randrange(90, 180))
+
+def _insertar(db, filas):
+    with db.transaccion() as conn:
+        conn.executemany("INSERT INTO clinical_records (px_id, px_name, date, doctor, tfg, sys) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", filas)
+
+def _filas(origen):
+    columnas, _, bloques = origen
+    return columnas, [tuple(f) for b in bloques for f in b]
+
+@pytest.fixture
+def db(tmp_path):
+    rng = random.Random(20261017)
+    db = AppDatabase(str(tmp_path / "espejo.db"))
+    _insertar(db, [_consulta(rng) for _ in range(400)])
+    espejo.sincronizar(db, lote=64)
+    yield db
+    db.cerrar()
+
+@pytest.mark.parametrize("desde, hasta, doctor", [
+    (None, None, None),
+    ("2025-12-15", "2026-01-31", None),
+    (None, "2025-12-31", "Dra. Ruiz"),
+])
+def test_historial_del_espejo_coincide_con_sqlite(db, desde, hasta, doctor):
+    sqlite = _filas(bloques_historial(db, None, desde, hasta, doctor, bloque=7))
+    assert _filas(espejo.bloques_historial(db, desde, hasta, doctor, bloque=7)) == sqlite
+
+def test_historial_usa_el_espejo_solo_si_esta_al_dia(db, monkeypatch):
+    leidos = []
+    original = espejo.bloques_historial
+    monkeypatch.setattr(espejo, "bloques_historial", lambda *a, **k: leidos.append(1) or original(*a, **k))
+
+    assert espejo.al_dia(db)
+    espejo.historial(db)
+    espejo.historial(db, "Paciente")  # búsqueda por texto: siempre SQLite
+    assert leidos == [1]
+
+    with db.transaccion() as conn:
+        conn.execute("UPDATE clinical_records SET tfg = -1 WHERE id = 5")
+    assert not espejo.al_dia(db)
+    _, filas = _filas(espejo.historial(db, columnas=["id", "tfg"]))
+    assert (5, -1) in filas and leidos == [1]
+
+    _insertar(db, [("n1", "Nuevo", "2026-03-01", None, 10.0, 120)])
+    espejo.sincronizar(db)
+    assert espejo.al_dia(db)
+    assert _filas(espejo.historial(db)) == _filas(bloques_historial(db))
+    assert leidos == [1, 1]
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from database import AppDatabase
+from laboratorio import _recursos, ingerir, observaciones
+
+VALIDA = {"resourceType": "Observation", "subject": {"reference": "Patient/001-1"},
+          "effectiveDateTime": "2024-03-01T08:00:00Z",
+          "code": {"coding": [{"system": "http://loinc.org", "code": "2823-3"}]},
+          "valueQuantity": {"value": 5.8, "unit": "mmol/L"}}
+
+INVALIDAS = [
+    [1, 2],
+    "x",
+    {"resourceType": "Bundle", "entry": [None, 3, {"resource": "y"}]},
+    {**VALIDA, "subject": "Patient/1"},
+    {**VALIDA, "code": {"coding": ["x"]}},
+    {**VALIDA, "code": "2823-3"},
+    {**VALIDA, "valueQuantity": 5},
+    {**VALIDA, "effectivePeriod": "2024-03-01"},
+    {"px_id": "001-1", "date": "2024-03-01", "codigo": ["potasio"], "valor": 5.8},
+]
+
+def _normalizar(recursos):
+    descartes = []
+    lineas = [(n, json.dumps(r)) for n, r in enumerate(recursos, start=1)]
+    descartar = lambda n, motivo, original: descartes.append((n, motivo))
+    return list(observaciones(_recursos(lineas, descartar), descartar)), descartes
+
+@pytest.mark.parametrize("recurso", INVALIDAS, ids=range(len(INVALIDAS)))
+def test_estructura_inesperada_se_descarta(recurso):
+    validas, descartes = _normalizar([recurso])
+    assert validas == []
+    assert descartes and all(n == 1 for n, _ in descartes)
+
+def test_ingesta_continua_tras_lineas_invalidas(tmp_path):
+    db = AppDatabase(str(tmp_path / "lab.db"))
+    with db.transaccion() as conn:
+        conn.execute("INSERT INTO clinical_records (px_id, px_name, date) VALUES ('001-1', 'Ana', '2024-03-01')")
+    ruta = tmp_path / "resultados.ndjson"
+    ruta.write_text("\n".join(json.dumps(r) for r in [*INVALIDAS, VALIDA]) + "\n", encoding="utf-8")
+    resumen = ingerir(db, str(ruta), "admin")
+    assert resumen["aplicadas"] == 1
+    assert db.consultar_uno("SELECT potasio FROM clinical_records")[0] == pytest.approx(5.8)
+    db.cerrar()
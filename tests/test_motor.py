@@ -0,0 +1,133 @@
+import itertools
+import json
+import random
+
+import pandas as pd
+import pytest
+
+from alertas import evaluar_alertas_lote
+from motor import RUTA_REGLAS, MotorReglas, clave_pdf, generar_plan_cientifico, pdf_reporte
+
+CONSULTA = {"px_name": "Ana Gil", "px_id": "001-1", "tfg": 50.0, "potasio": 4.5, "fevi": 55.0, "sleep": 7.0,
+            "stress": "Bajo", "sys": 120, "exercise": 150}
+
+def test_pdf_en_cache_por_fecha_de_consulta():
+    recoms, alertas = generar_plan_cientifico(CONSULTA)
+    primero = pdf_reporte(CONSULTA, recoms, alertas, "Ruiz", "2026-10-15")
+    assert pdf_reporte(CONSULTA, recoms, alertas, "Ruiz", "2026-10-15") is primero
+    assert clave_pdf(CONSULTA, recoms, alertas, "Ruiz", "2026-10-15") != \
+        clave_pdf(CONSULTA, recoms, alertas, "Ruiz", "2026-10-16")
+    assert pdf_reporte(CONSULTA, recoms, alertas, "Ruiz", "2026-10-16") is not primero
+
+def _referencia(d):
+    """Cadena if/elif anterior a la tabla de reglas (valores None = faltantes, como en el motor)"""
+    d = {k: v for k, v in d.items() if v is not None}
+    recom = {"dieta": [], "estilo": [], "clinico": [], "seguimiento": []}
+    alertas = []
+
+    tfg = d.get('tfg', 90)
+    if tfg < 30:
+        recom['clinico'].append("⚠️ ERC G4-G5: Derivar a nefrología. Considerar preparación para terapia de reemplazo renal.")
+        alertas.append("CRÍTICO: TFG <30 ml/min")
+    elif tfg < 60:
+        recom['clinico'].append("ERC G3: Iniciar/optimizar IECA o ARA-II + SGLT2i (ej: empagliflozina 10mg/día) según KDIGO.")
+        recom['seguimiento'].append("Control de TFG cada 3 meses")
+    elif tfg < 90:
+        recom['seguimiento'].append("Monitoreo anual de función renal")
+
+    potasio = d.get('potasio', 4.0)
+    if potasio > 5.5:
+        recom['dieta'].append("🔴 HIPERPOTASEMIA: Dieta estricta baja en K+ (<2g/día). Evitar: plátanos, naranjas, tomates, aguacate, frijoles.")
+        recom['clinico'].append("Considerar quelante de potasio (patiromer o ciclosilicato de zirconio sódico)")
+        alertas.append("URGENTE: K+ >5.5 mEq/L")
+    elif potasio > 5.2:
+        recom['dieta'].append("Restricción moderada de potasio. Limitar cítricos y vegetales crudos.")
+    elif potasio < 3.5:
+        recom['dieta'].append("Aumentar ingesta de potasio: plátanos, espinacas, batatas.")
+        alertas.append("Hipopotasemia detectada")
+
+    fevi = d.get('fevi', 55)
+    if fevi < 40:
+        recom['clinico'].append("🫀 IC-FEr: Terapia cuádruple GDMT: ARNI (sacubitrilo/valsartán) + betabloqueador + ARM + SGLT2i")
+        recom['seguimiento'].append("Ecocardiograma cada 3-6 meses")
+        alertas.append("Insuficiencia Cardíaca con FEr <40%")
+    elif fevi < 50:
+        recom['clinico'].append("FE limítrofe: Optimizar control de presión arterial y manejo de volumen")
+        recom['seguimiento'].append("Ecocardiograma anual")
+
+    sys = d.get('sys', 120)
+    if sys >= 140:
+        recom['clinico'].append("HTA: Meta <130/80 mmHg en ERC. IECA/ARA-II como primera línea.")
+        recom['dieta'].append("Dieta DASH: <2g sodio/día, rica en frutas y vegetales (ajustar K+ si ERC avanzada)")
+    elif sys < 100:
+        alertas.append("Hipotensión: Revisar medicación antihipertensiva")
+
+    sleep = d.get('sleep', 7)
+    if sleep < 6:
+        recom['estilo'].append("⚠️ Sueño insuficiente (<6h): Aumenta riesgo CV 20-30%. Meta: 7-8 horas/noche.")
+        recom['estilo'].append("Higiene del sueño: Horario regular, evitar pantallas 1h antes de dormir, ambiente oscuro.")
+    elif sleep > 9:
+        recom['estilo'].append("Sueño excesivo (>9h): Evaluar causas subyacentes (depresión, apnea del sueño)")
+
+    stress = d.get('stress', 'Bajo')
+    if stress == "Alto":
+        recom['estilo'].append("Estrés elevado aumenta activación simpática y eje RAA. Técnicas recomendadas:")
+        recom['estilo'].append("• Mindfulness/meditación 10-20 min/día (reduce PA sistólica 4-5 mmHg)")
+        recom['estilo'].append("• Ejercicio aeróbico moderado 150 min/semana")
+        recom['estilo'].append("• Considerar apoyo psicológico si persiste")
+
+    exercise = d.get('exercise', 0)
+    if exercise < 150:
+        recom['estilo'].append(f"Actividad física actual: {exercise} min/sem. Meta AHA: ≥150 min ejercicio moderado.")
+        recom['estilo'].append("Iniciar gradualmente: Caminata 30 min 5 días/semana, aumentar progresivamente.")
+
+    return recom, alertas
+
+# Valores en cada límite y a ambos lados; None = faltante
+LIMITES = {
+    "tfg": [None, 0, 15, 29.99, 30, 30.01, 59.99, 60, 60.01, 89.99, 90, 90.01, 150],
+    "potasio": [None, 2.0, 3.49, 3.5, 3.51, 5.19, 5.2, 5.21, 5.49, 5.5, 5.51, 8.0],
+    "fevi": [None, 5, 39.99, 40, 40.01, 49.99, 50, 50.01, 80],
+    "sys": [None, 80, 99, 99.99, 100, 100.01, 139, 139.99, 140, 140.01, 220],
+    "sleep": [None, 3, 5.99, 6, 6.01, 8.99, 9, 9.01, 12],
+    "stress": [None, "Bajo", "Moderado", "Alto"],
+    "exercise": [None, 0, 149, 150, 151, 500],
+}
+BASE = {"tfg": 95, "potasio": 4.5, "fevi": 60, "sys": 120, "sleep": 7.5, "stress": "Bajo", "exercise": 200}
+
+def _consulta(**valores):
+    return {k: v for k, v in {**BASE, **valores}.items() if v is not None}
+
+@pytest.mark.parametrize("parametro", list(LIMITES))
+def test_motor_igual_a_la_cadena_anterior_en_cada_limite(parametro):
+    for valor in LIMITES[parametro]:
+        d = _consulta(**{parametro: valor})
+        assert generar_plan_cientifico(d) == _referencia(d), (parametro, valor)
+
+def test_motor_igual_a_la_cadena_anterior_en_pares_de_limites():
+    for a, b in itertools.combinations(LIMITES, 2):
+        for va, vb in itertools.product(LIMITES[a], LIMITES[b]):
+            d = _consulta(**{a: va, b: vb})
+            assert generar_plan_cientifico(d) == _referencia(d), d
+
+def test_motor_igual_a_la_cadena_anterior_en_combinaciones_al_azar():
+    rng = random.Random(2024)
+    for _ in range(5_000):
+        d = {p: rng.choice(valores) for p, valores in LIMITES.items() if rng.random() < 0.85}
+        assert generar_plan_cientifico(d) == _referencia(d), d
+
+def test_barrido_sin_reglas_de_alerta():
+    with open(RUTA_REGLAS, encoding="utf-8") as f:
+        tabla = json.load(f)
+    tabla["reglas"] = [r for r in tabla["reglas"] if "alerta" not in r]
+    resultado = evaluar_alertas_lote(pd.DataFrame([BASE, {**BASE, "tfg": 10}]), MotorReglas(tabla))
+    assert resultado.empty
+    assert list(resultado.columns) == ["fila", "codigo", "alerta", "valor"]
+
+def test_barrido_vectorizado_igual_a_las_alertas_fila_por_fila():
+    rng = random.Random(7)
+    consultas = [{p: rng.choice(valores) for p, valores in LIMITES.items()} for _ in range(2_000)]
+    resultado = evaluar_alertas_lote(pd.DataFrame(consultas))
+    por_fila = resultado.groupby("fila")["alerta"].apply(list).to_dict()
+    for i, d in enumerate(consultas):
+        assert por_fila.get(i, []) == generar_plan_cientifico(d)[1], d
@@ -0,0 +1,190 @@
+"""
+Las tablas que mantienen los triggers de clinical_records deben coincidir con
+lo que se obtiene recalculando desde cero después de INSERT, UPDATE y DELETE.
+"""
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from database import CATEGORIAS_FEVI, EPOCA_JULIANA, ETAPAS_KDIGO, AppDatabase
+
+PACIENTES = [f"001-000000{i}-0" for i in range(6)]
+MEDICOS = ["Dra. Ruiz", "Dr. Soto", None]
+
+def _fecha(rng):
+    if rng.random() < 0.05:
+        return None
+    return (date(2024, 1, 1) + timedelta(days=rng.randrange(500))).isoformat()
+
+def _valor(rng, minimo, maximo):
+    return None if rng.random() < 0.15 else round(rng.uniform(minimo, maximo), 1)
+
+def _consulta(rng):
+    px_id = rng.choice(PACIENTES)
+    return {"px_id": px_id, "px_name": f"Paciente {px_id[-3]}", "date": _fecha(rng), "doctor": rng.choice(MEDICOS),
+            "tfg": _valor(rng, 5, 120), "fevi": _valor(rng, 15, 70), "potasio": _valor(rng, 3, 6),
+            "sys": rng.randrange(90, 180)}
+
+def _insertar(conn, fila):
+    columnas = ", ".join(fila)
+    return conn.execute(f"INSERT INTO clinical_records ({columnas}) VALUES ({', '.join('?' * len(fila))})",
+                        list(fila.values())).lastrowid
+
+def _alertar(conn, record_id, codigo):
+    conn.execute("""INSERT OR IGNORE INTO clinical_alerts
+        (record_id, px_id, px_name, date, doctor, codigo, alerta, detectada)
+        SELECT id, px_id, px_name, date, doctor, ?, 'prueba', '2026-01-01' FROM clinical_records WHERE id = ?""",
+                 (codigo, record_id))
+
+def _tabla(db, tabla):
+    """Filas de `tabla` como dicts (sin pasar por pandas: NULL sigue siendo None)"""
+    columnas = [f[1] for f in db.consultar(f"PRAGMA table_xinfo({tabla})")]
+    return [dict(zip(columnas, f)) for f in db.consultar(f"SELECT {', '.join(columnas)} FROM {tabla}")]
+
+def _filas(db):
+    return {f["id"]: f for f in _tabla(db, "clinical_records")}
+
+def _particion(fila):
+    return fila["date"][:7] if fila["date"] else "sin_fecha"
+
+@pytest.fixture
+def historial(tmp_path):
+    """
+    Base con historial, alertas y una ronda de cambios mezclados. Devuelve
+    (db, particiones que el espejo debe tener pendientes -> menor id afectado).
+    """
+    rng = random.Random(20261016)
+    db = AppDatabase(str(tmp_path / "triggers.db"))
+    with db.transaccion() as conn:
+        ids = [_insertar(conn, _consulta(rng)) for _ in range(120)]
+        for record_id in rng.sample(ids, 30):
+            for codigo in rng.sample(["K_ALTO", "TFG_BAJA", "FEVI_BAJA"], rng.randint(1, 2)):
+                _alertar(conn, record_id, codigo)
+        conn.execute("DELETE FROM espejo_pendientes")
+
+    pendientes = {}
+
+    def marcar(fila):
+        particion = _particion(fila)
+        pendientes[particion] = min(pendientes.get(particion, fila["id"]), fila["id"])
+
+    cambios = [
+        lambda: {"tfg": _valor(rng, 5, 120)},
+        lambda: {"fevi": _valor(rng, 15, 70)},
+        lambda: {"date": _fecha(rng)},
+        lambda: {"doctor": rng.choice(MEDICOS)},
+        lambda: {"px_id": rng.choice(PACIENTES)},
+        lambda: {"potasio": _valor(rng, 3, 6), "sys": rng.randrange(90, 180)},
+        lambda: {},  # se reescriben los mismos valores
+    ]
+    for _ in range(80):
+        antes = _filas(db)
+        record_id = rng.choice(sorted(antes))
+        operacion = rng.random()
+        with db.transaccion() as conn:
+            if operacion < 0.6:
+                valores = rng.choice(cambios)() or {"tfg": antes[record_id]["tfg"], "riesgo_erc": None}
+                asignaciones = ", ".join(f"{c} = ?" for c in valores)
+                conn.execute(f"UPDATE clinical_records SET {asignaciones} WHERE id = ?", [*valores.values(), record_id])
+            elif operacion < 0.75:
+                conn.execute("DELETE FROM clinical_alerts WHERE record_id = ?", (record_id,))
+                conn.execute("DELETE FROM clinical_records WHERE id = ?", (record_id,))
+            elif operacion < 0.9:
+                _alertar(conn, _insertar(conn, _consulta(rng)), "K_ALTO")
+            else:
+                conn.execute("DELETE FROM clinical_alerts WHERE id IN (SELECT id FROM clinical_alerts "
+                             "WHERE record_id = ? LIMIT 1)", (record_id,))
+        despues = _filas(db)
+        if record_id in antes and antes[record_id] != despues.get(record_id):
+            marcar(antes[record_id])
+            if record_id in despues:
+                marcar(despues[record_id])
+    yield db, pendientes
+    db.cerrar()
+
+def _x(fecha):
+    """Años desde la época de los triggers, como (julianday(date) - EPOCA_JULIANA) / 365.25"""
+    return (date.fromisoformat(fecha).toordinal() - date(2000, 1, 1).toordinal() + 2451544.5 - EPOCA_JULIANA) / 365.25
+
+def test_resumen_por_paciente_coincide_con_el_historial(historial):
+    db, _ = historial
+    resumen = {f["px_id"]: f for f in _tabla(db, "patient_summary")}
+    por_paciente = {}
+    for fila in _filas(db).values():
+        por_paciente.setdefault(fila["px_id"], []).append(fila)
+
+    assert set(resumen) == set(por_paciente)
+    for px_id, visitas in por_paciente.items():
+        r = resumen[px_id]
+        assert r["visitas"] == len(visitas)
+        fechas = [v["date"] for v in visitas if v["date"]]
+        assert r["primera"] == (min(fechas) if fechas else None)
+        # ORDER BY date DESC, id DESC: las fechas NULL quedan al final
+        ultima = max(visitas, key=lambda v: (v["date"] is not None, v["date"] or "", v["id"]))
+        assert r["ultimo_id"] == ultima["id"]
+        for columna in ("px_name", "tfg", "fevi", "potasio", "sys"):
+            assert r[columna] == ultima[columna]
+        for serie in ("tfg", "fevi"):
+            puntos = [(_x(v["date"]), v[serie]) for v in visitas if v["date"] and v[serie] is not None]
+            assert r[f"n_{serie}"] == len(puntos)
+            xs = np.array([p[0] for p in puntos])
+            if len(puntos) >= 2 and np.ptp(xs) > 0:
+                esperada = np.polyfit(xs, [p[1] for p in puntos], 1)[0]
+                assert r[f"pendiente_{serie}"] == pytest.approx(esperada, rel=1e-6, abs=1e-6)
+            else:
+                assert r[f"pendiente_{serie}"] is None
+
+def _categoria(valor, categorias):
+    for columna, inferior in categorias:
+        if inferior is None or valor >= inferior:
+            return columna
+
+def test_rollup_mensual_coincide_con_el_historial(historial):
+    db, _ = historial
+    esperado = {}
+
+    def fila(mes, doctor):
+        return esperado.setdefault((mes or "", doctor or ""), {})
+
+    def sumar(destino, columna, valor=1):
+        destino[columna] = destino.get(columna, 0) + valor
+
+    for r in _filas(db).values():
+        destino = fila(r["date"] and r["date"][:7], r["doctor"])
+        sumar(destino, "consultas")
+        for serie, categorias in (("tfg", ETAPAS_KDIGO), ("fevi", CATEGORIAS_FEVI)):
+            if r[serie] is not None:
+                sumar(destino, f"{serie}_n")
+                sumar(destino, f"{serie}_suma", r[serie])
+                sumar(destino, _categoria(r[serie], categorias))
+    # Consultas con alguna alerta, con el mes y médico que tenían al barrerse
+    for record_id, mes, doctor in db.consultar("""SELECT record_id, substr(MIN(date), 1, 7), MIN(doctor)
+            FROM clinical_alerts GROUP BY record_id"""):
+        sumar(fila(mes, doctor), "con_alerta")
+
+    columnas = ["consultas", "tfg_n", "tfg_suma", *(c for c, _ in ETAPAS_KDIGO),
+                "fevi_n", "fevi_suma", *(c for c, _ in CATEGORIAS_FEVI), "con_alerta"]
+    rollup = {(f["mes"], f["doctor"]): f for f in _tabla(db, "clinical_rollup_mes")}
+    assert set(rollup) == set(esperado)
+    for clave, valores in esperado.items():
+        for columna in columnas:
+            assert rollup[clave][columna] == pytest.approx(valores.get(columna, 0)), (clave, columna)
+
+def test_espejo_pendientes_solo_particiones_con_cambios(historial):
+    db, pendientes = historial
+    assert dict(db.consultar("SELECT particion, id_min FROM espejo_pendientes")) == pendientes
+
+def test_espejo_ignora_actualizaciones_sin_cambios(historial):
+    db, _ = historial
+    with db.transaccion() as conn:
+        conn.execute("DELETE FROM espejo_pendientes")
+        conn.execute("UPDATE clinical_records SET riesgo_erc = riesgo_erc, tfg = tfg")
+    assert db.consultar("SELECT * FROM espejo_pendientes") == []
+
+def test_espejo_trigger_cubre_todas_las_columnas(historial):
+    db, _ = historial
+    sql = db.consultar_uno("SELECT sql FROM sqlite_master WHERE name = 'clinical_records_espejo_au'")[0]
+    columnas = [fila[1] for fila in db.consultar("PRAGMA table_xinfo(clinical_records)")]
+    assert [col for col in columnas if f"old.{col} IS NOT new.{col}" not in sql] == []